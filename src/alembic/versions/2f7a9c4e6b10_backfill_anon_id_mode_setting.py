@@ -0,0 +1,45 @@
+"""backfill anon_id_mode setting for existing guilds
+
+Revision ID: 2f7a9c4e6b10
+Revises: 8e4d2b6f1a53
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2f7a9c4e6b10'
+down_revision: Union[str, Sequence[str], None] = '8e4d2b6f1a53'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+guild_settings = sa.table(
+    'guild_settings',
+    sa.column('guild_id', sa.String),
+    sa.column('settings', sa.JSON),
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # anon_id_mode 導入前からあるギルドは、従来どおりマッピングテーブルで匿名IDを割り当てる
+    bind = op.get_bind()
+    rows = bind.execute(sa.select(guild_settings.c.guild_id, guild_settings.c.settings)).all()
+    for guild_id, settings in rows:
+        if settings is None or 'anon_id_mode' in settings:
+            continue
+        bind.execute(
+            guild_settings.update()
+            .where(guild_settings.c.guild_id == guild_id)
+            .values(settings={**settings, 'anon_id_mode': 'table'})
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # 追加したキーは古いコードでは参照されないため、そのまま残す
+    pass
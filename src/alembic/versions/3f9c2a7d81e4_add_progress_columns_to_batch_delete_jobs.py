@@ -0,0 +1,36 @@
+"""add progress columns to batch_delete_jobs
+
+Revision ID: 3f9c2a7d81e4
+Revises: b6719d4521a4
+Create Date: 2026-10-19 02:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9c2a7d81e4'
+down_revision: Union[str, Sequence[str], None] = 'b6719d4521a4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('batch_delete_jobs', sa.Column('total_count', sa.BigInteger(), nullable=True))
+    op.add_column('batch_delete_jobs', sa.Column('processed_count', sa.BigInteger(), server_default='0', nullable=False))
+    op.add_column('batch_delete_jobs', sa.Column('last_post_id', sa.BigInteger(), nullable=True))
+    op.add_column('batch_delete_jobs', sa.Column('purged_post_id', sa.BigInteger(), nullable=True))
+    op.create_index('idx_batch_delete_jobs_status', 'batch_delete_jobs', ['status'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('idx_batch_delete_jobs_status', table_name='batch_delete_jobs')
+    op.drop_column('batch_delete_jobs', 'purged_post_id')
+    op.drop_column('batch_delete_jobs', 'last_post_id')
+    op.drop_column('batch_delete_jobs', 'processed_count')
+    op.drop_column('batch_delete_jobs', 'total_count')
@@ -0,0 +1,39 @@
+"""add conversion_prompts table
+
+Revision ID: 5b8e0d3a7c19
+Revises: e93b7c25fa60
+Create Date: 2026-10-19 05:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b8e0d3a7c19'
+down_revision: Union[str, Sequence[str], None] = 'e93b7c25fa60'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('conversion_prompts',
+    sa.Column('prompt_message_id', sa.String(length=64), nullable=False),
+    sa.Column('guild_id', sa.String(length=30), nullable=False),
+    sa.Column('channel_id', sa.String(length=30), nullable=False),
+    sa.Column('original_message_id', sa.String(length=64), nullable=False),
+    sa.Column('user_id_signature', sa.String(length=128), nullable=False),
+    sa.Column('is_thread', sa.Boolean(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('prompt_message_id')
+    )
+    op.create_index('idx_conversion_prompts_expires_at', 'conversion_prompts', ['expires_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('idx_conversion_prompts_expires_at', table_name='conversion_prompts')
+    op.drop_table('conversion_prompts')
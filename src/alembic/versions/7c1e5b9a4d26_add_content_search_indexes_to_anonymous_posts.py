@@ -0,0 +1,49 @@
+"""add content search indexes to anonymous_posts
+
+Revision ID: 7c1e5b9a4d26
+Revises: 3f9c2a7d81e4
+Create Date: 2026-10-19 02:40:00.000000
+
+"""
+import os
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c1e5b9a4d26'
+down_revision: Union[str, Sequence[str], None] = '3f9c2a7d81e4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# 日本語を扱えるテキスト検索設定 (textsearch_ja などで追加した 'japanese' など) を指定すると
+# tsvector の式インデックスも作成する
+POST_SEARCH_TS_CONFIG = os.getenv("POST_SEARCH_TS_CONFIG")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('idx_anonymous_posts_guild_created', 'anonymous_posts', ['guild_id', 'created_at'], unique=False)
+    # pg_trgm・tsvector の索引はPostgreSQLでのみ作成する (SQLiteでは検索は全件走査になる)
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.create_index('idx_anonymous_posts_content_trgm', 'anonymous_posts', ['content'], unique=False, postgresql_using='gin', postgresql_ops={'content': 'gin_trgm_ops'})
+    if POST_SEARCH_TS_CONFIG:
+        op.create_index(
+            'idx_anonymous_posts_content_tsv',
+            'anonymous_posts',
+            [sa.text(f"to_tsvector('{POST_SEARCH_TS_CONFIG}'::regconfig, content)")],
+            unique=False,
+            postgresql_using='gin'
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS idx_anonymous_posts_content_tsv")
+        op.drop_index('idx_anonymous_posts_content_trgm', table_name='anonymous_posts', postgresql_using='gin', postgresql_ops={'content': 'gin_trgm_ops'})
+    op.drop_index('idx_anonymous_posts_guild_created', table_name='anonymous_posts')
@@ -0,0 +1,58 @@
+"""add boards table
+
+Revision ID: 8e4d2b6f1a53
+Revises: 5b8e0d3a7c19
+Create Date: 2026-10-19 09:40:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8e4d2b6f1a53'
+down_revision: Union[str, Sequence[str], None] = '5b8e0d3a7c19'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('boards',
+    sa.Column('id', sa.BigInteger(), nullable=False),
+    sa.Column('guild_id', sa.String(length=30), nullable=False),
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.Column('thread_count', sa.Integer(), nullable=False),
+    sa.Column('last_activity_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('guild_id', 'name', name='uq_boards_guild_name')
+    )
+    op.create_index('idx_boards_guild_last_activity', 'boards', ['guild_id', 'last_activity_at', 'id'], unique=False)
+
+    op.add_column('anonymous_threads', sa.Column('deleted_at', sa.DateTime(timezone=True), nullable=True))
+    op.drop_index('idx_threads_guild_board', table_name='anonymous_threads')
+    op.create_index('idx_threads_guild_board_created', 'anonymous_threads', ['guild_id', 'board', 'created_at', 'id'], unique=False)
+    op.create_index('idx_threads_thread_discord_id', 'anonymous_threads', ['thread_discord_id'], unique=False)
+
+    # 既存のスレッドからボード一覧を作る
+    op.execute(
+        """
+        INSERT INTO boards (guild_id, name, thread_count, last_activity_at, created_at)
+        SELECT guild_id, board, COUNT(*), MAX(created_at), MIN(created_at)
+        FROM anonymous_threads
+        GROUP BY guild_id, board
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('idx_threads_thread_discord_id', table_name='anonymous_threads')
+    op.drop_index('idx_threads_guild_board_created', table_name='anonymous_threads')
+    op.create_index('idx_threads_guild_board', 'anonymous_threads', ['guild_id', 'board'], unique=False)
+    op.drop_column('anonymous_threads', 'deleted_at')
+    op.drop_index('idx_boards_guild_last_activity', table_name='boards')
+    op.drop_table('boards')
@@ -0,0 +1,62 @@
+"""add default partition to bot_logs
+
+Revision ID: a3c81f5e9d27
+Revises: 2f7a9c4e6b10
+Create Date: 2026-10-19 11:30:00.000000
+
+"""
+import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3c81f5e9d27'
+down_revision: Union[str, Sequence[str], None] = '2f7a9c4e6b10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# utils.partitions.PARTITION_MONTHS_AHEAD と合わせる
+MONTHS_AHEAD = 3
+
+
+def _next_month(value: datetime.date) -> datetime.date:
+    return datetime.date(value.year + (value.month == 12), value.month % 12 + 1, 1)
+
+
+def _is_partitioned(bind) -> bool:
+    if bind.dialect.name != 'postgresql':
+        return False
+    relkind = bind.execute(sa.text("SELECT relkind FROM pg_class WHERE relname = 'bot_logs' AND relnamespace = 'public'::regnamespace")).scalar()
+    return relkind == 'p'
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    if not _is_partitioned(bind):
+        return
+
+    # 前回のマイグレーションから時間が経っている場合に備え、今月から先のパーティションを作成する
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    month = datetime.date(today.year, today.month, 1)
+    for _ in range(MONTHS_AHEAD + 1):
+        op.execute(
+            f"CREATE TABLE IF NOT EXISTS bot_logs_p{month:%Y%m} PARTITION OF bot_logs "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d} 00:00:00+00') TO ('{_next_month(month):%Y-%m-%d} 00:00:00+00')"
+        )
+        month = _next_month(month)
+
+    # どの月のパーティションにも当てはまらない行の受け皿
+    op.execute("CREATE TABLE IF NOT EXISTS bot_logs_default PARTITION OF bot_logs DEFAULT")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    bind = op.get_bind()
+    if not _is_partitioned(bind):
+        return
+    op.execute("ALTER TABLE bot_logs DETACH PARTITION bot_logs_default")
+    op.execute("DROP TABLE bot_logs_default")
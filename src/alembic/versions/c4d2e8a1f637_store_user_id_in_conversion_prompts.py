@@ -0,0 +1,33 @@
+"""store user_id instead of user_id_signature in conversion_prompts
+
+Revision ID: c4d2e8a1f637
+Revises: a3c81f5e9d27
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4d2e8a1f637'
+down_revision: Union[str, Sequence[str], None] = 'a3c81f5e9d27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 署名からユーザーIDは復元できないため、表示中の確認メッセージは破棄する (期限は数十秒)
+    op.execute("DELETE FROM conversion_prompts")
+    op.drop_column('conversion_prompts', 'user_id_signature')
+    op.add_column('conversion_prompts', sa.Column('user_id', sa.String(length=30), nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DELETE FROM conversion_prompts")
+    op.drop_column('conversion_prompts', 'user_id')
+    op.add_column('conversion_prompts', sa.Column('user_id_signature', sa.String(length=128), nullable=False))
@@ -0,0 +1,29 @@
+"""add (level, created_at) index to bot_logs
+
+Revision ID: d48a6f3c0b17
+Revises: 7c1e5b9a4d26
+Create Date: 2026-10-19 03:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd48a6f3c0b17'
+down_revision: Union[str, Sequence[str], None] = '7c1e5b9a4d26'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('idx_bot_logs_level_created_at', 'bot_logs', ['level', 'created_at'], unique=False)
+    op.drop_index('idx_bot_logs_level', table_name='bot_logs')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_index('idx_bot_logs_level', 'bot_logs', ['level'], unique=False)
+    op.drop_index('idx_bot_logs_level_created_at', table_name='bot_logs')
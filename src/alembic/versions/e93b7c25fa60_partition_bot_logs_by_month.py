@@ -0,0 +1,106 @@
+"""partition bot_logs by month
+
+Revision ID: e93b7c25fa60
+Revises: d48a6f3c0b17
+Create Date: 2026-10-19 03:50:00.000000
+
+"""
+import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e93b7c25fa60'
+down_revision: Union[str, Sequence[str], None] = 'd48a6f3c0b17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# utils.partitions.PARTITION_MONTHS_AHEAD と合わせる
+MONTHS_AHEAD = 3
+
+
+def _next_month(value: datetime.date) -> datetime.date:
+    return datetime.date(value.year + (value.month == 12), value.month % 12 + 1, 1)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    # パーティションはPostgreSQLのみ。他のDBでは分割しない bot_logs をそのまま使う
+    if bind.dialect.name != 'postgresql':
+        return
+
+    op.drop_index('idx_bot_logs_level_created_at', table_name='bot_logs')
+    op.drop_index('idx_bot_logs_created_at', table_name='bot_logs')
+    op.execute("ALTER TABLE bot_logs RENAME TO bot_logs_unpartitioned")
+    op.execute("ALTER TABLE bot_logs_unpartitioned RENAME CONSTRAINT bot_logs_pkey TO bot_logs_unpartitioned_pkey")
+    op.execute("ALTER SEQUENCE bot_logs_id_seq OWNED BY NONE")
+
+    # パーティションキーは主キーに含める必要がある
+    op.execute("""
+        CREATE TABLE bot_logs (
+            id BIGINT NOT NULL DEFAULT nextval('bot_logs_id_seq'),
+            logger_name VARCHAR(255),
+            level VARCHAR(50),
+            message TEXT,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """)
+    op.execute("ALTER SEQUENCE bot_logs_id_seq OWNED BY bot_logs.id")
+
+    # 既存データの最も古い月から、数か月先までのパーティションを作成する
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    oldest = bind.execute(sa.text("SELECT min(created_at) FROM bot_logs_unpartitioned")).scalar()
+    month = datetime.date(oldest.year, oldest.month, 1) if oldest else datetime.date(today.year, today.month, 1)
+    last = datetime.date(today.year, today.month, 1)
+    for _ in range(MONTHS_AHEAD):
+        last = _next_month(last)
+    while month <= last:
+        op.execute(
+            f"CREATE TABLE bot_logs_p{month:%Y%m} PARTITION OF bot_logs "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d} 00:00:00+00') TO ('{_next_month(month):%Y-%m-%d} 00:00:00+00')"
+        )
+        month = _next_month(month)
+
+    op.execute("""
+        INSERT INTO bot_logs (id, logger_name, level, message, created_at)
+        SELECT id, logger_name, level, message, COALESCE(created_at, now()) FROM bot_logs_unpartitioned
+    """)
+    op.execute("DROP TABLE bot_logs_unpartitioned")
+
+    op.create_index('idx_bot_logs_level_created_at', 'bot_logs', ['level', 'created_at'], unique=False)
+    op.create_index('idx_bot_logs_created_at', 'bot_logs', ['created_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('idx_bot_logs_level_created_at', table_name='bot_logs')
+    op.drop_index('idx_bot_logs_created_at', table_name='bot_logs')
+    op.execute("ALTER TABLE bot_logs RENAME TO bot_logs_partitioned")
+    op.execute("ALTER SEQUENCE bot_logs_id_seq OWNED BY NONE")
+
+    op.execute("""
+        CREATE TABLE bot_logs (
+            id BIGINT NOT NULL DEFAULT nextval('bot_logs_id_seq'),
+            logger_name VARCHAR(255),
+            level VARCHAR(50),
+            message TEXT,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+            CONSTRAINT bot_logs_pkey PRIMARY KEY (id)
+        )
+    """)
+    op.execute("ALTER SEQUENCE bot_logs_id_seq OWNED BY bot_logs.id")
+    op.execute("""
+        INSERT INTO bot_logs (id, logger_name, level, message, created_at)
+        SELECT id, logger_name, level, message, created_at FROM bot_logs_partitioned
+    """)
+    op.execute("DROP TABLE bot_logs_partitioned CASCADE")
+
+    op.create_index('idx_bot_logs_level_created_at', 'bot_logs', ['level', 'created_at'], unique=False)
+    op.create_index('idx_bot_logs_created_at', 'bot_logs', ['created_at'], unique=False)
@@ -1,8 +1,19 @@
 import os
+import json
+import time
+import asyncio
+import hashlib
 import discord
 import logging
+from collections import Counter
+from contextlib import contextmanager
+from discord import app_commands
 from discord.ext import commands
 from utils.log_utils import setup_logging
+from utils.db_log_handler import DatabaseLogHandler
+from utils.write_behind import write_behind
+from utils.tracing import tracer
+from utils.memory_profile import LOW_MEMORY_MODE, client_options, freeze_after_warmup, rss_bytes
 from dotenv import load_dotenv
 
 # .envファイルから環境変数を読み込む
@@ -12,45 +23,200 @@ load_dotenv()
 setup_logging()
 logger = logging.getLogger(__name__)
 
+PROCESS_STARTED = time.perf_counter()
+
+# コマンドツリーのハッシュの保存先。内容が変わったときだけ同期する
+COMMAND_SYNC_HASH_FILE = os.getenv("COMMAND_SYNC_HASH_FILE", os.path.join('log', 'command_tree_hash.json'))
+FORCE_COMMAND_SYNC = os.getenv("FORCE_COMMAND_SYNC", "").lower() in ("1", "true", "yes")
+
+
+def command_tree_hash(tree: app_commands.CommandTree, guild: discord.abc.Snowflake | None = None) -> str:
+    """同期対象となるコマンド定義をシリアライズしたハッシュを返す"""
+    payload = sorted((command.to_dict(tree) for command in tree.get_commands(guild=guild)), key=lambda c: (c.get('type', 1), c['name']))
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+
+def parse_shard_ids(value: str) -> list[int]:
+    """"0-3" や "0,2,4" (組み合わせ可) の形式のシャードID指定を展開する"""
+    shard_ids = []
+    for part in value.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-', 1)
+            shard_ids.extend(range(int(start), int(end) + 1))
+        else:
+            shard_ids.append(int(part))
+    return sorted(set(shard_ids))
+
+
+def shard_options_from_env() -> dict | None:
+    """環境変数からシャーディングの設定を読み取る。シャーディングしない場合は None
+
+    BOT_SHARDING=auto     : AutoShardedBot。SHARD_COUNT 未指定ならDiscordの推奨数を使う
+    BOT_SHARDING=explicit : SHARD_COUNT と SHARD_IDS で、このプロセスが担当するシャードを指定する
+                            (複数のプロセス・コンテナでシャードを分担する場合)
+    """
+    mode = os.getenv("BOT_SHARDING", "none").lower()
+    if mode not in ("auto", "explicit"):
+        return None
+    options = {}
+    shard_count = os.getenv("SHARD_COUNT")
+    if shard_count:
+        options['shard_count'] = int(shard_count)
+    if mode == "explicit":
+        if 'shard_count' not in options or not os.getenv("SHARD_IDS"):
+            raise ValueError("BOT_SHARDING=explicit requires SHARD_COUNT and SHARD_IDS")
+        options['shard_ids'] = parse_shard_ids(os.getenv("SHARD_IDS"))
+        if any(shard_id >= options['shard_count'] for shard_id in options['shard_ids']):
+            raise ValueError("SHARD_IDS must be smaller than SHARD_COUNT")
+    return options
+
+
+class AnonymousBotMixin:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.startup_timings: dict[str, float] = {}
+
+    @contextmanager
+    def startup_phase(self, name: str):
+        """起動処理の各段階の所要時間(ms)を記録する"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.startup_timings[name] = (time.perf_counter() - started) * 1000
+
+    async def setup_hook(self):
+        """ログイン後、Gateway接続前に一度だけ呼ばれる"""
+        with self.startup_phase('load_cogs'):
+            await load_cogs(self)
+        with self.startup_phase('sync_commands'):
+            await self.sync_commands()
+
+    async def sync_commands(self):
+        """コマンドツリーが前回の同期から変わっている場合のみ同期する"""
+        targets: list[discord.abc.Snowflake | None] = [None]
+        guild_id = os.getenv('GUILD_ID')
+        if guild_id:
+            targets.append(discord.Object(id=int(guild_id)))
+
+        try:
+            with open(COMMAND_SYNC_HASH_FILE, encoding='utf-8') as f:
+                synced_hashes = json.load(f)
+        except (OSError, ValueError):
+            synced_hashes = {}
+
+        for guild in targets:
+            key = 'global' if guild is None else str(guild.id)
+            label = "global" if guild is None else f"guild {guild.id}"
+            digest = command_tree_hash(self.tree, guild)
+            if synced_hashes.get(key) == digest and not FORCE_COMMAND_SYNC:
+                logger.info(f"Command tree unchanged, skipping {label} sync")
+                continue
+            try:
+                synced = await self.tree.sync(guild=guild)
+                synced_hashes[key] = digest
+                logger.info(f"Synced {len(synced)} command(s) to {label}")
+            except Exception as e:
+                logger.error(f"Failed to sync commands to {label}: {e}")
+
+        try:
+            os.makedirs(os.path.dirname(COMMAND_SYNC_HASH_FILE) or '.', exist_ok=True)
+            with open(COMMAND_SYNC_HASH_FILE, 'w', encoding='utf-8') as f:
+                json.dump(synced_hashes, f)
+        except OSError as e:
+            logger.warning(f"Failed to save command tree hash: {e}")
+
+    def shard_stats(self) -> list[dict]:
+        """このプロセスが担当するシャードごとのレイテンシ(ms)とギルド数"""
+        guild_counts = Counter(guild.shard_id for guild in self.guilds)
+        if isinstance(self, commands.AutoShardedBot):
+            return [
+                {'shard_id': shard_id, 'latency_ms': latency * 1000, 'guilds': guild_counts.get(shard_id, 0)}
+                for shard_id, latency in self.latencies
+            ]
+        return [{'shard_id': self.shard_id or 0, 'latency_ms': self.latency * 1000, 'guilds': len(self.guilds)}]
+
+    def handles_guild(self, guild_id: int | str) -> bool:
+        """ギルドがこのプロセスのシャードに属するか"""
+        shard_ids = getattr(self, 'shard_ids', None)
+        if not shard_ids or not self.shard_count:
+            return True
+        return (int(guild_id) >> 22) % self.shard_count in shard_ids
+
+    @property
+    def is_primary_process(self) -> bool:
+        """ギルドに依存しない定期処理(保持期間の削除など)を担当するプロセスか"""
+        shard_ids = getattr(self, 'shard_ids', None)
+        return not shard_ids or 0 in shard_ids
+
+    async def close(self):
+        """終了時に遅延書き込みバッファを書き出してから切断する"""
+        await super().close()
+        try:
+            await write_behind.close()
+        except Exception as e:
+            logger.error(f"Failed to drain write-behind buffer: {e}")
+        if write_behind.overflow:
+            logger.warning(f"Write-behind overflow during this session: {dict(write_behind.overflow)}")
+        try:
+            await tracer.close()
+        except Exception as e:
+            logger.error(f"Failed to close tracer: {e}")
+        for handler in logging.getLogger().handlers:
+            if isinstance(handler, DatabaseLogHandler) and (handler.dropped or handler.listener.failed):
+                logger.warning(f"Database log handler dropped {handler.dropped} and failed to write {handler.listener.failed} record(s) during this session")
+
+
+class AnonymousBot(AnonymousBotMixin, commands.Bot):
+    pass
+
+
+class AnonymousShardedBot(AnonymousBotMixin, commands.AutoShardedBot):
+    pass
+
+
 # Botの初期化
 intents = discord.Intents.default()
 intents.messages = True
 intents.message_content = True
-bot = commands.Bot(command_prefix='/', intents=intents)
+shard_options = shard_options_from_env()
+if shard_options is None:
+    bot = AnonymousBot(command_prefix='/', intents=intents, **client_options())
+else:
+    bot = AnonymousShardedBot(command_prefix='/', intents=intents, **client_options(), **shard_options)
 
-async def load_cogs():
-    """cogsフォルダ内のCogを読み込む"""
-    for filename in os.listdir('./cogs'):
-        if filename.endswith('.py'):
-            try:
-                await bot.load_extension(f'cogs.{filename[:-3]}')
-                logger.info(f'Loaded cog: {filename[:-3]}')
-            except Exception as e:
-                logger.error(f'Failed to load cog {filename[:-3]}: {e}')
+async def load_cogs(bot: commands.Bot):
+    """cogsフォルダ内のCogを並行して読み込む"""
+    async def load(name: str):
+        started = time.perf_counter()
+        try:
+            await bot.load_extension(f'cogs.{name}')
+            logger.info(f'Loaded cog: {name} ({(time.perf_counter() - started) * 1000:.1f}ms)')
+        except Exception as e:
+            logger.error(f'Failed to load cog {name}: {e}')
+
+    names = sorted(filename[:-3] for filename in os.listdir('./cogs') if filename.endswith('.py'))
+    await asyncio.gather(*(load(name) for name in names))
 
 @bot.event
 async def on_ready():
-    """Botが起動したときに呼び出されるイベント"""
+    """Gatewayに接続したときに呼び出されるイベント(再接続のたびに呼ばれる)"""
     logger.info(f'{bot.user.name} has connected to Discord!')
-    await load_cogs()
+    if 'ready' not in bot.startup_timings:
+        bot.startup_timings['ready'] = (time.perf_counter() - PROCESS_STARTED) * 1000
+        timings = ", ".join(f"{name}={ms:.0f}ms" for name, ms in bot.startup_timings.items())
+        logger.info(f"Startup timings: {timings}")
+        if LOW_MEMORY_MODE:
+            freeze_after_warmup()
+        logger.info(f"RSS after startup: {rss_bytes() / 1024 / 1024:.1f}MB (low memory mode: {LOW_MEMORY_MODE})")
     logger.info('Bot is ready to receive commands.')
 
-    # グローバルコマンドの同期
-    try:
-        synced = await bot.tree.sync()
-        logger.info(f"Synced {len(synced)} global command(s)")
-    except Exception as e:
-        logger.error(f"Failed to sync global commands: {e}")
-
-    # 特定ギルドへのコマンド同期
-    guild_id = os.getenv('GUILD_ID')
-    if guild_id:
-        try:
-            guild = discord.Object(id=int(guild_id))
-            synced = await bot.tree.sync(guild=guild)
-            logger.info(f"Synced {len(synced)} command(s) to guild {guild_id}")
-        except Exception as e:
-            logger.error(f"Failed to sync commands to guild {guild_id}: {e}")
+@bot.event
+async def on_shard_ready(shard_id: int):
+    logger.info(f"Shard {shard_id} is ready")
 
 @bot.event
 async def on_command_error(ctx, error):
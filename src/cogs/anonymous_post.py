@@ -1,7 +1,6 @@
 import logging
-import asyncio
-import re
-from datetime import datetime, timedelta
+from collections import Counter
+from datetime import date, datetime, timedelta
 
 import discord
 import nanoid
@@ -12,8 +11,18 @@ from sqlalchemy.orm import Session
 
 from cogs.config import ConfigCog
 from database import get_db
-from models import AdminCommandLog, AnonIdMapping, AnonymousPost, AnonymousThread, BotBannedUser, GuildBannedUser, NgWord, RateLimit, UserCommandLog
+from models import AdminCommandLog, AnonIdMapping, AnonymousPost, AnonymousThread, RateLimit, UserCommandLog
+from utils.board_catalogue import anonymous_threads, record_thread_created
 from utils.crypto import Encryptor
+from utils.log_dispatcher import LogDispatcher
+from utils.deletion_attribution import DeletionAttributor, PendingDeletion
+from utils.message_filter import AnonymousMessageFilter
+from utils.post_cache import recent_posts
+from utils.post_validation import (
+    STAGE_BAN, STAGE_LENGTH, STAGE_NG_WORD, STAGE_RATE_LIMIT, PostIdentity, PostRejected, ban_index, ng_word_matcher,
+)
+from utils.tracing import span, tracer
+from utils.write_behind import write_behind
 
 logger = logging.getLogger(__name__)
 
@@ -24,16 +33,23 @@ encryptor = Encryptor()
 class AnonymousPostCog(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-
-    def is_banned(self, db: Session, guild_id: str, user_id: str) -> bool:
-        """ユーザーがBANされているかチェックする"""
-        guild_ban = db.query(GuildBannedUser).filter_by(guild_id=guild_id, user_id=user_id).first()
-        if guild_ban:
-            return True
-        bot_ban = db.query(BotBannedUser).filter_by(user_id=user_id).first()
-        if bot_ban:
-            return True
-        return False
+        self.log_dispatcher = LogDispatcher(bot)
+        self.message_filter = AnonymousMessageFilter()
+        self.deletion_attributor = DeletionAttributor(bot, self._send_log_message)
+        self.webhook_cache: dict[int, Webhook] = {}
+        # Discord APIの呼び出し回数 ("コマンド.呼び出し" ごと)
+        self.api_calls = Counter()
+        # 投稿前の検証で拒否した回数 (段階ごと)
+        self.rejections = Counter()
+
+    async def cog_load(self):
+        self.log_dispatcher.start()
+        # Gatewayに接続する前に作り終えるため、削除イベントの取りこぼしはない
+        await self.message_filter.rebuild()
+
+    async def cog_unload(self):
+        await self.deletion_attributor.close()
+        await self.log_dispatcher.close()
 
     def check_rate_limit(self, db: Session, guild_id: str, user_id_signature: str, settings: dict) -> bool:
         """レート制限をチェックする"""
@@ -44,36 +60,66 @@ class AnonymousPostCog(commands.Cog):
             return False
 
         limit_time = discord.utils.utcnow() - timedelta(seconds=window)
-        recent_posts = db.query(RateLimit).filter(
+        recent_count = db.query(RateLimit).filter(
             RateLimit.guild_id == guild_id,
             RateLimit.user_id_signature == user_id_signature,
             RateLimit.timestamp > limit_time
         ).count()
-        return recent_posts >= count
-
-    def check_ng_words(self, db: Session, guild_id: str, content: str) -> tuple[bool, str | None]:
-        """NGワードをチェックする"""
-        ng_words = db.query(NgWord).filter(NgWord.guild_id == guild_id).all()
-        for ng_word in ng_words:
-            is_match = False
-            if ng_word.match_type == 'exact':
-                if ng_word.word == content:
-                    is_match = True
-            elif ng_word.match_type == 'regex':
-                try:
-                    if re.search(ng_word.word, content):
-                        is_match = True
-                except re.error:
-                    # 正規表現が無効な場合はログに出力してスキップ
-                    logger.warning(f"Invalid regex for NG word (ID: {ng_word.id}): {ng_word.word}")
-                    continue
-            else:  # partial (default)
-                if ng_word.word in content:
-                    is_match = True
-            
-            if is_match:
-                return True, ng_word.action
-        return False, None
+        return recent_count >= count
+
+    def validate_post(
+        self,
+        db: Session,
+        guild_id: str,
+        user_id: str,
+        settings: dict,
+        content: str,
+        today: date,
+        ng_text: str | None = None,
+        check_ng_words: bool = True,
+        check_rate_limit: bool = True,
+        persistent: bool = False,
+    ) -> PostIdentity:
+        """投稿前の検証を安い順 (文字数 → BAN → NGワード → レート制限) に行い、投稿者の識別情報を返す
+
+        暗号化・署名 (PBKDF2) はレート制限の確認で初めて必要になるため、それより前の段階で
+        拒否された投稿では導出しない。拒否した場合は段階を記録して PostRejected を送出する。
+        """
+        max_length = settings.get('max_message_length', 2000)
+        if len(content) > max_length:
+            self._reject(STAGE_LENGTH, f"Message too long ({len(content)} > {max_length})")
+
+        with span("ban_check"):
+            if ban_index.is_banned(db, guild_id, user_id):
+                self._reject(STAGE_BAN, "Banned user")
+
+        if check_ng_words:
+            with span("ng_words"):
+                is_ng, ng_action = ng_word_matcher.match(db, guild_id, ng_text if ng_text is not None else content)
+            if is_ng and ng_action == 'block':
+                self._reject(STAGE_NG_WORD, "NG word detected")
+
+        identity = PostIdentity(encryptor, user_id, settings['guild_salt'], today)
+        if check_rate_limit:
+            with span("rate_limit"):
+                signature = identity.persistent_signature if persistent else identity.daily_signature
+                if self.check_rate_limit(db, guild_id, signature, settings):
+                    self._reject(STAGE_RATE_LIMIT, "Rate limit exceeded")
+        return identity
+
+    def _reject(self, stage: str, message: str):
+        self.rejections[stage] += 1
+        raise PostRejected(stage, message)
+
+    def _rejection_message(self, rejected: PostRejected, settings: dict, ng_message: str) -> str:
+        """スレッド・フォーラム投稿で拒否した理由をユーザー向けのメッセージにする"""
+        if rejected.stage == STAGE_BAN:
+            return "❌ あなたは匿名チャットからBANされています。"
+        if rejected.stage == STAGE_RATE_LIMIT:
+            return "❌ レート制限に達しました。しばらくしてから再試行してください。"
+        if rejected.stage == STAGE_NG_WORD:
+            return ng_message
+        return f"❌ メッセージが長すぎます。{settings.get('max_message_length', 2000)}文字以下にしてください。"
 
     async def get_webhook(self, channel: discord.TextChannel | discord.Thread) -> Webhook:
         """チャンネルまたはスレッドのWebhookを取得または作成する"""
@@ -81,18 +127,44 @@ class AnonymousPostCog(commands.Cog):
         if isinstance(channel, discord.Thread):
             target_channel = channel.parent
 
+        # 一度取得したWebhookは、チャンネルのWebhookが更新されるまで再利用する
+        webhook = self.webhook_cache.get(target_channel.id)
+        if webhook is not None:
+            return webhook
+
+        self.api_calls['get_webhook.webhooks'] += 1
         webhooks = await target_channel.webhooks()
         webhook = discord.utils.find(lambda wh: wh.user == self.bot.user, webhooks)
         if webhook is None:
+            self.api_calls['get_webhook.create_webhook'] += 1
             webhook = await target_channel.create_webhook(name=f"{self.bot.user.name} Webhook")
+        self.webhook_cache[target_channel.id] = webhook
+        self.deletion_attributor.own_webhook_ids.add(webhook.id)
         return webhook
 
+    @commands.Cog.listener()
+    async def on_webhooks_update(self, channel: discord.abc.GuildChannel):
+        self.webhook_cache.pop(channel.id, None)
+
+    def derive_anon_id(self, settings: dict, channel_or_thread_id: str, user_id_signature: str) -> str:
+        """DBを参照せずに匿名IDを導出する。"""
+        jst = pytz.timezone('Asia/Tokyo')
+        today = datetime.now(jst).date()
+        id_rotation_days = max(int(settings.get('id_rotation_days', 1)), 1)
+        rotation_epoch = (today - date(1970, 1, 1)).days // id_rotation_days
+        return encryptor.derive_anon_id(user_id_signature, channel_or_thread_id, rotation_epoch, settings['guild_salt'])
+
     async def get_or_create_anon_id(self, db: Session, guild_id: str, channel_or_thread_id: str, daily_user_id_signature: str) -> str:
         """匿名IDを取得または作成する。"""
-        now_utc = datetime.now(pytz.utc)
-        
         config_cog: ConfigCog = self.bot.get_cog("ConfigCog")
         settings = await config_cog.get_guild_settings(db, guild_id)
+
+        # derivedモードではHMACで決定的に導出し、anon_id_mappingsには触れない
+        # (新規ギルドは作成時に derived が保存され、既存のギルドはマイグレーションで table が保存されている)
+        if settings.get('anon_id_mode') == 'derived':
+            return self.derive_anon_id(settings, channel_or_thread_id, daily_user_id_signature)
+
+        now_utc = datetime.now(pytz.utc)
         id_rotation_days = settings.get('id_rotation_days', 1)
         
         expiration_time = now_utc - timedelta(days=id_rotation_days)
@@ -118,23 +190,32 @@ class AnonymousPostCog(commands.Cog):
             db.add(new_mapping)
             return new_anon_id
 
-    async def _send_log_message(self, guild_id: str, embed: discord.Embed):
-        """設定されたログチャンネルにEmbedメッセージを送信する"""
-        db = next(get_db())
+    async def _delete_post_message(self, post):
+        """投稿のメッセージを取得せずに削除する
+
+        スレッドIDが記録されていればスレッド内のメッセージとして扱う。BOTにメッセージ管理権限が
+        ない場合は、投稿に使ったWebhookから削除する。
+        """
+        channel_id = int(post.thread_id or post.channel_id)
         try:
-            config_cog: ConfigCog = self.bot.get_cog("ConfigCog")
-            if not config_cog:
-                return
-            settings = await config_cog.get_guild_settings(db, guild_id)
-            log_channel_id = settings.get('log_channel_id')
-            if log_channel_id:
-                channel = self.bot.get_channel(int(log_channel_id))
-                if channel:
-                    await channel.send(embed=embed)
-        except Exception as e:
-            print(f"Failed to send log message: {e}")
-        finally:
-            db.close()
+            self.api_calls['delete.delete_message'] += 1
+            await self.bot.get_partial_messageable(channel_id).get_partial_message(int(post.message_id)).delete()
+        except discord.Forbidden:
+            channel = self.bot.get_channel(channel_id) or self.bot.get_channel(int(post.channel_id))
+            if channel is None:
+                raise
+            webhook = await self.get_webhook(channel)
+            self.api_calls['delete.webhook_delete_message'] += 1
+            await webhook.delete_message(int(post.message_id), thread=discord.Object(id=int(post.thread_id)) if post.thread_id else discord.utils.MISSING)
+
+    def _remember_post(self, post: AnonymousPost):
+        """削除イベント用のフィルタと、最近の投稿のキャッシュに投稿を追加する (コミットが成功してから呼ぶ)"""
+        self.message_filter.add(post.message_id)
+        recent_posts.add_post(post)
+
+    async def _send_log_message(self, guild_id: str, embed: discord.Embed):
+        """ログチャンネルへの送信キューにEmbedを追加する(送信はバックグラウンドでまとめて行う)"""
+        self.log_dispatcher.enqueue(guild_id, embed)
 
     async def _post_message(
         self,
@@ -146,47 +227,31 @@ class AnonymousPostCog(commands.Cog):
         attachments: list[discord.Attachment],
         is_converted: bool = False,
         original_message_id: str | None = None
-    ) -> AnonymousPost:
-        """匿名メッセージを投稿する内部共通処理"""
-        config_cog: ConfigCog = self.bot.get_cog("ConfigCog")
-        settings = await config_cog.get_guild_settings(db, guild_id)
-        guild_salt = settings['guild_salt']
+    ) -> tuple[AnonymousPost, PostIdentity]:
+        """匿名メッセージを投稿する内部共通処理。導出済みの署名を再利用できるよう識別情報も返す"""
+        with span("settings"):
+            config_cog: ConfigCog = self.bot.get_cog("ConfigCog")
+            settings = await config_cog.get_guild_settings(db, guild_id)
         
         jst = pytz.timezone('Asia/Tokyo')
         today = datetime.now(jst).date()
 
-        user_id = str(user.id)
-        user_id_encrypted = encryptor.encrypt(user_id, guild_salt)
-        
-        daily_user_id_signature = encryptor.sign_daily_user_id(user_id, guild_salt, today)
-        persistent_user_id_signature = encryptor.sign_persistent_user_id(user_id, guild_salt)
-        search_tag = encryptor.sign_search_tag(daily_user_id_signature, user_id, guild_salt)
+        identity = self.validate_post(db, guild_id, str(user.id), settings, content, today, persistent=is_converted)
 
         # get_or_create_anon_id に渡すシグネチャを使い分ける
-        signature_for_anon_id = persistent_user_id_signature if is_converted else daily_user_id_signature
-
-        if self.is_banned(db, guild_id, user_id):
-            raise ValueError("Banned user")
-
-        if self.check_rate_limit(db, guild_id, signature_for_anon_id, settings):
-            raise ValueError("Rate limit exceeded")
-
-        is_ng, ng_action = self.check_ng_words(db, guild_id, content)
-        if is_ng and ng_action == 'block':
-            raise ValueError("NG word detected")
-
-        max_length = settings.get('max_message_length', 2000)
-        if len(content) > max_length:
-            raise ValueError(f"Message too long ({len(content)} > {max_length})")
+        signature_for_anon_id = identity.persistent_signature if is_converted else identity.daily_signature
 
         channel_or_thread_id = str(channel.id)
         # フォーラム内のスレッドの場合、親のフォーラムチャンネルIDをキーにする
         if isinstance(channel, discord.Thread) and isinstance(channel.parent, discord.ForumChannel):
             channel_or_thread_id = str(channel.parent_id)
-        anon_id = await self.get_or_create_anon_id(db, guild_id, channel_or_thread_id, signature_for_anon_id)
-        webhook = await self.get_webhook(channel)
+        with span("anon_id"):
+            anon_id = await self.get_or_create_anon_id(db, guild_id, channel_or_thread_id, signature_for_anon_id)
+        with span("webhook_lookup"):
+            webhook = await self.get_webhook(channel)
 
-        files = [await att.to_file() for att in attachments]
+        with span("attachments", count=len(attachments)):
+            files = [await att.to_file() for att in attachments]
 
         send_kwargs = {
             "content": content,
@@ -197,13 +262,17 @@ class AnonymousPostCog(commands.Cog):
         if isinstance(channel, discord.Thread):
             send_kwargs["thread"] = channel
         
-        webhook_message = await webhook.send(**send_kwargs)
+        with span("webhook_send"):
+            webhook_message = await webhook.send(**send_kwargs)
 
         attachment_urls = [att.url for att in webhook_message.attachments]
+        with span("crypto"):
+            user_id_encrypted = identity.encrypted_user_id
+            search_tag = identity.search_tag
         new_post = AnonymousPost(
             guild_id=guild_id,
             user_id_encrypted=user_id_encrypted,
-            daily_user_id_signature=daily_user_id_signature,  # 常に日次署名を保存
+            daily_user_id_signature=identity.daily_signature,  # 常に日次署名を保存
             search_tag=search_tag,
             anonymous_id=anon_id,
             message_id=str(webhook_message.id),
@@ -215,13 +284,14 @@ class AnonymousPostCog(commands.Cog):
         )
         db.add(new_post)
         
+        # レート制限の判定はコミット済みの行を数えるため、遅延書き込みにせず投稿と同じトランザクションで書き込む
         db.add(RateLimit(
             guild_id=guild_id,
             user_id_signature=signature_for_anon_id,  # レート制限のキーも使い分ける
             command_name='post' if not is_converted else 'convert'
         ))
         
-        return new_post
+        return new_post, identity
 
     @app_commands.command(name="post", description="匿名でメッセージを投稿します。")
     @app_commands.describe(
@@ -247,11 +317,12 @@ class AnonymousPostCog(commands.Cog):
             return
             
         await interaction.response.defer(ephemeral=True)
+        trace = tracer.start("post", guild_id=str(interaction.guild.id))
         db = next(get_db())
         try:
             attachments = [att for att in [attachment1, attachment2, attachment3, attachment4, attachment5] if att]
             
-            new_post = await self._post_message(
+            new_post, _ = await self._post_message(
                 db=db,
                 guild_id=str(interaction.guild.id),
                 user=interaction.user,
@@ -260,13 +331,16 @@ class AnonymousPostCog(commands.Cog):
                 attachments=attachments
             )
 
-            db.add(UserCommandLog(
+            with span("commit"):
+                db.commit()
+            self._remember_post(new_post)
+            write_behind.add(
+                UserCommandLog,
                 guild_id=str(interaction.guild.id),
                 command_name='post',
                 executed_by_signature=new_post.daily_user_id_signature,
                 params={'channel_id': str(interaction.channel_id), 'message_length': len(message), 'attachments': len(attachments)}
-            ))
-            db.commit()
+            )
 
             await interaction.delete_original_response()
 
@@ -275,7 +349,8 @@ class AnonymousPostCog(commands.Cog):
             log_embed.add_field(name="チャンネル", value=interaction.channel.mention, inline=False)
             if new_post.attachment_urls:
                 log_embed.add_field(name="添付ファイル", value="\n".join(new_post.attachment_urls), inline=False)
-            await self._send_log_message(str(interaction.guild.id), log_embed)
+            with span("log_send"):
+                await self._send_log_message(str(interaction.guild.id), log_embed)
 
         except ValueError as e:
             error_messages = {
@@ -292,6 +367,7 @@ class AnonymousPostCog(commands.Cog):
                 await interaction.followup.send("❌ エラーが発生しました。管理者に連絡してください。", ephemeral=True)
         finally:
             db.close()
+            tracer.end(trace)
 
     @app_commands.command(name="reply", description="指定したメッセージに匿名で返信します。")
     @app_commands.describe(
@@ -311,47 +387,62 @@ class AnonymousPostCog(commands.Cog):
         attachment3: discord.Attachment = None,
     ):
         await interaction.response.defer(ephemeral=True)
+        trace = tracer.start("reply", guild_id=str(interaction.guild.id))
         db = next(get_db())
         try:
-            target_message = await interaction.channel.fetch_message(int(message_id))
-            if not target_message:
-                await interaction.followup.send("❌ 返信先のメッセージが見つかりません。", ephemeral=True)
-                return
-
             guild_id = str(interaction.guild.id)
             user_id = str(interaction.user.id)
 
-            config_cog: ConfigCog = self.bot.get_cog("ConfigCog")
-            settings = await config_cog.get_guild_settings(db, guild_id)
-            guild_salt = settings['guild_salt']
+            # 返信先は匿名投稿のキャッシュ・DB、メッセージキャッシュの順に解決し、見つからない場合だけAPIで確認する
+            with span("target_lookup"):
+                target_deleted = recent_posts.was_deleted(message_id)
+                target_post = None if target_deleted else recent_posts.get(message_id, guild_id)
+                if target_post is None and not target_deleted:
+                    target_post = db.query(AnonymousPost).filter_by(guild_id=guild_id, message_id=message_id).first()
+                    if target_post is not None and target_post.deleted_at is not None:
+                        target_deleted, target_post = True, None
+                if target_post is not None and str(interaction.channel_id) not in (target_post.channel_id, target_post.thread_id):
+                    target_post = None
+            # 削除済みの匿名投稿には、Discord上にメッセージが残っていても返信しない
+            if target_deleted:
+                await interaction.followup.send("❌ 返信先のメッセージが見つかりません。", ephemeral=True)
+                return
+            if target_post is None and discord.utils.get(self.bot.cached_messages, id=int(message_id), channel__id=interaction.channel_id) is None:
+                with span("fetch_target"):
+                    self.api_calls['reply.fetch_message'] += 1
+                    await interaction.channel.fetch_message(int(message_id))
+
+            with span("settings"):
+                config_cog: ConfigCog = self.bot.get_cog("ConfigCog")
+                settings = await config_cog.get_guild_settings(db, guild_id)
             
             jst = pytz.timezone('Asia/Tokyo')
             today = datetime.now(jst).date()
 
-            user_id_encrypted = encryptor.encrypt(user_id, guild_salt)
-            daily_user_id_signature = encryptor.sign_daily_user_id(user_id, guild_salt, today)
-            search_tag = encryptor.sign_search_tag(daily_user_id_signature, user_id, guild_salt)
-
-            if self.is_banned(db, guild_id, user_id):
-                await interaction.followup.send("❌ あなたは匿名チャットからBANされています。", ephemeral=True)
-                return
-
-            max_length = settings.get('max_message_length', 2000)
-            if len(message) > max_length:
-                await interaction.followup.send(f"❌ メッセージが長すぎます。{max_length}文字以下にしてください。", ephemeral=True)
+            # 返信は従来どおりNGワード・レート制限の対象外
+            try:
+                identity = self.validate_post(db, guild_id, user_id, settings, message, today, check_ng_words=False, check_rate_limit=False)
+            except PostRejected as e:
+                if e.stage == STAGE_BAN:
+                    await interaction.followup.send("❌ あなたは匿名チャットからBANされています。", ephemeral=True)
+                else:
+                    max_length = settings.get('max_message_length', 2000)
+                    await interaction.followup.send(f"❌ メッセージが長すぎます。{max_length}文字以下にしてください。", ephemeral=True)
                 return
+            daily_user_id_signature = identity.daily_signature
 
             channel_or_thread_id = str(interaction.channel_id)
-            anon_id = await self.get_or_create_anon_id(db, guild_id, channel_or_thread_id, daily_user_id_signature)
-            webhook = await self.get_webhook(interaction.channel)
+            with span("anon_id"):
+                anon_id = await self.get_or_create_anon_id(db, guild_id, channel_or_thread_id, daily_user_id_signature)
+            with span("webhook_lookup"):
+                webhook = await self.get_webhook(interaction.channel)
 
             attachments = [att for att in [attachment1, attachment2, attachment3] if att]
-            files = [await att.to_file() for att in attachments]
+            with span("attachments", count=len(attachments)):
+                files = [await att.to_file() for att in attachments]
 
             reply_to_url = f"https://discord.com/channels/{guild_id}/{interaction.channel.id}/{message_id}"
             
-            target_post = db.query(AnonymousPost).filter_by(message_id=message_id).first()
-            
             reply_prefix = ""
             if target_post:
                 reply_prefix = f">>[{target_post.anonymous_id}]({reply_to_url})\n"
@@ -371,16 +462,21 @@ class AnonymousPostCog(commands.Cog):
             # コマンドがスレッドで実行された場合、そのスレッドに投稿
             if isinstance(interaction.channel, discord.Thread):
                 thread_to_post_in = interaction.channel
-            # そうでなく、返信先がスレッド内のメッセージの場合、そのスレッドに投稿
-            elif hasattr(target_message, 'thread') and target_message.thread:
-                thread_to_post_in = target_message.thread
+            # そうでなく、返信先のメッセージからスレッドが作られている場合、そのスレッドに投稿
+            # (メッセージから作られたスレッドのIDは元のメッセージIDと同じ)
+            else:
+                thread_to_post_in = interaction.guild.get_thread(int(message_id))
 
             if thread_to_post_in:
                 send_kwargs["thread"] = thread_to_post_in
 
-            webhook_message = await webhook.send(**send_kwargs)
+            with span("webhook_send"):
+                webhook_message = await webhook.send(**send_kwargs)
 
             attachment_urls = [att.url for att in webhook_message.attachments]
+            with span("crypto"):
+                user_id_encrypted = identity.encrypted_user_id
+                search_tag = identity.search_tag
             new_post = AnonymousPost(
                 guild_id=guild_id,
                 user_id_encrypted=user_id_encrypted,
@@ -393,13 +489,16 @@ class AnonymousPostCog(commands.Cog):
                 attachment_urls=attachment_urls
             )
             db.add(new_post)
-            db.add(UserCommandLog(
+            with span("commit"):
+                db.commit()
+            self._remember_post(new_post)
+            write_behind.add(
+                UserCommandLog,
                 guild_id=guild_id,
                 command_name='reply',
                 executed_by_signature=daily_user_id_signature,
                 params={'channel_id': str(interaction.channel.id), 'target_message_id': message_id}
-            ))
-            db.commit()
+            )
 
             await interaction.followup.send("✅ メッセージに返信しました。", ephemeral=True)
 
@@ -412,6 +511,7 @@ class AnonymousPostCog(commands.Cog):
                 await interaction.followup.send("❌ エラーが発生しました。管理者に連絡してください。", ephemeral=True)
         finally:
             db.close()
+            tracer.end(trace)
 
     @app_commands.command(name="delete", description="指定した匿名投稿を削除します。")
     @app_commands.describe(message_id="削除するメッセージID")
@@ -428,11 +528,15 @@ class AnonymousPostCog(commands.Cog):
             settings = await config_cog.get_guild_settings(db, guild_id)
             guild_salt = settings['guild_salt']
             
-            post_to_delete = db.query(AnonymousPost).filter(
+            active_post = db.query(AnonymousPost).filter(
                 AnonymousPost.guild_id == guild_id,
                 AnonymousPost.message_id == message_id,
                 AnonymousPost.deleted_at.is_(None)
-            ).first()
+            )
+            # 最近の投稿はキャッシュから取得する
+            post_to_delete = recent_posts.get(message_id, guild_id)
+            if post_to_delete is None:
+                post_to_delete = active_post.first()
 
             if not post_to_delete:
                 await interaction.followup.send("❌ 削除対象の投稿が見つからないか、既に削除されています。", ephemeral=True)
@@ -451,40 +555,31 @@ class AnonymousPostCog(commands.Cog):
                 return
 
             try:
-                target_channel = None
-                # スレッドIDが記録されていれば、スレッドを優先して取得
-                if post_to_delete.thread_id:
-                    target_channel = self.bot.get_channel(int(post_to_delete.thread_id))
-                
-                # スレッドが見つからないか、元々スレッドでなければチャンネルを取得
-                if not target_channel:
-                    target_channel = self.bot.get_channel(int(post_to_delete.channel_id))
-
-                if target_channel:
-                    message_to_delete = await target_channel.fetch_message(int(post_to_delete.message_id))
-                    await message_to_delete.delete()
+                await self._delete_post_message(post_to_delete)
             except discord.NotFound:
                 pass  # 既にDiscord上から削除されている場合は何もしない
             except discord.Forbidden:
                 await interaction.followup.send("メッセージを削除する権限がBOTにありません。", ephemeral=True)
                 # この場合でも論理削除は続行する
 
-            post_to_delete.deleted_at = discord.utils.utcnow()
+            values = {AnonymousPost.deleted_at: discord.utils.utcnow()}
+            if is_admin:
+                values[AnonymousPost.deleted_by] = user_id
+            active_post.update(values, synchronize_session=False)
+            db.commit()
+            recent_posts.evict(message_id)
 
+            # is_author の場合のログは finally で記録
             if is_admin:
-                post_to_delete.deleted_by = user_id
-                db.add(AdminCommandLog(
+                write_behind.add(
+                    AdminCommandLog,
                     guild_id=guild_id,
                     command_name='delete',
                     executed_by=user_id,
                     target_user_id=post_to_delete.user_id_encrypted,
                     params={'message_id': message_id, 'channel_id': post_to_delete.channel_id},
                     success=True
-                ))
-            
-            # is_author の場合のログは finally で記録
-
-            db.commit()
+                )
             success = True
             await interaction.followup.send("✅ 投稿を削除しました。", ephemeral=True)
 
@@ -502,14 +597,14 @@ class AnonymousPostCog(commands.Cog):
         finally:
             # 管理者でない（＝投稿者本人）の場合のログを記録
             if post_to_delete and not interaction.user.guild_permissions.manage_messages:
-                db.add(UserCommandLog(
+                write_behind.add(
+                    UserCommandLog,
                     guild_id=str(interaction.guild.id),
                     command_name='delete',
                     executed_by_signature=post_to_delete.daily_user_id_signature,
                     params={'message_id': message_id},
                     success=success
-                ))
-                db.commit()
+                )
             db.close()
 
     @app_commands.command(name="th", description="匿名でスレッドを作成します。")
@@ -520,49 +615,47 @@ class AnonymousPostCog(commands.Cog):
     )
     async def thread(self, interaction: discord.Interaction, board: str, title: str, content: str):
         await interaction.response.defer(ephemeral=True)
+        trace = tracer.start("thread", guild_id=str(interaction.guild.id))
         db = next(get_db())
         try:
             guild_id = str(interaction.guild.id)
             user_id = str(interaction.user.id)
 
-            config_cog: ConfigCog = self.bot.get_cog("ConfigCog")
-            settings = await config_cog.get_guild_settings(db, guild_id)
-            guild_salt = settings['guild_salt']
-            
-            jst = pytz.timezone('Asia/Tokyo')
-            today = datetime.now(jst).date()
-
-            user_id_encrypted = encryptor.encrypt(user_id, guild_salt)
-            daily_user_id_signature = encryptor.sign_daily_user_id(user_id, guild_salt, today)
-            search_tag = encryptor.sign_search_tag(daily_user_id_signature, user_id, guild_salt)
-
-            if self.is_banned(db, guild_id, user_id):
-                await interaction.followup.send("❌ あなたは匿名チャットからBANされています。", ephemeral=True)
-                return
-
-            if self.check_rate_limit(db, guild_id, daily_user_id_signature, settings):
-                await interaction.followup.send("❌ レート制限に達しました。しばらくしてから再試行してください。", ephemeral=True)
-                return
-
-            is_ng, ng_action = self.check_ng_words(db, guild_id, title + "\n" + content)
-            if is_ng and ng_action == 'block':
-                await interaction.followup.send("❌ タイトルまたはメッセージに不適切な単語が含まれているため、スレッドを作成できません。", ephemeral=True)
-                return
-
             if not isinstance(interaction.channel, discord.TextChannel):
                 await interaction.followup.send("❌ このコマンドはテキストチャンネルでのみ使用できます。", ephemeral=True)
                 return
 
-            thread = await interaction.channel.create_thread(name=title, type=discord.ChannelType.public_thread)
-            anon_id = await self.get_or_create_anon_id(db, guild_id, str(thread.id), daily_user_id_signature)
-            webhook = await self.get_webhook(thread)
-
-            webhook_message = await webhook.send(
-                content=content,
-                username=settings.get('anon_id_format', '匿名ユーザー_{id}').format(id=anon_id),
-                wait=True
-            )
+            with span("settings"):
+                config_cog: ConfigCog = self.bot.get_cog("ConfigCog")
+                settings = await config_cog.get_guild_settings(db, guild_id)
+            
+            jst = pytz.timezone('Asia/Tokyo')
+            today = datetime.now(jst).date()
 
+            try:
+                identity = self.validate_post(db, guild_id, user_id, settings, content, today, ng_text=title + "\n" + content)
+            except PostRejected as e:
+                await interaction.followup.send(self._rejection_message(e, settings, ng_message="❌ タイトルまたはメッセージに不適切な単語が含まれているため、スレッドを作成できません。"), ephemeral=True)
+                return
+            daily_user_id_signature = identity.daily_signature
+
+            with span("create_thread"):
+                thread = await interaction.channel.create_thread(name=title, type=discord.ChannelType.public_thread)
+            with span("anon_id"):
+                anon_id = await self.get_or_create_anon_id(db, guild_id, str(thread.id), daily_user_id_signature)
+            with span("webhook_lookup"):
+                webhook = await self.get_webhook(thread)
+
+            with span("webhook_send"):
+                webhook_message = await webhook.send(
+                    content=content,
+                    username=settings.get('anon_id_format', '匿名ユーザー_{id}').format(id=anon_id),
+                    wait=True
+                )
+
+            with span("crypto"):
+                user_id_encrypted = identity.encrypted_user_id
+                search_tag = identity.search_tag
             new_thread_db = AnonymousThread(
                 guild_id=guild_id,
                 thread_discord_id=str(thread.id),
@@ -571,6 +664,7 @@ class AnonymousPostCog(commands.Cog):
                 created_by_encrypted=user_id_encrypted
             )
             db.add(new_thread_db)
+            record_thread_created(db, guild_id, board, discord.utils.utcnow())
 
             new_post = AnonymousPost(
                 guild_id=guild_id,
@@ -585,9 +679,12 @@ class AnonymousPostCog(commands.Cog):
                 attachment_urls=[]
             )
             db.add(new_post)
-
             db.add(RateLimit(guild_id=guild_id, user_id_signature=daily_user_id_signature, command_name='thread'))
-            db.commit()
+
+            with span("commit"):
+                db.commit()
+            self._remember_post(new_post)
+            anonymous_threads.add(thread.id)
 
             await interaction.followup.send(f"✅ スレッド '{title}' を作成しました。", ephemeral=True)
 
@@ -595,7 +692,8 @@ class AnonymousPostCog(commands.Cog):
             log_embed.add_field(name="匿名ID", value=anon_id, inline=False)
             log_embed.add_field(name="スレッド", value=thread.mention, inline=False)
             log_embed.add_field(name="タイトル", value=title, inline=False)
-            await self._send_log_message(guild_id, log_embed)
+            with span("log_send"):
+                await self._send_log_message(guild_id, log_embed)
 
         except Exception as e:
             db.rollback()
@@ -604,120 +702,42 @@ class AnonymousPostCog(commands.Cog):
                 await interaction.followup.send("❌ スレッド作成中にエラーが発生しました。管理者に連絡してください。", ephemeral=True)
         finally:
             db.close()
+            tracer.end(trace)
 
 
     @commands.Cog.listener()
-    async def on_message_delete(self, message: discord.Message):
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
         """
         コマンド以外でメッセージが削除された場合も、それが匿名投稿であればDBに記録する
+        (キャッシュにないメッセージも対象にするため raw イベントを使う)
         """
-        if not message.guild:
-            return
-            
-        # Webhookによって投稿されたメッセージはbot.userがauthorになるため、これだけでは不十分
-        # message.webhook_id があるかどうかで判断するのがより確実
-        if not message.webhook_id:
+        # 匿名投稿でないことが確定したメッセージはDBを見ない
+        if not payload.guild_id or payload.message_id not in self.message_filter:
             return
+        if recent_posts.was_deleted(payload.message_id):
+            return  # /delete や一括削除で既に記録済み
+        self.deletion_attributor.add(payload.guild_id, PendingDeletion(payload.channel_id, message_ids=[payload.message_id]))
 
-        db: Session = next(get_db())
-        try:
-            post = db.query(AnonymousPost).filter(
-                AnonymousPost.guild_id == str(message.guild.id),
-                AnonymousPost.message_id == str(message.id),
-                AnonymousPost.deleted_at.is_(None)
-            ).first()
-
-            if post:
-                # 監査ログから削除実行者を取得
-                deleter = None
-                # 監査ログが取得できるまで少し待つ
-                await asyncio.sleep(2)
-                async for entry in message.guild.audit_logs(limit=5, action=discord.AuditLogAction.message_delete):
-                    # 削除されたメッセージのチャンネルと実行者のターゲットが一致するかで判断
-                    if entry.extra.channel.id == message.channel.id and entry.target.id == self.bot.user.id:
-                        deleter = entry.user
-                        deleter = entry.user
-                        break
-                
-                post.deleted_at = discord.utils.utcnow()
-                if deleter:
-                    post.deleted_by = str(deleter.id)
-                else:
-                    # 監査ログで追えない場合は、投稿者自身が削除したとみなし、暗号化IDを保存
-                    post.deleted_by = post.user_id_encrypted
-
-                db.commit()
-
-                log_embed = discord.Embed(title="匿名投稿削除 (外部)", color=0x7289da, timestamp=discord.utils.utcnow())
-                log_embed.add_field(name="匿名ID", value=post.anonymous_id, inline=False)
-                log_embed.add_field(name="対象メッセージID", value=message.id, inline=False)
-                log_embed.add_field(name="チャンネル", value=message.channel.mention, inline=False)
-                if deleter:
-                    log_embed.add_field(name="削除実行者", value=deleter.mention, inline=False)
-                else:
-                    log_embed.add_field(name="削除実行者", value="不明 (投稿者本人による削除の可能性)", inline=False)
-                
-                await self._send_log_message(str(message.guild.id), log_embed)
-
-        except Exception as e:
-            logger.error(f"Error in on_message_delete event: {e}", exc_info=True)
-            db.rollback()
-        finally:
-            db.close()
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
+        """一括削除 (purge) された匿名投稿を、まとめて記録する"""
+        if not payload.guild_id:
+            return
+        message_ids = [message_id for message_id in payload.message_ids if message_id in self.message_filter]
+        if message_ids:
+            self.deletion_attributor.add(payload.guild_id, PendingDeletion(payload.channel_id, message_ids=message_ids, bulk=True))
 
     @commands.Cog.listener()
-    async def on_thread_delete(self, thread: discord.Thread):
+    async def on_raw_thread_delete(self, payload: discord.RawThreadDeleteEvent):
         """
         フォーラム投稿（スレッド）が削除された場合、DBに記録する
         """
-        # フォーラムチャンネル内のスレッドでなければ無視
-        if not isinstance(thread.parent, discord.ForumChannel):
+        # フォーラム投稿のスレッドIDは最初のメッセージIDと同じため、同じフィルタで判定できる
+        if payload.thread_id not in self.message_filter:
             return
+        thread_name = payload.thread.name if payload.thread else None
+        self.deletion_attributor.add(payload.guild_id, PendingDeletion(payload.parent_id, thread_id=payload.thread_id, thread_name=thread_name))
 
-        db: Session = next(get_db())
-        try:
-            # 削除されたスレッドIDに紐づく投稿を探す
-            post = db.query(AnonymousPost).filter(
-                AnonymousPost.guild_id == str(thread.guild.id),
-                AnonymousPost.thread_id == str(thread.id),
-                AnonymousPost.deleted_at.is_(None)
-            ).first()
-
-            if post:
-                # 監査ログから削除実行者を取得
-                deleter = None
-                # 監査ログが記録されるまで少し待つ
-                await asyncio.sleep(2)
-                async for entry in thread.guild.audit_logs(limit=5, action=discord.AuditLogAction.thread_delete):
-                    if entry.target.id == thread.id:
-                        deleter = entry.user
-                        break
-                
-                post.deleted_at = discord.utils.utcnow()
-                if deleter:
-                    post.deleted_by = str(deleter.id)
-                else:
-                    # 監査ログで追えない場合は、投稿者本人が削除したとみなし、暗号化IDを保存
-                    post.deleted_by = post.user_id_encrypted
-
-                db.commit()
-
-                log_embed = discord.Embed(title="匿名フォーラム投稿削除 (外部)", color=0x7289da, timestamp=discord.utils.utcnow())
-                log_embed.add_field(name="匿名ID", value=post.anonymous_id, inline=False)
-                log_embed.add_field(name="対象スレッド", value=thread.name, inline=False)
-                log_embed.add_field(name="フォーラム", value=thread.parent.mention, inline=False)
-                if deleter:
-                    log_embed.add_field(name="削除実行者", value=deleter.mention, inline=False)
-                else:
-                    log_embed.add_field(name="削除実行者", value="不明 (投稿者本人による削除の可能性)", inline=False)
-                
-                await self._send_log_message(str(thread.guild.id), log_embed)
-
-        except Exception as e:
-            logger.error(f"Error in on_thread_delete event: {e}", exc_info=True)
-            db.rollback()
-        finally:
-            db.close()
     @app_commands.command(name="forum_post", description="指定したフォーラムに匿名で新しい投稿を作成します。")
     @app_commands.describe(
         forum="投稿先のフォーラムチャンネル",
@@ -726,48 +746,45 @@ class AnonymousPostCog(commands.Cog):
     )
     async def forum_post(self, interaction: discord.Interaction, forum: discord.ForumChannel, title: str, content: str):
         await interaction.response.defer(ephemeral=True)
+        trace = tracer.start("forum_post", guild_id=str(interaction.guild.id))
         db: Session = next(get_db())
         try:
             guild_id = str(interaction.guild.id)
             user_id = str(interaction.user.id)
 
-            config_cog: ConfigCog = self.bot.get_cog("ConfigCog")
-            settings = await config_cog.get_guild_settings(db, guild_id)
-            guild_salt = settings['guild_salt']
+            with span("settings"):
+                config_cog: ConfigCog = self.bot.get_cog("ConfigCog")
+                settings = await config_cog.get_guild_settings(db, guild_id)
             
             jst = pytz.timezone('Asia/Tokyo')
             today = discord.utils.utcnow().astimezone(jst).date()
 
-            user_id_encrypted = encryptor.encrypt(user_id, guild_salt)
-            daily_user_id_signature = encryptor.sign_daily_user_id(user_id, guild_salt, today)
-            search_tag = encryptor.sign_search_tag(daily_user_id_signature, user_id, guild_salt)
-
-            if self.is_banned(db, guild_id, user_id):
-                await interaction.followup.send("❌ あなたは匿名チャットからBANされています。", ephemeral=True)
-                return
-
-            if self.check_rate_limit(db, guild_id, daily_user_id_signature, settings):
-                await interaction.followup.send("❌ レート制限に達しました。しばらくしてから再試行してください。", ephemeral=True)
-                return
-
-            is_ng, ng_action = self.check_ng_words(db, guild_id, title + "\n" + content)
-            if is_ng and ng_action == 'block':
-                await interaction.followup.send("❌ タイトルまたはメッセージに不適切な単語が含まれているため、投稿できません。", ephemeral=True)
+            try:
+                identity = self.validate_post(db, guild_id, user_id, settings, content, today, ng_text=title + "\n" + content)
+            except PostRejected as e:
+                await interaction.followup.send(self._rejection_message(e, settings, ng_message="❌ タイトルまたはメッセージに不適切な単語が含まれているため、投稿できません。"), ephemeral=True)
                 return
+            daily_user_id_signature = identity.daily_signature
 
             # 匿名IDの生成 (IDのスコープはフォーラムチャンネル自体)
-            anon_id = await self.get_or_create_anon_id(db, guild_id, str(forum.id), daily_user_id_signature)
+            with span("anon_id"):
+                anon_id = await self.get_or_create_anon_id(db, guild_id, str(forum.id), daily_user_id_signature)
             
             # Webhookを取得して、匿名ユーザーとして投稿
-            webhook = await self.get_webhook(forum)
-            thread_with_message = await webhook.send(
-                content=content,
-                username=settings.get('anon_id_format', '匿名ユーザー_{id}').format(id=anon_id),
-                thread_name=title,
-                wait=True,
-            )
+            with span("webhook_lookup"):
+                webhook = await self.get_webhook(forum)
+            with span("webhook_send"):
+                thread_with_message = await webhook.send(
+                    content=content,
+                    username=settings.get('anon_id_format', '匿名ユーザー_{id}').format(id=anon_id),
+                    thread_name=title,
+                    wait=True,
+                )
             
             # データベースに保存
+            with span("crypto"):
+                user_id_encrypted = identity.encrypted_user_id
+                search_tag = identity.search_tag
             new_post = AnonymousPost(
                 guild_id=guild_id,
                 user_id_encrypted=user_id_encrypted,
@@ -781,7 +798,9 @@ class AnonymousPostCog(commands.Cog):
             )
             db.add(new_post)
             db.add(RateLimit(guild_id=guild_id, user_id_signature=daily_user_id_signature, command_name='forum_post'))
-            db.commit()
+            with span("commit"):
+                db.commit()
+            self._remember_post(new_post)
 
             await interaction.followup.send(f"✅ フォーラムに投稿 '{title}' を作成しました。", ephemeral=True)
 
@@ -791,6 +810,7 @@ class AnonymousPostCog(commands.Cog):
             await interaction.followup.send("❌ 投稿中にエラーが発生しました。", ephemeral=True)
         finally:
             db.close()
+            tracer.end(trace)
 
     @app_commands.command(name="myid", description="このチャンネルで今日使用している匿名IDを表示します。")
     async def myid(self, interaction: discord.Interaction):
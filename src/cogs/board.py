@@ -0,0 +1,150 @@
+import asyncio
+import logging
+
+import discord
+from discord import app_commands
+from discord.ext import commands
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, get_db
+from models import AnonymousThread, Board
+from utils.board_catalogue import anonymous_threads, record_thread_deleted
+from utils.pagination import KeysetPaginationView
+
+logger = logging.getLogger(__name__)
+
+
+class BoardListView(KeysetPaginationView):
+    """最終更新日時の新しい順にボードを表示する"""
+
+    def __init__(self, bot, guild_id: str, total: int):
+        columns = [Board.id, Board.name, Board.thread_count, Board.last_activity_at]
+        filters = [Board.guild_id == guild_id, Board.thread_count > 0]
+        super().__init__(bot, guild_id, Board, columns, filters, total, descending=True, sort_columns=[Board.last_activity_at, Board.id])
+
+    async def build_embed(self, rows: list) -> discord.Embed:
+        embed = discord.Embed(title="ボード一覧", color=discord.Color.green())
+
+        if not rows:
+            embed.description = "このページにボードはありません。"
+            return embed
+
+        for board in rows:
+            embed.add_field(
+                name=board.name,
+                value=f"スレッド数: {board.thread_count} / 最終更新: {discord.utils.format_dt(board.last_activity_at, 'R')}",
+                inline=False
+            )
+        return embed
+
+
+class BoardThreadsView(KeysetPaginationView):
+    """ボード内のスレッドを新しい順に表示する"""
+
+    def __init__(self, bot, guild_id: str, board: str, total: int):
+        columns = [AnonymousThread.id, AnonymousThread.created_at, AnonymousThread.thread_discord_id, AnonymousThread.title]
+        filters = [AnonymousThread.guild_id == guild_id, AnonymousThread.board == board, AnonymousThread.deleted_at.is_(None)]
+        super().__init__(bot, guild_id, AnonymousThread, columns, filters, total, descending=True)
+        self.board = board
+
+    async def build_embed(self, rows: list) -> discord.Embed:
+        embed = discord.Embed(title=f"ボード「{self.board}」のスレッド", color=discord.Color.green())
+
+        if not rows:
+            embed.description = "このページにスレッドはありません。"
+            return embed
+
+        embed.description = "\n".join(
+            f"<#{thread.thread_discord_id}> {thread.title} ({discord.utils.format_dt(thread.created_at, 'd')})"
+            for thread in rows
+        )
+        return embed
+
+
+class BoardCog(commands.Cog):
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+
+    async def cog_load(self):
+        # Gatewayに接続する前に作り終えるため、削除イベントの取りこぼしはない
+        await anonymous_threads.rebuild()
+
+    def _record_thread_deleted(self, thread_id: int):
+        db = SessionLocal()
+        try:
+            record_thread_deleted(db, str(thread_id), discord.utils.utcnow())
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Failed to update board catalogue for thread {thread_id}: {e}", exc_info=True)
+        finally:
+            db.close()
+
+    @commands.Cog.listener()
+    async def on_raw_thread_delete(self, payload: discord.RawThreadDeleteEvent):
+        """/th で作られたスレッドが削除された場合、ボードのスレッド数を減らす"""
+        # 匿名スレッドでないことが確定したスレッドはDBを見ない
+        if payload.thread_id not in anonymous_threads:
+            return
+        await asyncio.to_thread(self._record_thread_deleted, payload.thread_id)
+
+    async def board_autocomplete(self, interaction: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:
+        db = SessionLocal()
+        try:
+            names = db.query(Board.name).filter(
+                Board.guild_id == str(interaction.guild_id),
+                Board.thread_count > 0,
+                Board.name.startswith(current, autoescape=True)
+            ).order_by(Board.last_activity_at.desc()).limit(25).all()
+        finally:
+            db.close()
+        return [app_commands.Choice(name=name, value=name) for (name,) in names]
+
+    @app_commands.command(name="boards", description="スレッドのあるボードの一覧を表示します。")
+    async def boards(self, interaction: discord.Interaction):
+        await interaction.response.defer(ephemeral=True)
+        db: Session = next(get_db())
+        try:
+            guild_id = str(interaction.guild.id)
+            total = db.query(Board).filter(Board.guild_id == guild_id, Board.thread_count > 0).count()
+            if total == 0:
+                await interaction.followup.send("ℹ️ まだボードがありません。`/th` でスレッドを作成できます。", ephemeral=True)
+                return
+
+            view = BoardListView(self.bot, guild_id, total)
+            embed = await view.get_page_embed()
+
+            await interaction.followup.send(embed=embed, view=view, ephemeral=True)
+        except Exception as e:
+            logger.error(f"Error in boards command: {e}", exc_info=True)
+            await interaction.followup.send("❌ ボード一覧の取得中にエラーが発生しました。", ephemeral=True)
+        finally:
+            db.close()
+
+    @app_commands.command(name="board_threads", description="ボード内のスレッドを新しい順に表示します。")
+    @app_commands.describe(board="ボード名")
+    @app_commands.autocomplete(board=board_autocomplete)
+    async def board_threads(self, interaction: discord.Interaction, board: str):
+        await interaction.response.defer(ephemeral=True)
+        db: Session = next(get_db())
+        try:
+            guild_id = str(interaction.guild.id)
+            # スレッド数はボード一覧に記録された値を使い、スレッドを数え直さない
+            catalogue_entry = db.query(Board.thread_count).filter_by(guild_id=guild_id, name=board).first()
+            if not catalogue_entry or catalogue_entry.thread_count == 0:
+                await interaction.followup.send(f"❌ ボード「{board}」にスレッドはありません。", ephemeral=True)
+                return
+
+            view = BoardThreadsView(self.bot, guild_id, board, catalogue_entry.thread_count)
+            embed = await view.get_page_embed()
+
+            await interaction.followup.send(embed=embed, view=view, ephemeral=True)
+        except Exception as e:
+            logger.error(f"Error in board_threads command: {e}", exc_info=True)
+            await interaction.followup.send("❌ スレッド一覧の取得中にエラーが発生しました。", ephemeral=True)
+        finally:
+            db.close()
+
+
+async def setup(bot: commands.Bot):
+    await bot.add_cog(BoardCog(bot))
@@ -8,6 +8,7 @@ import base64
 
 from models import GuildSettings, ConfigHistory, NgWord
 from database import get_db
+from utils.post_validation import ng_word_matcher
 
 # 仕様書の付録にあるデフォルト設定
 DEFAULT_SETTINGS = {
@@ -21,6 +22,7 @@ DEFAULT_SETTINGS = {
     "ngword_action": "block",
     "log_retention_days": 180,
     "anonymous_id_reset_mode": "daily",
+    "anon_id_mode": "derived",
     "bulk_delete_max_count": 1000,
     "bulk_delete_require_reason_threshold": 10,
     "bulk_delete_notify_admins": True,
@@ -40,17 +42,52 @@ SETTING_DESCRIPTIONS = {
     "ngword_action": "NGワード検知時のアクション",
     "log_retention_days": "ログの保持期間(日)",
     "anonymous_id_reset_mode": "匿名IDのリセットモード",
+    "anon_id_mode": "匿名IDの割り当て方式 (derived: DB不要の導出 / table: 従来のマッピングテーブル)",
     "bulk_delete_max_count": "一括削除の最大件数",
     "bulk_delete_require_reason_threshold": "理由必須となる一括削除の閾値",
     "bulk_delete_notify_admins": "一括削除時の管理者通知",
     "conversion_channels": "誤投稿変換の対象チャンネル",
 }
 
+EMPTY_CHANNELS: frozenset[int] = frozenset()
+
+# 取りうる値が限定されている設定キー
+SETTING_CHOICES = {
+    "anon_id_mode": ["derived", "table"],
+}
+
 
 class ConfigCog(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self.settings_cache = {}
+        # 誤投稿変換が有効なギルドの対象チャンネルID。on_messageがDBに触れずに判定するために使う
+        self.conversion_index: dict[int, frozenset[int]] = {}
+
+    async def cog_load(self):
+        """全ギルドの変換対象チャンネルを読み込む"""
+        db: Session = next(get_db())
+        try:
+            for guild_id, settings in db.query(GuildSettings.guild_id, GuildSettings.settings):
+                self.update_conversion_index(guild_id, settings)
+        finally:
+            db.close()
+
+    def update_conversion_index(self, guild_id: str, settings: dict):
+        settings = settings or {}
+        channels = frozenset(int(channel_id) for channel_id in settings.get("conversion_channels", []))
+        if settings.get("conversion_enabled", DEFAULT_SETTINGS["conversion_enabled"]) and channels:
+            self.conversion_index[int(guild_id)] = channels
+        else:
+            self.conversion_index.pop(int(guild_id), None)
+
+    def conversion_channel_ids(self, guild_id: int) -> frozenset[int]:
+        return self.conversion_index.get(guild_id, EMPTY_CHANNELS)
+
+    def cache_settings(self, guild_id: str, settings: dict):
+        """設定のキャッシュと変換対象チャンネルの索引を更新する"""
+        self.settings_cache[guild_id] = settings
+        self.update_conversion_index(guild_id, settings)
 
     async def get_guild_settings(self, db: Session, guild_id: str) -> dict:
         """ギルドの設定を取得または作成する(キャッシュ対応)"""
@@ -66,7 +103,7 @@ class ConfigCog(commands.Cog):
             settings_model = GuildSettings(guild_id=guild_id, settings=new_settings)
             db.add(settings_model)
             db.commit()
-            self.settings_cache[guild_id] = new_settings
+            self.cache_settings(guild_id, new_settings)
             return new_settings
 
         # 既存の設定にソルトがない場合は追加
@@ -75,10 +112,10 @@ class ConfigCog(commands.Cog):
             new_settings['guild_salt'] = base64.b64encode(os.urandom(16)).decode()
             settings_model.settings = new_settings
             db.commit()
-            self.settings_cache[guild_id] = new_settings
+            self.cache_settings(guild_id, new_settings)
             return new_settings
         
-        self.settings_cache[guild_id] = settings_model.settings
+        self.cache_settings(guild_id, settings_model.settings)
         return settings_model.settings
 
     async def key_autocomplete(self, interaction: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:
@@ -89,7 +126,7 @@ class ConfigCog(commands.Cog):
             
             choices = []
             # guild_saltは除外
-            settable_keys = {k: v for k, v in settings.items() if k != 'guild_salt'}
+            settable_keys = {k: v for k, v in {**DEFAULT_SETTINGS, **settings}.items() if k != 'guild_salt'}
             
             for key, value in settable_keys.items():
                 if current.lower() in key.lower():
@@ -137,7 +174,7 @@ class ConfigCog(commands.Cog):
                 if key == 'guild_salt':
                     await interaction.followup.send("このキーは変更できません。", ephemeral=True)
                     return
-                if key not in settings_data:
+                if key not in settings_data and key not in DEFAULT_SETTINGS:
                     await interaction.followup.send(f"設定キー '{key}' は存在しません。", ephemeral=True)
                     return
                 
@@ -151,6 +188,9 @@ class ConfigCog(commands.Cog):
                 except (ValueError, TypeError):
                     await interaction.followup.send(f"値の型が不正です。'{key}' は {original_type.__name__} 型である必要があります。", ephemeral=True)
                     return
+                if key in SETTING_CHOICES and new_value not in SETTING_CHOICES[key]:
+                    await interaction.followup.send(f"'{key}' には {', '.join(SETTING_CHOICES[key])} のいずれかを指定してください。", ephemeral=True)
+                    return
 
                 guild_settings = db.query(GuildSettings).filter_by(guild_id=guild_id).first()
                 old_value = guild_settings.settings.get(key)
@@ -173,7 +213,7 @@ class ConfigCog(commands.Cog):
                 db.commit()
                 
                 # キャッシュを更新
-                self.settings_cache[guild_id] = new_settings
+                self.cache_settings(guild_id, new_settings)
                 
                 await interaction.followup.send(f"設定 '{key}' を `{new_value}` に更新しました。", ephemeral=True)
 
@@ -213,7 +253,7 @@ class ConfigCog(commands.Cog):
             guild_settings.settings = new_settings
             
             db.commit()
-            self.settings_cache[guild_id] = new_settings
+            self.cache_settings(guild_id, new_settings)
             
             await interaction.followup.send(f"{channel.mention} を変換対象チャンネルに追加しました。", ephemeral=True)
         except Exception as e:
@@ -246,7 +286,7 @@ class ConfigCog(commands.Cog):
             guild_settings.settings = new_settings
             
             db.commit()
-            self.settings_cache[guild_id] = new_settings
+            self.cache_settings(guild_id, new_settings)
             
             await interaction.followup.send(f"{channel.mention} を変換対象チャンネルから削除しました。", ephemeral=True)
         except Exception as e:
@@ -308,6 +348,7 @@ class ConfigCog(commands.Cog):
             )
             db.add(new_ng_word)
             db.commit()
+            ng_word_matcher.invalidate(guild_id)
             
             await interaction.followup.send(f"NGワード `{word}` ({match_type}) を追加しました。", ephemeral=True)
         except Exception as e:
@@ -341,6 +382,7 @@ class ConfigCog(commands.Cog):
 
             db.delete(ng_word_to_delete)
             db.commit()
+            ng_word_matcher.invalidate(guild_id)
             
             await interaction.followup.send(f"NGワード `{word}` ({match_type}) を削除しました。", ephemeral=True)
         except Exception as e:
@@ -1,78 +1,94 @@
+import os
+import asyncio
+import datetime
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
+from sqlalchemy import delete, insert, select
 from sqlalchemy.orm import Session
 import logging
 
-from models import ConversionHistory
+from models import ConversionHistory, ConversionPrompt
 from database import get_db
 from cogs.config import DEFAULT_SETTINGS, ConfigCog
 from cogs.anonymous_post import AnonymousPostCog
 from utils.crypto import Encryptor
+from utils.write_behind import write_behind
 
 logger = logging.getLogger(__name__)
 
 encryptor = Encryptor()
 
+# 期限切れの確認メッセージを片付ける間隔(秒)と、1回に片付ける件数
+CONVERSION_SWEEP_INTERVAL = float(os.getenv("CONVERSION_SWEEP_INTERVAL", 5))
+CONVERSION_SWEEP_BATCH_SIZE = int(os.getenv("CONVERSION_SWEEP_BATCH_SIZE", 100))
 
-class ConversionView(discord.ui.View):
-    def __init__(self, author: discord.User, cog_instance: "ConversionCog", original_message: discord.Message, timeout: float):
-        super().__init__(timeout=timeout)
-        self.author = author
-        self.cog_instance = cog_instance
-        self.original_message = original_message
-        self.confirmation_message = None
+CONVERSION_ERROR_MESSAGES = {
+    "Banned user": "❌ あなたは匿名チャットからBANされています。",
+    "Rate limit exceeded": "❌ レート制限に達しました。しばらくしてから再試行してください。",
+    "NG word detected": "❌ メッセージに不適切な単語が含まれているため、変換をブロックしました。",
+}
+
+
+class ConversionButton(discord.ui.DynamicItem[discord.ui.Button], template=r'conversion:(?P<action>convert|cancel):(?P<channel_id>\d+):(?P<message_id>\d+):(?P<author_id>\d+)'):
+    """誤投稿変換の確認ボタン
+
+    custom_id に元のメッセージ・チャンネル・投稿者を埋め込むため、確認メッセージごとに
+    Viewを保持する必要がなく、BOTの再起動後も押せる。
+    """
+
+    def __init__(self, action: str, channel_id: int, message_id: int, author_id: int):
+        custom_id = f"conversion:{action}:{channel_id}:{message_id}:{author_id}"
+        if action == "convert":
+            button = discord.ui.Button(label="変換する", style=discord.ButtonStyle.primary, emoji="🔄", custom_id=custom_id)
+        else:
+            button = discord.ui.Button(label="キャンセル", style=discord.ButtonStyle.secondary, custom_id=custom_id)
+        super().__init__(button)
+        self.action = action
+        self.channel_id = channel_id
+        self.message_id = message_id
+        self.author_id = author_id
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+        return cls(match['action'], int(match['channel_id']), int(match['message_id']), int(match['author_id']))
 
     async def interaction_check(self, interaction: discord.Interaction) -> bool:
-        if interaction.user.id != self.author.id:
+        if interaction.user.id != self.author_id:
             await interaction.response.send_message("このボタンはメッセージの投稿者のみが使用できます。", ephemeral=True)
             return False
         return True
 
-    async def on_timeout(self):
-        if self.confirmation_message:
-            try:
-                await self.confirmation_message.delete()
-            except discord.NotFound:
-                pass  # Already deleted
-        await self.cog_instance.record_conversion_history(
-            self.original_message, None, "timeout"
-        )
+    async def callback(self, interaction: discord.Interaction):
+        cog: "ConversionCog" = interaction.client.get_cog("ConversionCog")
+        if self.action == "convert":
+            await cog.handle_convert(interaction, self.message_id)
+        else:
+            await cog.handle_cancel(interaction)
 
-    @discord.ui.button(label="変換する", style=discord.ButtonStyle.primary, emoji="🔄")
-    async def convert(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await interaction.response.defer()
-        try:
-            await self.cog_instance.convert_message(interaction, self.original_message)
-            if self.confirmation_message:
-                await self.confirmation_message.delete()
-        except ValueError as e:
-            error_messages = {
-                "Banned user": "❌ あなたは匿名チャットからBANされています。",
-                "Rate limit exceeded": "❌ レート制限に達しました。しばらくしてから再試行してください。",
-                "NG word detected": "❌ メッセージに不適切な単語が含まれているため、変換をブロックしました。",
-            }
-            message = error_messages.get(str(e), "❌ メッセージが長すぎるか、その他の理由で変換できませんでした。")
-            await interaction.followup.send(message, ephemeral=True)
-        except Exception as e:
-            logger.error(f"Error during conversion: {e}", exc_info=True)
-            await interaction.followup.send("変換中に予期せぬエラーが発生しました。", ephemeral=True)
-        self.stop()
 
-    @discord.ui.button(label="キャンセル", style=discord.ButtonStyle.secondary)
-    async def cancel(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await interaction.response.defer()
-        if self.confirmation_message:
-            await self.confirmation_message.delete()
-        await self.cog_instance.record_conversion_history(
-            self.original_message, None, "cancelled"
-        )
-        self.stop()
+def prompt_view(message: discord.Message) -> discord.ui.View:
+    view = discord.ui.View(timeout=None)
+    for action in ("convert", "cancel"):
+        view.add_item(ConversionButton(action, message.channel.id, message.id, message.author.id))
+    return view
 
 
 class ConversionCog(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.anonymous_post_cog: AnonymousPostCog = self.bot.get_cog("AnonymousPostCog")
+
+    async def cog_load(self):
+        self.bot.add_dynamic_items(ConversionButton)
+        self.sweep_prompts.start()
+
+    async def cog_unload(self):
+        self.sweep_prompts.cancel()
+        self.bot.remove_dynamic_items(ConversionButton)
+
+    @property
+    def anonymous_post_cog(self) -> AnonymousPostCog | None:
+        # Cogは並行して読み込まれるため、使用時に取得する
+        return self.bot.get_cog("AnonymousPostCog")
 
     async def get_guild_settings(self, db: Session, guild_id: str) -> dict:
         config_cog: "ConfigCog" = self.bot.get_cog("ConfigCog")
@@ -80,82 +96,202 @@ class ConversionCog(commands.Cog):
             return DEFAULT_SETTINGS
         return await config_cog.get_guild_settings(db, guild_id)
 
-    async def record_conversion_history(self, original_message: discord.Message, converted_message_id: int | None, status: str):
+    async def get_cached_settings(self, guild_id: str) -> dict:
+        """キャッシュ済みの設定があればセッションを開かずに返す"""
+        config_cog: "ConfigCog" = self.bot.get_cog("ConfigCog")
+        settings = config_cog.settings_cache.get(guild_id) if config_cog else None
+        if settings is None:
+            db: Session = next(get_db())
+            try:
+                settings = await self.get_guild_settings(db, guild_id)
+            finally:
+                db.close()
+        return settings
+
+    def record_conversion_history(self, guild_id: str, channel_id: str, user_id_signature: str, original_message_id: str, converted_message_id: int | None, status: str, is_thread: bool = False):
+        write_behind.add(
+            ConversionHistory,
+            guild_id=guild_id,
+            user_id_signature=user_id_signature,
+            original_message_id=original_message_id,
+            converted_message_id=str(converted_message_id) if converted_message_id else None,
+            channel_id=channel_id,
+            thread_id=channel_id if is_thread else None,
+            status=status,
+        )
+
+    async def prompt_signature(self, prompt) -> str:
+        """確認の投稿者の永続署名を導出する (PBKDF2のためイベントループの外で実行する)"""
+        settings = await self.get_cached_settings(prompt.guild_id)
+        return await asyncio.to_thread(encryptor.sign_persistent_user_id, prompt.user_id, settings.get('guild_salt', ''))
+
+    async def record_unconverted(self, prompt, status: str):
+        """変換されずに終わった確認を履歴に記録する"""
+        try:
+            signature = await self.prompt_signature(prompt)
+        except Exception as e:
+            logger.error(f"Failed to record conversion history: {e}")
+            return
+        self.record_conversion_history(prompt.guild_id, prompt.channel_id, signature, prompt.original_message_id, None, status, prompt.is_thread)
+
+    def claim_prompts(self, condition) -> list:
+        """条件に合う確認メッセージの行を削除して返す(ボタンとスイーパーが同じ行を二重に処理しないようにする)"""
         db: Session = next(get_db())
         try:
-            config_cog: "ConfigCog" = self.bot.get_cog("ConfigCog")
-            settings = await config_cog.get_guild_settings(db, str(original_message.guild.id))
-            guild_salt = settings.get('guild_salt', '')
-            
-            user_id = str(original_message.author.id)
-            user_id_signature = encryptor.sign_persistent_user_id(user_id, guild_salt)
-
-            history_entry = ConversionHistory(
-                guild_id=str(original_message.guild.id),
-                user_id_signature=user_id_signature,
-                original_message_id=str(original_message.id),
-                converted_message_id=str(converted_message_id) if converted_message_id else None,
-                channel_id=str(original_message.channel.id),
-                thread_id=str(original_message.channel.id) if isinstance(original_message.channel, discord.Thread) else None,
-                status=status,
-            )
-            db.add(history_entry)
+            rows = db.execute(delete(ConversionPrompt).where(condition).returning(*ConversionPrompt.__table__.columns)).all()
+            db.commit()
+            return rows
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def restore_prompt(self, prompt):
+        """変換に失敗した場合に、再試行と期限切れの片付けのために行を戻す"""
+        db: Session = next(get_db())
+        try:
+            db.execute(insert(ConversionPrompt).values(**prompt._mapping))
             db.commit()
         except Exception as e:
-            logger.error(f"Failed to record conversion history: {e}")
             db.rollback()
+            logger.error(f"Failed to restore conversion prompt: {e}")
         finally:
             db.close()
 
+    async def delete_prompt_message(self, channel_id: str, prompt_message_id: str):
+        try:
+            await self.bot.get_partial_messageable(int(channel_id)).get_partial_message(int(prompt_message_id)).delete()
+        except discord.NotFound:
+            pass  # Already deleted
+        except discord.HTTPException as e:
+            logger.warning(f"Failed to delete conversion prompt {prompt_message_id}: {e}")
+
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
         if message.author.bot or not message.guild:
             return
-        
+
+        # 変換対象チャンネル以外のメッセージは、DBに触れずにここで除外する
+        # (スレッドの場合は親チャンネル(フォーラム)が変換対象かを見る)
+        config_cog: "ConfigCog" = self.bot.get_cog("ConfigCog")
+        channel = message.channel
+        target_channel_id = channel.parent_id if isinstance(channel, discord.Thread) else channel.id
+        if not config_cog or target_channel_id not in config_cog.conversion_channel_ids(message.guild.id):
+            return
+
         # テキストチャンネルか、フォーラムチャンネル内のスレッドでのみ動作
-        is_text_channel = isinstance(message.channel, discord.TextChannel)
-        is_thread_in_forum = isinstance(message.channel, discord.Thread) and isinstance(message.channel.parent, discord.ForumChannel)
-        
+        is_text_channel = isinstance(channel, discord.TextChannel)
+        is_thread_in_forum = isinstance(channel, discord.Thread) and isinstance(channel.parent, discord.ForumChannel)
+
         if not is_text_channel and not is_thread_in_forum:
             return
 
         # Ensure AnonymousPostCog is ready
         if not self.anonymous_post_cog:
-            self.anonymous_post_cog = self.bot.get_cog("AnonymousPostCog")
-            if not self.anonymous_post_cog:
-                logger.warning("AnonymousPostCog not found, conversion feature will be disabled.")
-                return
+            logger.warning("AnonymousPostCog not found, conversion feature will be disabled.")
+            return
+
+        guild_id = str(message.guild.id)
+        settings = await self.get_cached_settings(guild_id)
+        timeout = settings.get("conversion_timeout", 30.0)
+
+        view = prompt_view(message)
+        confirmation_message = await message.reply("このメッセージを匿名投稿に変換しますか？", view=view)
+        # ボタンは ConversionButton が custom_id から処理するため、Viewをメモリに残さない
+        view.stop()
 
         db: Session = next(get_db())
         try:
-            settings = await self.get_guild_settings(db, str(message.guild.id))
-            conversion_enabled = settings.get("conversion_enabled", False)
-            if not conversion_enabled:
-                return
+            db.add(ConversionPrompt(
+                prompt_message_id=str(confirmation_message.id),
+                guild_id=guild_id,
+                channel_id=str(channel.id),
+                original_message_id=str(message.id),
+                user_id=str(message.author.id),
+                is_thread=isinstance(channel, discord.Thread),
+                expires_at=discord.utils.utcnow() + datetime.timedelta(seconds=float(timeout)),
+            ))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Failed to save conversion prompt: {e}")
+            await self.delete_prompt_message(str(channel.id), str(confirmation_message.id))
+        finally:
+            db.close()
 
-            conversion_channels = settings.get("conversion_channels", [])
-            timeout = settings.get("conversion_timeout", 30.0)
+    async def handle_convert(self, interaction: discord.Interaction, message_id: int):
+        await interaction.response.defer()
+        claimed = self.claim_prompts(ConversionPrompt.prompt_message_id == str(interaction.message.id))
+        if not claimed:
+            await interaction.followup.send("この確認は期限切れです。", ephemeral=True)
+            return
+        prompt = claimed[0]
 
-            target_channel_id = str(message.channel.id)
-            # スレッドの場合、親チャンネル（フォーラム）が変換対象かチェック
-            if isinstance(message.channel, discord.Thread):
-                target_channel_id = str(message.channel.parent_id)
+        if prompt.expires_at <= discord.utils.utcnow():
+            # スイーパーより先に押された期限切れの確認は、タイムアウトとして扱う
+            await self.delete_prompt_message(prompt.channel_id, prompt.prompt_message_id)
+            await self.record_unconverted(prompt, "timeout")
+            await interaction.followup.send("この確認は期限切れです。", ephemeral=True)
+            return
 
-            if target_channel_id in conversion_channels:
-                view = ConversionView(message.author, self, message, timeout)
-                confirmation_message = await message.reply(
-                    "このメッセージを匿名投稿に変換しますか？",
-                    view=view,
-                    delete_after=timeout
-                )
-                view.confirmation_message = confirmation_message
-        finally:
-            db.close()
+        try:
+            original_message = await interaction.channel.fetch_message(message_id)
+        except discord.NotFound:
+            await self.delete_prompt_message(prompt.channel_id, prompt.prompt_message_id)
+            await interaction.followup.send("元のメッセージが見つかりませんでした。", ephemeral=True)
+            return
+
+        try:
+            await self.convert_message(interaction, original_message)
+        except ValueError as e:
+            self.restore_prompt(prompt)
+            message = CONVERSION_ERROR_MESSAGES.get(str(e), "❌ メッセージが長すぎるか、その他の理由で変換できませんでした。")
+            await interaction.followup.send(message, ephemeral=True)
+            return
+        except Exception as e:
+            self.restore_prompt(prompt)
+            logger.error(f"Error during conversion: {e}", exc_info=True)
+            await interaction.followup.send("変換中に予期せぬエラーが発生しました。", ephemeral=True)
+            return
+        await self.delete_prompt_message(prompt.channel_id, prompt.prompt_message_id)
+
+    async def handle_cancel(self, interaction: discord.Interaction):
+        await interaction.response.defer()
+        for prompt in self.claim_prompts(ConversionPrompt.prompt_message_id == str(interaction.message.id)):
+            await self.delete_prompt_message(prompt.channel_id, prompt.prompt_message_id)
+            await self.record_unconverted(prompt, "cancelled")
+
+    @tasks.loop(seconds=CONVERSION_SWEEP_INTERVAL)
+    async def sweep_prompts(self):
+        """期限切れの確認メッセージを削除し、タイムアウトとして記録する"""
+        # 全ギルドの確認メッセージを対象にするため、シャードを複数プロセスで分担している場合は
+        # シャード0を担当するプロセスだけが実行する (同じメッセージを複数のプロセスで削除しない)
+        if not getattr(self.bot, 'is_primary_process', True):
+            return
+        while True:
+            try:
+                expired = select(ConversionPrompt.prompt_message_id).where(
+                    ConversionPrompt.expires_at <= discord.utils.utcnow()
+                ).order_by(ConversionPrompt.expires_at).limit(CONVERSION_SWEEP_BATCH_SIZE)
+                prompts = self.claim_prompts(ConversionPrompt.prompt_message_id.in_(expired.scalar_subquery()))
+            except Exception as e:
+                logger.error(f"Error sweeping conversion prompts: {e}")
+                return
+            for prompt in prompts:
+                await self.delete_prompt_message(prompt.channel_id, prompt.prompt_message_id)
+                await self.record_unconverted(prompt, "timeout")
+            if len(prompts) < CONVERSION_SWEEP_BATCH_SIZE:
+                return
+
+    @sweep_prompts.before_loop
+    async def before_sweep_prompts(self):
+        await self.bot.wait_until_ready()
 
     async def convert_message(self, interaction: discord.Interaction, original_message: discord.Message):
         db: Session = next(get_db())
         try:
-            new_post = await self.anonymous_post_cog._post_message(
+            new_post, identity = await self.anonymous_post_cog._post_message(
                 db=db,
                 guild_id=str(original_message.guild.id),
                 user=original_message.author,
@@ -166,9 +302,21 @@ class ConversionCog(commands.Cog):
                 original_message_id=str(original_message.id)
             )
             db.commit()
+            self.anonymous_post_cog._remember_post(new_post)
 
-            # 履歴を記録
-            await self.record_conversion_history(original_message, int(new_post.message_id), "converted")
+            # 履歴を記録 (署名は投稿時に導出したものを使い、PBKDF2をやり直さない)
+            try:
+                self.record_conversion_history(
+                    str(original_message.guild.id),
+                    str(original_message.channel.id),
+                    identity.persistent_signature,
+                    str(original_message.id),
+                    int(new_post.message_id),
+                    "converted",
+                    isinstance(original_message.channel, discord.Thread),
+                )
+            except Exception as e:
+                logger.error(f"Failed to record conversion history: {e}")
 
             # 元のメッセージを削除
             try:
@@ -1,39 +1,194 @@
+import asyncio
 import discord
 import logging
 import os
 import io
+import gzip
+import threading
 from discord.ext import commands, tasks
 from discord import app_commands
 import datetime
 import pytz
 from database import SessionLocal
 from models import BotLog
-from sqlalchemy import desc
+from utils.partitions import MonthlyPartitioner
+from utils.retention import RetentionEngine
+from utils.tracing import tracer
 
 logger = logging.getLogger(__name__)
 
+EXPORT_BATCH_SIZE = 1000
+# アップロード待ちにしておける完成済みファイルの数 (圧縮がアップロードより速い場合のメモリ上限)
+EXPORT_PARTS_IN_FLIGHT = 2
+# Discordのアップロード上限 (ギルド外で実行された場合)
+DEFAULT_UPLOAD_LIMIT = 10 * 1024 * 1024
+UPLOAD_LIMIT_MARGIN = 0.95
+# /shard_status に表示する遅いトレースの件数 (Embedのフィールド上限に収める)
+SHARD_STATUS_SLOW_TRACES = 5
+
+
+def parse_jst_datetime(value: str) -> datetime.datetime:
+    """JSTの日付または日時の文字列をdatetimeに変換する"""
+    for fmt in ('%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return pytz.timezone('Asia/Tokyo').localize(datetime.datetime.strptime(value.strip(), fmt))
+        except ValueError:
+            continue
+    raise ValueError(f"Invalid datetime: {value}")
+
+
+class GzipPartWriter:
+    """行をgzipで圧縮しながら書き込み、サイズ上限に達したら次のファイルに分ける"""
+
+    def __init__(self, max_bytes: int, filename_prefix: str):
+        self.max_bytes = max_bytes
+        self.filename_prefix = filename_prefix
+        self.part = 0
+        self.rows = 0
+        self._open()
+
+    def _open(self):
+        self.buffer = io.BytesIO()
+        self.gzip = gzip.GzipFile(fileobj=self.buffer, mode='wb')
+        self.part += 1
+        self.part_rows = 0
+        self.pending = 0  # 圧縮器に渡したがまだ出力されていない可能性のあるバイト数
+
+    def _finish(self) -> discord.File:
+        self.gzip.close()
+        self.buffer.seek(0)
+        return discord.File(self.buffer, filename=f"{self.filename_prefix}_{self.part}.txt.gz")
+
+    def write(self, line: str) -> discord.File | None:
+        """1行書き込む。ファイルが上限に達した場合は完成したファイルを返す"""
+        data = line.encode('utf-8')
+        finished = None
+        if self.part_rows and self.buffer.tell() + self.pending + len(data) > self.max_bytes:
+            # 圧縮後のサイズを確定させてから、本当に上限を超えるか判定する
+            self.gzip.flush()
+            self.pending = 0
+            if self.buffer.tell() + len(data) > self.max_bytes:
+                finished = self._finish()
+                self._open()
+        self.gzip.write(data)
+        self.pending += len(data)
+        self.part_rows += 1
+        self.rows += 1
+        return finished
+
+    def close(self) -> discord.File | None:
+        """最後のファイルを返す(書き込みがなければ None)"""
+        if not self.part_rows:
+            self.gzip.close()
+            return None
+        return self._finish()
+
+
+class LogExport:
+    """ログの読み出しと圧縮を別スレッドで行い、完成したファイルだけをイベントループに渡す"""
+
+    def __init__(self, level: str | None, start_date: datetime.datetime, end_date: datetime.datetime | None, newest_first: bool, max_bytes: int, filename_prefix: str):
+        self.level = level
+        self.start_date = start_date
+        self.end_date = end_date
+        self.newest_first = newest_first
+        self.writer = GzipPartWriter(max_bytes, filename_prefix)
+        self.parts: asyncio.Queue[discord.File | None] = asyncio.Queue()
+        self._loop = asyncio.get_running_loop()
+        self._slots = threading.Semaphore(EXPORT_PARTS_IN_FLIGHT)
+        self._stopped = threading.Event()
+
+    def _hand_over(self, part: discord.File | None) -> bool:
+        """完成したファイルをキューに渡す。アップロードが詰まっている間は待ち、中止されたら False を返す"""
+        if part is not None:
+            self._slots.acquire()
+            if self._stopped.is_set():
+                return False
+        self._loop.call_soon_threadsafe(self.parts.put_nowait, part)
+        return True
+
+    def run(self) -> int:
+        """別スレッドで実行する。書き込んだ行数を返し、最後にキューへ None を渡す"""
+        db = SessionLocal()
+        try:
+            query = db.query(BotLog.created_at, BotLog.level, BotLog.logger_name, BotLog.message)
+
+            # (level, created_at) の複合インデックスを使う
+            if self.level:
+                query = query.filter(BotLog.level == self.level.upper())
+            query = query.filter(BotLog.created_at >= self.start_date)
+            if self.end_date:
+                query = query.filter(BotLog.created_at < self.end_date)
+
+            if self.newest_first:
+                query = query.order_by(BotLog.created_at.desc())
+            else:
+                query = query.order_by(BotLog.created_at.asc())
+
+            jst = pytz.timezone('Asia/Tokyo')
+            for log in query.yield_per(EXPORT_BATCH_SIZE):
+                jst_time = log.created_at.astimezone(jst)
+                part = self.writer.write(f"[{jst_time.strftime('%Y-%m-%d %H:%M:%S')}] [{log.level:<8}] {log.logger_name}: {log.message}\n")
+                if part and not self._hand_over(part):
+                    return self.writer.rows
+            part = self.writer.close()
+            if part:
+                self._hand_over(part)
+            return self.writer.rows
+        finally:
+            db.close()
+            self._hand_over(None)
+
+    def uploaded(self):
+        """1ファイルのアップロードが終わった"""
+        self._slots.release()
+
+    def stop(self):
+        """アップロードを中止し、待機中のスレッドを終わらせる"""
+        self._stopped.set()
+        self._slots.release()
+
+
 class LogViewer(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.retention_engine = RetentionEngine()
         self.cleanup_logs.start()
 
-    def cog_unload(self):
-        self.cleanup_logs.cancel()
+    async def cog_load(self):
+        # どのプロセスもログを書き込むため、保持期間の処理 (プライマリのみ) を待たずに起動時にパーティションを用意する
+        await asyncio.to_thread(self.ensure_log_partitions)
 
-    @tasks.loop(hours=24)
-    async def cleanup_logs(self):
+    def ensure_log_partitions(self):
+        partitioner = MonthlyPartitioner(BotLog.__tablename__)
         db = SessionLocal()
         try:
-            one_year_ago = datetime.datetime.utcnow() - datetime.timedelta(days=365)
-            db.query(BotLog).filter(BotLog.created_at < one_year_ago).delete()
-            db.commit()
-            logger.info("Old bot logs have been deleted.")
+            if partitioner.is_partitioned(db):
+                partitioner.ensure_partitions(db)
         except Exception as e:
-            logger.error(f"Error cleaning up bot logs: {e}")
             db.rollback()
+            # 他のプロセスが同時に作成した場合など。DEFAULTパーティションがあるため書き込みは失敗しない
+            logger.warning(f"Failed to ensure bot_logs partitions: {e}")
         finally:
             db.close()
 
+    def cog_unload(self):
+        self.cleanup_logs.cancel()
+
+    @tasks.loop(hours=24)
+    async def cleanup_logs(self):
+        """保持期間を過ぎたログ・履歴を各テーブルから削除する"""
+        # シャードを複数プロセスで分担している場合は、シャード0を担当するプロセスだけが実行する
+        if not getattr(self.bot, 'is_primary_process', True):
+            return
+        try:
+            report = await self.retention_engine.run()
+            total = sum(r['deleted'] or 0 for r in report.values())
+            seconds = sum(r['seconds'] for r in report.values())
+            logger.info(f"Retention run finished: {total} rows deleted in {seconds:.3f}s")
+        except Exception as e:
+            logger.error(f"Error running retention: {e}")
+
     @cleanup_logs.before_loop
     async def before_cleanup_logs(self):
         await self.bot.wait_until_ready()
@@ -42,45 +197,72 @@ class LogViewer(commands.Cog):
     @app_commands.default_permissions(manage_guild=True)
     @app_commands.describe(
         level="ログレベル (INFO, WARNING, ERROR, CRITICAL)",
-        days="表示する日数 (1-30)",
-        limit="表示する件数 (1-1000)"
+        days="表示する日数 (since を指定しない場合)",
+        since="開始日時 (JST, 例: 2024-01-31 または 2024-01-31 12:00)",
+        until="終了日時 (JST, 例: 2024-02-01)",
+        newest_first="新しい順に出力するか (デフォルト: True)"
     )
-    async def view_bot_logs(self, interaction: discord.Interaction, level: str = None, days: int = 7, limit: int = 100):
+    async def view_bot_logs(self, interaction: discord.Interaction, level: str = None, days: int = 7, since: str = None, until: str = None, newest_first: bool = True):
         if not await self.bot.is_owner(interaction.user):
             await interaction.response.send_message("このコマンドはBOTのオーナーのみが実行できます。", ephemeral=True)
             return
         await interaction.response.defer(ephemeral=True)
 
-        db = SessionLocal()
         try:
-            query = db.query(BotLog)
-
-            if level:
-                query = query.filter(BotLog.level == level.upper())
+            start_date = parse_jst_datetime(since) if since else datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days)
+            end_date = parse_jst_datetime(until) if until else None
+        except ValueError:
+            await interaction.followup.send("日時の形式が正しくありません。(例: 2024-01-31 または 2024-01-31 12:00)", ephemeral=True)
+            return
 
-            if days:
-                start_date = datetime.datetime.utcnow() - datetime.timedelta(days=days)
-                query = query.filter(BotLog.created_at >= start_date)
+        upload_limit = interaction.guild.filesize_limit if interaction.guild else DEFAULT_UPLOAD_LIMIT
+        timestamp = datetime.datetime.utcnow().strftime('%Y%m%d_%H%M%S')
+        export = LogExport(level, start_date, end_date, newest_first, int(upload_limit * UPLOAD_LIMIT_MARGIN), f"bot_logs_{timestamp}")
 
-            query = query.order_by(BotLog.created_at.asc()).limit(limit)
+        # 読み出しと圧縮はイベントループを止めないよう別スレッドで行い、完成したファイルから順にアップロードする
+        export_task = asyncio.create_task(asyncio.to_thread(export.run))
+        try:
+            while (part := await export.parts.get()) is not None:
+                await interaction.followup.send(file=part, ephemeral=True)
+                export.uploaded()
+            rows = await export_task
+        finally:
+            export.stop()
 
-            logs = query.all()
+        if not rows:
+            await interaction.followup.send("指定された条件のログは見つかりませんでした。", ephemeral=True)
 
-            if not logs:
-                await interaction.followup.send("指定された条件のログは見つかりませんでした。", ephemeral=True)
-                return
+    @app_commands.command(name="shard_status", description="シャードごとのレイテンシとギルド数を表示します。")
+    @app_commands.default_permissions(manage_guild=True)
+    async def shard_status(self, interaction: discord.Interaction):
+        if not await self.bot.is_owner(interaction.user):
+            await interaction.response.send_message("このコマンドはBOTのオーナーのみが実行できます。", ephemeral=True)
+            return
 
-            log_content = ""
-            for log in logs:
-                jst_time = log.created_at.astimezone(pytz.timezone('Asia/Tokyo'))
-                log_content += f"[{jst_time.strftime('%Y-%m-%d %H:%M:%S')}] [{log.level:<8}] {log.logger_name}: {log.message}\n"
+        embed = discord.Embed(title="シャードの状態", color=discord.Color.blue())
+        embed.description = f"シャード数: {self.bot.shard_count or 1} / このプロセスのギルド数: {len(self.bot.guilds)}"
+        for stat in self.bot.shard_stats():
+            latency = "未接続" if stat['latency_ms'] != stat['latency_ms'] else f"{stat['latency_ms']:.0f}ms"
+            embed.add_field(name=f"シャード {stat['shard_id']}", value=f"レイテンシ: {latency}\nギルド数: {stat['guilds']}", inline=True)
 
-            log_file = io.BytesIO(log_content.encode('utf-8'))
-            timestamp = datetime.datetime.utcnow().strftime('%Y%m%d_%H%M%S')
-            await interaction.followup.send(file=discord.File(log_file, filename=f"bot_logs_{timestamp}.txt"), ephemeral=True)
+        anonymous_post_cog = self.bot.get_cog("AnonymousPostCog")
+        if anonymous_post_cog:
+            dispatcher = anonymous_post_cog.log_dispatcher
+            embed.add_field(
+                name="ログ送信キュー",
+                value=f"待機中: {dispatcher.queue_depth()}件\n送信: {dispatcher.sent_messages} / 失敗: {dispatcher.failed_messages} / 破棄: {dispatcher.dropped}",
+                inline=False
+            )
 
-        finally:
-            db.close()
+        # このプロセスで記録された最も遅いトレース (内訳はステージごとの所要時間)
+        slowest = tracer.slowest()[:SHARD_STATUS_SLOW_TRACES]
+        if slowest:
+            embed.add_field(
+                name="遅いトレース",
+                value="\n".join(f"`{breakdown[:150]}`" for _, _, breakdown in slowest),
+                inline=False
+            )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
 
 
 async def setup(bot):
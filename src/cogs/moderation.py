@@ -1,5 +1,5 @@
+import os
 import math
-import re
 import logging
 from enum import Enum
 from datetime import datetime, timedelta
@@ -7,44 +7,98 @@ from datetime import datetime, timedelta
 import discord
 from discord import app_commands
 from discord.ext import commands
+from sqlalchemy import func, literal, literal_column, select
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm import Session
 
-from cogs.config import ConfigCog
+from cogs.config import DEFAULT_SETTINGS, ConfigCog
 from database import get_db
-from models import AdminCommandLog, AnonymousPost, GuildBannedUser, BotBannedUser, BulkDeleteHistory
+from models import AdminCommandLog, AnonymousPost, GuildBannedUser, BotBannedUser, BatchDeleteJob
+from utils.batch_delete import BatchDeleteWorker, count_targets, estimate_run, preview_targets
 from utils.crypto import Encryptor
+from utils.pagination import KeysetPaginationView
+from utils.post_cache import recent_posts
+from utils.post_validation import ban_index
+from utils.write_behind import write_behind
 
 logger = logging.getLogger(__name__)
 encryptor = Encryptor()
 
 
-class UserPostsView(discord.ui.View):
-    def __init__(self, bot, guild_id: str, user: discord.User, posts: list[AnonymousPost]):
-        super().__init__(timeout=180)
-        self.bot = bot
-        self.guild_id = guild_id
+# admin_logs / search_posts の件数はこの値を上限に数える
+ADMIN_LOG_COUNT_CAP = 1000
+SEARCH_COUNT_CAP = 1000
+# 日本語を扱えるテキスト検索設定を指定すると、本文検索に全文検索 (tsvector) を使う
+# 未指定の場合は pg_trgm のインデックスが効く ILIKE で検索する (3文字以上)
+POST_SEARCH_TS_CONFIG = os.getenv("POST_SEARCH_TS_CONFIG")
+SEARCH_MIN_QUERY_LENGTH = 1 if POST_SEARCH_TS_CONFIG else 3
+
+
+def content_search_filter(query: str):
+    """本文検索の条件を返す。マイグレーションで作成したインデックスと同じ式を使う"""
+    if POST_SEARCH_TS_CONFIG:
+        ts_config = literal_column(f"'{POST_SEARCH_TS_CONFIG}'::regconfig")
+        document = func.to_tsvector(ts_config, AnonymousPost.content)
+        return document.bool_op('@@')(func.plainto_tsquery(ts_config, query))
+    return AnonymousPost.content.icontains(query, autoescape=True)
+
+
+def capped_count(db: Session, query, cap: int) -> tuple[int, bool]:
+    """最大 cap 件までの件数と、上限を超えたかどうかを返す"""
+    count = db.query(func.count()).select_from(query.limit(cap + 1).subquery()).scalar()
+    return min(count, cap), count > cap
+
+
+def matching_daily_signatures(db: Session, filters: list, sign_search_tag) -> tuple[list[str], int]:
+    """条件内の投稿から、search_tag が一致する日次署名とその投稿数を求める
+
+    search_tag は (ユーザー, 日) ごとに同じ値になるため、日次署名単位で1回ずつ照合する。
+    """
+    tag_groups = db.query(
+        AnonymousPost.daily_user_id_signature,
+        AnonymousPost.search_tag,
+        func.count(AnonymousPost.id)
+    ).filter(*filters).group_by(
+        AnonymousPost.daily_user_id_signature,
+        AnonymousPost.search_tag
+    ).all()
+
+    matched_signatures = []
+    total_posts = 0
+    for daily_signature, search_tag, count in tag_groups:
+        if sign_search_tag(daily_signature) == search_tag:
+            matched_signatures.append(daily_signature)
+            total_posts += count
+    return matched_signatures, total_posts
+
+
+class UserPostsView(KeysetPaginationView):
+    def __init__(self, bot, guild_id: str, user: discord.User, filters: list, total: int):
+        columns = [
+            AnonymousPost.id,
+            AnonymousPost.created_at,
+            AnonymousPost.channel_id,
+            AnonymousPost.message_id,
+            AnonymousPost.anonymous_id,
+            AnonymousPost.is_converted,
+            AnonymousPost.attachment_urls,
+            AnonymousPost.content,
+            AnonymousPost.deleted_at,
+        ]
+        super().__init__(bot, guild_id, AnonymousPost, columns, filters, total)
         self.user = user
-        self.posts = posts
-        self.current_page = 1
-        self.posts_per_page = 10
-        self.total_pages = math.ceil(len(self.posts) / self.posts_per_page)
-
-    async def get_page_embed(self) -> discord.Embed:
-        start_index = (self.current_page - 1) * self.posts_per_page
-        end_index = start_index + self.posts_per_page
-        page_posts = self.posts[start_index:end_index]
 
+    async def build_embed(self, rows: list) -> discord.Embed:
         embed = discord.Embed(
             title=f"{self.user.name} の匿名投稿",
             color=discord.Color.purple()
         )
-        embed.set_footer(text=f"ページ {self.current_page}/{self.total_pages} ({len(self.posts)}件)")
 
-        if not page_posts:
+        if not rows:
             embed.description = "このページに投稿はありません。"
             return embed
 
-        for post in page_posts:
+        for post in rows:
             channel = self.bot.get_channel(int(post.channel_id))
             channel_name = f"#{channel.name}" if channel else "不明なチャンネル"
             message_link = f"https://discord.com/channels/{self.guild_id}/{post.channel_id}/{post.message_id}"
@@ -72,101 +126,113 @@ class UserPostsView(discord.ui.View):
             
         return embed
 
-    @discord.ui.button(label="◀️ 前へ", style=discord.ButtonStyle.grey)
-    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if self.current_page > 1:
-            self.current_page -= 1
-            embed = await self.get_page_embed()
-            await interaction.response.edit_message(embed=embed, view=self)
-        else:
-
-            await interaction.response.defer()
-
-    @discord.ui.button(label="次へ ▶️", style=discord.ButtonStyle.grey)
-    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if self.current_page < self.total_pages:
-            self.current_page += 1
-            embed = await self.get_page_embed()
-            await interaction.response.edit_message(embed=embed, view=self)
-        else:
-            await interaction.response.defer()
-
-
-class AdminLogView(discord.ui.View):
-    def __init__(self, bot, guild_id: str, logs: list[AdminCommandLog], total_logs: int, title: str):
-        super().__init__(timeout=180)
-        self.bot = bot
-        self.guild_id = guild_id
-        self.logs = logs
-        self.total_logs = total_logs
+
+class SearchPostsView(KeysetPaginationView):
+    def __init__(self, bot, guild_id: str, query: str, filters: list, total: int, total_capped: bool):
+        columns = [
+            AnonymousPost.id,
+            AnonymousPost.created_at,
+            AnonymousPost.channel_id,
+            AnonymousPost.message_id,
+            AnonymousPost.anonymous_id,
+            AnonymousPost.content,
+            AnonymousPost.deleted_at,
+        ]
+        super().__init__(bot, guild_id, AnonymousPost, columns, filters, total, total_capped, descending=True)
+        self.query = query
+
+    async def build_embed(self, rows: list) -> discord.Embed:
+        embed = discord.Embed(title=f"「{self.query}」の検索結果", color=discord.Color.blue())
+
+        if not rows:
+            embed.description = "このページに投稿はありません。"
+            return embed
+
+        for post in rows:
+            channel = self.bot.get_channel(int(post.channel_id))
+            channel_name = f"#{channel.name}" if channel else "不明なチャンネル"
+            message_link = f"https://discord.com/channels/{self.guild_id}/{post.channel_id}/{post.message_id}"
+
+            title = f"投稿日時: {post.created_at.strftime('%Y-%m-%d %H:%M:%S')}"
+            if post.deleted_at:
+                title = f"(削除済み) {title}"
+
+            content_preview = (post.content[:200] + '...') if len(post.content) > 200 else post.content
+            value = (
+                f"**チャンネル:** {channel_name} / [リンク]({message_link})\n"
+                f"**匿名ID:** `{post.anonymous_id}`\n"
+                f"```{content_preview}```"
+            )
+            embed.add_field(name=title, value=value, inline=False)
+
+        return embed
+
+
+class AdminLogView(KeysetPaginationView):
+    def __init__(self, bot, guild_id: str, filters: list, total_logs: int, total_capped: bool, title: str):
+        columns = [
+            AdminCommandLog.id,
+            AdminCommandLog.created_at,
+            AdminCommandLog.command_name,
+            AdminCommandLog.executed_by,
+            AdminCommandLog.target_user_id,
+            AdminCommandLog.success,
+        ]
+        super().__init__(bot, guild_id, AdminCommandLog, columns, filters, total_logs, total_capped)
         self.title = title
-        self.current_page = 1
-        self.logs_per_page = 10
-        self.total_pages = math.ceil(len(self.logs) / self.logs_per_page)
-        self.encryptor = Encryptor()
+        self.guild_salt = None
+        self.encryptor = encryptor
 
-    async def get_page_embed(self) -> discord.Embed:
-        start_index = (self.current_page - 1) * self.logs_per_page
-        end_index = start_index + self.logs_per_page
-        page_logs = self.logs[start_index:end_index]
+    async def get_guild_salt(self) -> str:
+        if self.guild_salt is None:
+            config_cog: ConfigCog = self.bot.get_cog("ConfigCog")
+            settings = config_cog.settings_cache.get(self.guild_id)
+            if settings is None:
+                db: Session = next(get_db())
+                try:
+                    settings = await config_cog.get_guild_settings(db, self.guild_id)
+                finally:
+                    db.close()
+            self.guild_salt = settings['guild_salt']
+        return self.guild_salt
 
+    async def get_user(self, user_id: int) -> discord.User:
+        return self.bot.get_user(user_id) or await self.bot.fetch_user(user_id)
+
+    async def build_embed(self, rows: list) -> discord.Embed:
         embed = discord.Embed(title=self.title, color=discord.Color.dark_gold())
-        embed.set_footer(text=f"ページ {self.current_page}/{self.total_pages} ({self.total_logs}件)")
 
-        if not page_logs:
+        if not rows:
             embed.description = "このページにログはありません。"
             return embed
 
-        db: Session = next(get_db())
-        try:
-            config_cog: ConfigCog = self.bot.get_cog("ConfigCog")
-            settings = await config_cog.get_guild_settings(db, self.guild_id)
-            guild_salt = settings['guild_salt']
+        # 復号は表示するページの行だけに行う
+        guild_salt = await self.get_guild_salt() if any(log.target_user_id for log in rows) else None
 
-            for log in page_logs:
-                executor = await self.bot.fetch_user(int(log.executed_by))
-                
-                value_str = f"**実行者:** {executor.mention} (`{log.executed_by}`)\n"
-                
-                if log.target_user_id:
-                    decrypted_id = self.encryptor.decrypt(log.target_user_id, guild_salt)
-                    if decrypted_id:
-                        target_user = await self.bot.fetch_user(int(decrypted_id))
-                        value_str += f"**対象者:** {target_user.mention} (`{decrypted_id}`)\n"
-                    else:
-                        value_str += f"**対象者:** `ID復号失敗`\n"
-
-                value_str += f"**実行日時:** {log.created_at.strftime('%Y-%m-%d %H:%M:%S')}\n"
-                value_str += f"**成功/失敗:** {'✅ Success' if log.success else '❌ Failure'}"
-
-                embed.add_field(
-                    name=f"コマンド: `{log.command_name}`",
-                    value=value_str,
-                    inline=False
-                )
-        finally:
-            db.close()
+        for log in rows:
+            executor = await self.get_user(int(log.executed_by))
+            
+            value_str = f"**実行者:** {executor.mention} (`{log.executed_by}`)\n"
+            
+            if log.target_user_id:
+                decrypted_id = self.encryptor.decrypt(log.target_user_id, guild_salt)
+                if decrypted_id:
+                    target_user = await self.get_user(int(decrypted_id))
+                    value_str += f"**対象者:** {target_user.mention} (`{decrypted_id}`)\n"
+                else:
+                    value_str += f"**対象者:** `ID復号失敗`\n"
+
+            value_str += f"**実行日時:** {log.created_at.strftime('%Y-%m-%d %H:%M:%S')}\n"
+            value_str += f"**成功/失敗:** {'✅ Success' if log.success else '❌ Failure'}"
+
+            embed.add_field(
+                name=f"コマンド: `{log.command_name}`",
+                value=value_str,
+                inline=False
+            )
             
         return embed
 
-    @discord.ui.button(label="◀️ 前へ", style=discord.ButtonStyle.grey)
-    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if self.current_page > 1:
-            self.current_page -= 1
-            embed = await self.get_page_embed()
-            await interaction.response.edit_message(embed=embed, view=self)
-        else:
-            await interaction.response.defer()
-
-    @discord.ui.button(label="次へ ▶️", style=discord.ButtonStyle.grey)
-    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if self.current_page < self.total_pages:
-            self.current_page += 1
-            embed = await self.get_page_embed()
-            await interaction.response.edit_message(embed=embed, view=self)
-        else:
-            await interaction.response.defer()
-
 
 class Scope(Enum):
     current_channel = "current_channel"
@@ -191,6 +257,7 @@ class AdminCommands(Enum):
     unban = "unban"
     trace = "trace"
     user_posts = "user_posts"
+    search_posts = "search_posts"
     bulk_delete = "bulk_delete"
     admin_logs = "admin_logs"
 
@@ -204,6 +271,13 @@ class DeletedStatus(Enum):
 class ModerationCog(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        self.batch_delete_worker = BatchDeleteWorker(bot)
+
+    async def cog_load(self):
+        self.batch_delete_worker.start()
+
+    async def cog_unload(self):
+        await self.batch_delete_worker.close()
 
     @app_commands.command(name="ban", description="ユーザーをこのサーバーの匿名投稿からBANします。")
     @app_commands.describe(user="BAN対象のユーザー", global_ban="BOT全体からBANするかどうか (デフォルト: False)")
@@ -235,6 +309,7 @@ class ModerationCog(commands.Cog):
                 new_ban = BotBannedUser(user_id=user_id, banned_by=banned_by_id)
                 db.add(new_ban)
                 db.commit()
+                ban_index.add(None, user_id)
                 await interaction.followup.send(f"✅ {user.mention} をグローバルBANしました。", ephemeral=True)
             else:
                 existing_ban = db.query(GuildBannedUser).filter_by(guild_id=guild_id, user_id=user_id).first()
@@ -244,6 +319,7 @@ class ModerationCog(commands.Cog):
                 new_ban = GuildBannedUser(guild_id=guild_id, user_id=user_id, banned_by=banned_by_id)
                 db.add(new_ban)
                 db.commit()
+                ban_index.add(guild_id, user_id)
                 await interaction.followup.send(f"✅ {user.mention} をこのサーバーの匿名投稿からBANしました。", ephemeral=True)
             
             success = True
@@ -253,7 +329,8 @@ class ModerationCog(commands.Cog):
             logger.error(f"An error occurred in 'ban' command.", exc_info=True)
             await interaction.followup.send(f"❌ エラーが発生しました。管理者に連絡してください。", ephemeral=True)
         finally:
-            log = AdminCommandLog(
+            write_behind.add(
+                AdminCommandLog,
                 guild_id=str(interaction.guild.id),
                 command_name='ban',
                 executed_by=str(interaction.user.id),
@@ -261,8 +338,6 @@ class ModerationCog(commands.Cog):
                 params={'user_id': str(user.id), 'global_ban': global_ban},
                 success=success
             )
-            db.add(log)
-            db.commit()
             db.close()
 
     @app_commands.command(name="unban", description="ユーザーの匿名投稿BANを解除します。")
@@ -292,6 +367,7 @@ class ModerationCog(commands.Cog):
                     return
                 db.delete(ban_to_remove)
                 db.commit()
+                ban_index.remove(None, user_id)
                 await interaction.followup.send(f"✅ {user.mention} のグローバルBANを解除しました。", ephemeral=True)
             else:
                 ban_to_remove = db.query(GuildBannedUser).filter_by(guild_id=guild_id, user_id=user_id).first()
@@ -300,6 +376,7 @@ class ModerationCog(commands.Cog):
                     return
                 db.delete(ban_to_remove)
                 db.commit()
+                ban_index.remove(guild_id, user_id)
                 await interaction.followup.send(f"✅ {user.mention} のBANを解除しました。", ephemeral=True)
 
             success = True
@@ -309,7 +386,8 @@ class ModerationCog(commands.Cog):
             logger.error(f"An error occurred in 'unban' command.", exc_info=True)
             await interaction.followup.send(f"❌ エラーが発生しました。管理者に連絡してください。", ephemeral=True)
         finally:
-            log = AdminCommandLog(
+            write_behind.add(
+                AdminCommandLog,
                 guild_id=str(interaction.guild.id),
                 command_name='unban',
                 executed_by=str(interaction.user.id),
@@ -317,8 +395,6 @@ class ModerationCog(commands.Cog):
                 params={'user_id': str(user.id), 'global_unban': global_unban},
                 success=success
             )
-            db.add(log)
-            db.commit()
             db.close()
 
     @app_commands.command(name="trace", description="メッセージIDから投稿者を特定します。")
@@ -332,7 +408,7 @@ class ModerationCog(commands.Cog):
         try:
             guild_id = str(interaction.guild.id)
 
-            post = db.query(AnonymousPost).filter_by(guild_id=guild_id, message_id=message_id).first()
+            post = recent_posts.get(message_id, guild_id) or db.query(AnonymousPost).filter_by(guild_id=guild_id, message_id=message_id).first()
             if not post:
                 await interaction.followup.send("❌ 指定されたメッセージIDの投稿が見つかりません。", ephemeral=True)
                 return
@@ -346,6 +422,12 @@ class ModerationCog(commands.Cog):
             if decrypted_user_id:
                 user = await self.bot.fetch_user(int(decrypted_user_id))
                 member = interaction.guild.get_member(user.id)
+                if member is None:
+                    # 省メモリモードではメンバーをキャッシュしないため取得する
+                    try:
+                        member = await interaction.guild.fetch_member(user.id)
+                    except discord.NotFound:
+                        member = None
 
                 embed = discord.Embed(title="投稿者特定結果", color=discord.Color.orange())
                 embed.set_author(name=f"{user.name} ({user.id})", icon_url=user.display_avatar.url)
@@ -377,7 +459,8 @@ class ModerationCog(commands.Cog):
             logger.error(f"An error occurred in 'trace' command.", exc_info=True)
             await interaction.followup.send(f"❌ エラーが発生しました。管理者に連絡してください。", ephemeral=True)
         finally:
-            log = AdminCommandLog(
+            write_behind.add(
+                AdminCommandLog,
                 guild_id=str(interaction.guild.id),
                 command_name='trace',
                 executed_by=str(interaction.user.id),
@@ -385,8 +468,6 @@ class ModerationCog(commands.Cog):
                 params={'message_id': message_id},
                 success=success
             )
-            db.add(log)
-            db.commit()
             db.close()
 
     @app_commands.command(name="user_posts", description="指定したユーザーの匿名投稿を検索します。")
@@ -415,31 +496,28 @@ class ModerationCog(commands.Cog):
             encrypted_user_id = encryptor.encrypt(user_id, guild_salt)
 
             start_date = discord.utils.utcnow() - timedelta(days=days)
-            query = db.query(AnonymousPost).filter(
+            filters = [
                 AnonymousPost.guild_id == guild_id,
-                AnonymousPost.created_at >= start_date
-            )
+                AnonymousPost.created_at >= start_date,
+            ]
 
             if deleted_status == DeletedStatus.deleted_only:
-                query = query.filter(AnonymousPost.deleted_at.isnot(None))
+                filters.append(AnonymousPost.deleted_at.isnot(None))
             elif deleted_status == DeletedStatus.exclude_deleted:
-                query = query.filter(AnonymousPost.deleted_at.is_(None))
-
-            posts_in_period = query.order_by(AnonymousPost.created_at.asc()).all()
+                filters.append(AnonymousPost.deleted_at.is_(None))
 
-            user_posts_found = []
-            for post in posts_in_period:
-                recalculated_tag = encryptor.sign_search_tag(post.daily_user_id_signature, user_id, guild_salt)
-                if recalculated_tag == post.search_tag:
-                    user_posts_found.append(post)
+            matched_signatures, total_posts = matching_daily_signatures(
+                db, filters, encryptor.search_tag_signer(user_id, guild_salt)
+            )
 
-            if not user_posts_found:
+            if not matched_signatures:
                 await interaction.followup.send(f"ℹ️ {user.mention} による過去{days}日間の匿名投稿は見つかりませんでした。", ephemeral=True)
                 # This is not an error, so we mark it as a success.
                 success = True
                 return
 
-            view = UserPostsView(self.bot, guild_id, user, user_posts_found)
+            filters.append(AnonymousPost.daily_user_id_signature.in_(matched_signatures))
+            view = UserPostsView(self.bot, guild_id, user, filters, total_posts)
             embed = await view.get_page_embed()
 
             await interaction.followup.send(embed=embed, view=view, ephemeral=True)
@@ -450,7 +528,8 @@ class ModerationCog(commands.Cog):
             logger.error(f"An error occurred in 'user_posts' command.", exc_info=True)
             await interaction.followup.send(f"❌ エラーが発生しました。管理者に連絡してください。", ephemeral=True)
         finally:
-            log = AdminCommandLog(
+            write_behind.add(
+                AdminCommandLog,
                 guild_id=str(interaction.guild.id),
                 command_name='user_posts',
                 executed_by=str(interaction.user.id),
@@ -458,8 +537,68 @@ class ModerationCog(commands.Cog):
                 params={'days': days, 'deleted_status': deleted_status.value},
                 success=success
             )
-            db.add(log)
-            db.commit()
+            db.close()
+
+    @app_commands.command(name="search_posts", description="匿名投稿の本文を検索します。")
+    @app_commands.describe(
+        query="検索する文字列",
+        channel="検索対象のチャンネル（省略時はサーバー全体）",
+        days="検索する日数（1-90、デフォルト30）",
+        deleted_status="削除済みメッセージの扱い"
+    )
+    @app_commands.default_permissions(view_audit_log=True)
+    async def search_posts(self, interaction: discord.Interaction, query: str, channel: discord.TextChannel = None, days: int = 30, deleted_status: DeletedStatus = DeletedStatus.exclude_deleted):
+        await interaction.response.defer(ephemeral=True)
+        db: Session = next(get_db())
+        success = False
+        try:
+            if not 1 <= days <= 90:
+                await interaction.followup.send("❌ 日数は1から90の間で指定してください。", ephemeral=True)
+                return
+            if len(query) < SEARCH_MIN_QUERY_LENGTH:
+                await interaction.followup.send(f"❌ 検索文字列は{SEARCH_MIN_QUERY_LENGTH}文字以上で指定してください。", ephemeral=True)
+                return
+
+            guild_id = str(interaction.guild.id)
+            start_date = discord.utils.utcnow() - timedelta(days=days)
+            filters = [
+                AnonymousPost.guild_id == guild_id,
+                AnonymousPost.created_at >= start_date,
+                content_search_filter(query),
+            ]
+            if channel:
+                filters.append(AnonymousPost.channel_id == str(channel.id))
+
+            if deleted_status == DeletedStatus.deleted_only:
+                filters.append(AnonymousPost.deleted_at.isnot(None))
+            elif deleted_status == DeletedStatus.exclude_deleted:
+                filters.append(AnonymousPost.deleted_at.is_(None))
+
+            total, total_capped = capped_count(db, db.query(AnonymousPost.id).filter(*filters), SEARCH_COUNT_CAP)
+            if not total:
+                await interaction.followup.send(f"ℹ️ 「{query}」を含む過去{days}日間の匿名投稿は見つかりませんでした。", ephemeral=True)
+                success = True
+                return
+
+            view = SearchPostsView(self.bot, guild_id, query, filters, total, total_capped)
+            embed = await view.get_page_embed()
+
+            await interaction.followup.send(embed=embed, view=view, ephemeral=True)
+            success = True
+
+        except Exception as e:
+            db.rollback()
+            logger.error(f"An error occurred in 'search_posts' command.", exc_info=True)
+            await interaction.followup.send(f"❌ エラーが発生しました。管理者に連絡してください。", ephemeral=True)
+        finally:
+            write_behind.add(
+                AdminCommandLog,
+                guild_id=str(interaction.guild.id),
+                command_name='search_posts',
+                executed_by=str(interaction.user.id),
+                params={'query': query, 'channel_id': str(channel.id) if channel else None, 'days': days, 'deleted_status': deleted_status.value},
+                success=success
+            )
             db.close()
 
     @app_commands.command(name="bulk_delete", description="条件を指定して匿名投稿をまとめて削除します。")
@@ -478,16 +617,27 @@ class ModerationCog(commands.Cog):
         
         try:
             guild_id = str(interaction.guild.id)
-            
-            query = db.query(AnonymousPost).filter(
+            config_cog: ConfigCog = self.bot.get_cog("ConfigCog")
+            settings = await config_cog.get_guild_settings(db, guild_id)
+
+            scope_filters = [
                 AnonymousPost.guild_id == guild_id,
                 AnonymousPost.deleted_at.is_(None)
-            )
+            ]
+            conditions = {
+                'scope': scope.value,
+                'type': condition_type.value,
+                'value': condition_value,
+                'channel_id': None,
+                # 実行後に投稿されたメッセージは対象にしない
+                'max_post_id': db.query(func.max(AnonymousPost.id)).filter(AnonymousPost.guild_id == guild_id).scalar() or 0,
+            }
 
             if scope == Scope.current_channel:
-                query = query.filter(AnonymousPost.channel_id == str(interaction.channel_id))
-            
-            posts_to_delete = []
+                conditions['channel_id'] = str(interaction.channel_id)
+                scope_filters.append(AnonymousPost.channel_id == conditions['channel_id'])
+
+            # 時刻や件数に依存する条件は、ジョブを再開しても対象が変わらないようにここで解決しておく
             if condition_type == ConditionType.user:
                 try:
                     target_user = await commands.UserConverter().convert(interaction, condition_value)
@@ -495,80 +645,78 @@ class ModerationCog(commands.Cog):
                     await interaction.followup.send("❌ 指定されたユーザーが見つかりません。", ephemeral=True)
                     return
                 user_id = str(target_user.id)
-                
-                config_cog: ConfigCog = self.bot.get_cog("ConfigCog")
-                settings = await config_cog.get_guild_settings(db, guild_id)
                 guild_salt = settings['guild_salt']
                 target_user_id_encrypted = encryptor.encrypt(user_id, guild_salt)
-                
-                all_posts_in_scope = query.all()
-                for post in all_posts_in_scope:
-                    recalculated_tag = encryptor.sign_search_tag(post.daily_user_id_signature, user_id, guild_salt)
-                    if recalculated_tag == post.search_tag:
-                        posts_to_delete.append(post)
-            else:
-                if condition_type == ConditionType.messages:
-                    limit = int(condition_value)
-                    query = query.order_by(AnonymousPost.created_at.desc()).limit(limit)
-                elif condition_type == ConditionType.hours:
-                    hours = int(condition_value)
-                    since = discord.utils.utcnow() - timedelta(hours=hours)
-                    query = query.filter(AnonymousPost.created_at >= since)
-                elif condition_type == ConditionType.contains:
-                    query = query.filter(AnonymousPost.content.contains(condition_value))
-                elif condition_type == ConditionType.pattern:
-                    all_posts_in_scope = query.all()
-                    try:
-                        pattern = re.compile(condition_value)
-                        posts_to_delete = [p for p in all_posts_in_scope if pattern.search(p.content)]
-                    except re.error as e:
-                        await interaction.followup.send(f"❌ 正規表現エラー: {e}", ephemeral=True)
-                        return
-                elif condition_type == ConditionType.anonymous_id:
-                    query = query.filter(AnonymousPost.anonymous_id == condition_value)
-                elif condition_type == ConditionType.converted_only:
-                    query = query.filter(AnonymousPost.is_converted.is_(True))
-                elif condition_type == ConditionType.direct_only:
-                    query = query.filter(AnonymousPost.original_message_id.is_(None))
-                
-                if condition_type != ConditionType.pattern:
-                    posts_to_delete = query.all()
+                conditions['daily_signatures'], _ = matching_daily_signatures(
+                    db, scope_filters, encryptor.search_tag_signer(user_id, guild_salt)
+                )
+            elif condition_type == ConditionType.messages:
+                newest = db.query(AnonymousPost.id).filter(*scope_filters).order_by(
+                    AnonymousPost.created_at.desc()
+                ).limit(int(condition_value)).subquery()
+                conditions['min_post_id'] = db.query(func.min(newest.c.id)).scalar() or 0
+            elif condition_type == ConditionType.hours:
+                since = discord.utils.utcnow() - timedelta(hours=int(condition_value))
+                conditions['since'] = since.isoformat()
+            elif condition_type == ConditionType.pattern:
+                # 正規表現はDB側で評価するため、DBで構文を検証する
+                try:
+                    db.execute(select(literal('').regexp_match(condition_value)))
+                except DBAPIError as e:
+                    db.rollback()
+                    await interaction.followup.send(f"❌ 正規表現エラー: {e.orig}", ephemeral=True)
+                    return
+
+            target_count, is_estimate = count_targets(db, guild_id, conditions)
+            count_text = f"約 {target_count}" if is_estimate else str(target_count)
 
-            if not posts_to_delete:
+            if not target_count:
                 await interaction.followup.send("ℹ️ 削除対象の投稿は見つかりませんでした。", ephemeral=True)
                 success = True
                 return
 
+            max_count = settings.get('bulk_delete_max_count', DEFAULT_SETTINGS['bulk_delete_max_count'])
+
             if dry_run:
+                batches, seconds = estimate_run(min(target_count, max_count))
                 embed = discord.Embed(title="一括削除プレビュー (Dry Run)", color=discord.Color.yellow())
-                embed.description = f"**{len(posts_to_delete)}** 件の投稿が削除対象です。"
-                for post in posts_to_delete[:5]:
+                embed.description = f"**{count_text}** 件の投稿が削除対象です。"
+                embed.add_field(name="バッチ数", value=f"{batches} 回", inline=True)
+                embed.add_field(name="推定所要時間", value=f"約 {math.ceil(seconds / 60)} 分" if seconds >= 60 else f"約 {math.ceil(seconds)} 秒", inline=True)
+                if target_count > max_count:
+                    embed.add_field(name="⚠️ 上限超過", value=f"一括削除の上限 ({max_count} 件) を超えているため、このままでは実行できません。", inline=False)
+                for post in preview_targets(db, guild_id, conditions):
                     content_preview = (post.content[:70] + '...') if len(post.content) > 70 else post.content
                     channel = self.bot.get_channel(int(post.channel_id))
                     channel_name = channel.name if channel else "不明"
                     embed.add_field(name=f"#{channel_name} の投稿", value=content_preview, inline=False)
                 await interaction.followup.send(embed=embed, ephemeral=True)
             else:
-                post_ids_to_delete = [p.id for p in posts_to_delete]
-                
-                db.query(AnonymousPost).filter(AnonymousPost.id.in_(post_ids_to_delete)).update({
-                    'deleted_at': discord.utils.utcnow(),
-                    'deleted_by': str(interaction.user.id)
-                }, synchronize_session=False)
+                if target_count > max_count:
+                    await interaction.followup.send(
+                        f"❌ 削除対象が {count_text} 件あり、一括削除の上限 ({max_count} 件) を超えています。条件を絞り込んでください。",
+                        ephemeral=True
+                    )
+                    return
+                conditions['max_count'] = max_count
 
-                history = BulkDeleteHistory(
+                job = BatchDeleteJob(
                     guild_id=guild_id,
-                    executed_by=str(interaction.user.id),
-                    target_type='anonymous_post',
-                    scope=scope.value,
-                    conditions={'type': condition_type.value, 'value': condition_value},
-                    deleted_count=len(post_ids_to_delete),
-                    dry_run=False
+                    status='pending',
+                    conditions=conditions,
+                    created_by=str(interaction.user.id),
+                    total_count=target_count,
+                    processed_count=0
                 )
-                db.add(history)
+                db.add(job)
                 db.commit()
-                
-                await interaction.followup.send(f"✅ {len(post_ids_to_delete)} 件の投稿を論理削除しました。", ephemeral=True)
+
+                progress_message = await interaction.followup.send(
+                    f"⏳ {target_count} 件の投稿の一括削除をジョブ #{job.id} として開始しました。進捗はこのメッセージで更新されます。",
+                    ephemeral=True,
+                    wait=True
+                )
+                self.batch_delete_worker.enqueue(job.id, progress_message)
             
             success = True
 
@@ -577,7 +725,8 @@ class ModerationCog(commands.Cog):
             logger.error(f"An error occurred in 'bulk_delete' command.", exc_info=True)
             await interaction.followup.send(f"❌ エラーが発生しました。管理者に連絡してください。", ephemeral=True)
         finally:
-            log = AdminCommandLog(
+            write_behind.add(
+                AdminCommandLog,
                 guild_id=str(interaction.guild.id),
                 command_name='bulk_delete',
                 executed_by=str(interaction.user.id),
@@ -585,8 +734,6 @@ class ModerationCog(commands.Cog):
                 params={'scope': scope.value, 'condition_type': condition_type.value, 'condition_value': condition_value, 'dry_run': dry_run},
                 success=success
             )
-            db.add(log)
-            db.commit()
             db.close()
 
     @app_commands.command(name="admin_logs", description="管理コマンドの実行ログを検索します。")
@@ -607,33 +754,33 @@ class ModerationCog(commands.Cog):
 
             guild_id = str(interaction.guild.id)
             
-            query = db.query(AdminCommandLog).filter(AdminCommandLog.guild_id == guild_id)
-
             start_date = discord.utils.utcnow() - timedelta(days=days)
-            query = query.filter(AdminCommandLog.created_at >= start_date)
+            filters = [
+                AdminCommandLog.guild_id == guild_id,
+                AdminCommandLog.created_at >= start_date,
+            ]
 
             if command_name:
-                query = query.filter(AdminCommandLog.command_name == command_name.value)
+                filters.append(AdminCommandLog.command_name == command_name.value)
             
             if user:
-                query = query.filter(AdminCommandLog.executed_by == str(user.id))
+                filters.append(AdminCommandLog.executed_by == str(user.id))
 
             if target_user:
                 config_cog: ConfigCog = self.bot.get_cog("ConfigCog")
                 settings = await config_cog.get_guild_settings(db, guild_id)
                 guild_salt = settings['guild_salt']
                 encrypted_target_id = encryptor.encrypt(str(target_user.id), guild_salt)
-                query = query.filter(AdminCommandLog.target_user_id == encrypted_target_id)
+                filters.append(AdminCommandLog.target_user_id == encrypted_target_id)
 
-            total_logs = query.count()
-            logs = query.order_by(AdminCommandLog.created_at.asc()).all()
+            total_logs, total_capped = capped_count(db, db.query(AdminCommandLog.id).filter(*filters), ADMIN_LOG_COUNT_CAP)
 
-            if not logs:
+            if not total_logs:
                 await interaction.followup.send("ℹ️ 指定された条件のログは見つかりませんでした。", ephemeral=True)
                 return
 
             title = f"管理コマンド実行ログ (過去{days}日間)"
-            view = AdminLogView(self.bot, guild_id, logs, total_logs, title)
+            view = AdminLogView(self.bot, guild_id, filters, total_logs, total_capped, title)
             embed = await view.get_page_embed()
             
             await interaction.followup.send(embed=embed, view=view, ephemeral=True)
@@ -0,0 +1,233 @@
+import json
+import time
+import asyncio
+import itertools
+from collections import Counter
+
+from aiohttp import web
+
+API_PREFIX = "/api/v10"
+DISCORD_EPOCH = 1420070400000
+
+
+def json_response(data, status: int = 200) -> web.Response:
+    """JSONの応答を返す
+
+    discord.py は Content-Type が application/json と完全に一致する場合だけ本文をJSONとして
+    読むため、aiohttp の json_response が付ける charset を付けない。
+    """
+    return web.Response(body=json.dumps(data).encode(), status=status, headers={"Content-Type": "application/json"})
+
+
+class SnowflakeGenerator:
+    """DiscordのSnowflake形式のIDを生成する"""
+
+    def __init__(self):
+        self._counter = itertools.count()
+
+    def __call__(self) -> int:
+        timestamp = int(time.time() * 1000) - DISCORD_EPOCH
+        return (timestamp << 22) | (next(self._counter) & 0x3FFFFF)
+
+
+class FakeDiscord:
+    """負荷試験用の最小限のDiscord REST/Webhookサーバー
+
+    BOTが使うエンドポイントだけを実装し、送信されたメッセージはメモリ上に保持する。
+    latency を指定すると全リクエストにその遅延を加える。
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.snowflake = SnowflakeGenerator()
+        self.bot_user = {"id": str(self.snowflake()), "username": "loadtest-bot", "discriminator": "0000", "global_name": None, "avatar": None, "bot": True}
+        self.application_id = self.bot_user["id"]
+        self.webhooks: dict[str, dict] = {}  # channel_id -> webhook
+        self.messages: dict[str, dict] = {}  # message_id -> message
+        self.webhook_messages: list[dict] = []  # Webhook経由で投稿されたメッセージ(送信順)
+        self.calls = Counter()
+        self._runner: web.AppRunner | None = None
+        self.port: int | None = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}{API_PREFIX}"
+
+    def build_app(self) -> web.Application:
+        app = web.Application(middlewares=[self._middleware])
+        r = app.router
+        r.add_get(f"{API_PREFIX}/users/@me", self.get_me)
+        r.add_get(f"{API_PREFIX}/oauth2/applications/@me", self.get_application)
+        r.add_post(f"{API_PREFIX}/interactions/{{interaction_id}}/{{token}}/callback", self.interaction_callback)
+        r.add_get(f"{API_PREFIX}/channels/{{channel_id}}/webhooks", self.get_channel_webhooks)
+        r.add_post(f"{API_PREFIX}/channels/{{channel_id}}/webhooks", self.create_webhook)
+        r.add_post(f"{API_PREFIX}/channels/{{channel_id}}/messages", self.create_message)
+        r.add_get(f"{API_PREFIX}/channels/{{channel_id}}/messages/{{message_id}}", self.get_message)
+        r.add_delete(f"{API_PREFIX}/channels/{{channel_id}}/messages/{{message_id}}", self.delete_message)
+        r.add_post(f"{API_PREFIX}/webhooks/{{webhook_id}}/{{token}}", self.execute_webhook)
+        r.add_get(f"{API_PREFIX}/webhooks/{{webhook_id}}/{{token}}/messages/{{message_id}}", self.get_webhook_message)
+        r.add_patch(f"{API_PREFIX}/webhooks/{{webhook_id}}/{{token}}/messages/{{message_id}}", self.get_webhook_message)
+        r.add_delete(f"{API_PREFIX}/webhooks/{{webhook_id}}/{{token}}/messages/{{message_id}}", self.delete_webhook_message)
+        r.add_route("*", f"{API_PREFIX}/{{tail:.*}}", self.fallback)
+        return app
+
+    async def start(self):
+        self._runner = web.AppRunner(self.build_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler):
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource else request.path
+        self.calls[f"{request.method} {route.removeprefix(API_PREFIX)}"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return await handler(request)
+
+    # --- payload helpers ---
+
+    def _message_payload(self, channel_id: str, content: str, author: dict, webhook_id: str | None = None, guild_id: str | None = None) -> dict:
+        message_id = str(self.snowflake())
+        data = {
+            "id": message_id,
+            "channel_id": channel_id,
+            "author": author,
+            "content": content or "",
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S.000000+00:00", time.gmtime()),
+            "edited_timestamp": None,
+            "tts": False,
+            "mention_everyone": False,
+            "mentions": [],
+            "mention_roles": [],
+            "attachments": [],
+            "embeds": [],
+            "pinned": False,
+            "type": 0,
+            "flags": 0,
+        }
+        if guild_id:
+            data["guild_id"] = guild_id
+        if webhook_id:
+            data["webhook_id"] = webhook_id
+        self.messages[message_id] = data
+        return data
+
+    async def _json_body(self, request: web.Request) -> dict:
+        if request.content_type == "application/json":
+            return await request.json()
+        if request.content_type.startswith("multipart/"):
+            reader = await request.multipart()
+            async for part in reader:
+                if part.name == "payload_json":
+                    return json.loads(await part.text())
+        return {}
+
+    # --- handlers ---
+
+    async def get_me(self, request):
+        return json_response(self.bot_user)
+
+    async def get_application(self, request):
+        return json_response({
+            "id": self.application_id,
+            "name": self.bot_user["username"],
+            "icon": None,
+            "description": "",
+            "rpc_origins": [],
+            "bot_public": False,
+            "bot_require_code_grant": False,
+            "owner": self.bot_user,
+            "summary": "",
+            "verify_key": "0" * 64,
+            "team": None,
+            "flags": 0,
+            "bot": self.bot_user,
+        })
+
+    async def interaction_callback(self, request):
+        return json_response({
+            "interaction": {
+                "id": request.match_info["interaction_id"],
+                "type": 2,
+                "activity_instance_id": None,
+                "response_message_id": None,
+                "response_message_loading": True,
+                "response_message_ephemeral": True,
+            },
+            "resource": {"type": 5},
+        })
+
+    def _webhook_for(self, channel_id: str) -> dict:
+        webhook = self.webhooks.get(channel_id)
+        if webhook is None:
+            webhook_id = str(self.snowflake())
+            webhook = {
+                "id": webhook_id,
+                "type": 1,
+                "channel_id": channel_id,
+                "name": f"{self.bot_user['username']} Webhook",
+                "avatar": None,
+                "token": f"token-{webhook_id}",
+                "application_id": self.application_id,
+                "user": self.bot_user,
+            }
+            self.webhooks[channel_id] = webhook
+        return webhook
+
+    async def get_channel_webhooks(self, request):
+        channel_id = request.match_info["channel_id"]
+        webhook = self.webhooks.get(channel_id)
+        return json_response([webhook] if webhook else [])
+
+    async def create_webhook(self, request):
+        return json_response(self._webhook_for(request.match_info["channel_id"]))
+
+    async def create_message(self, request):
+        body = await self._json_body(request)
+        return json_response(self._message_payload(request.match_info["channel_id"], body.get("content"), self.bot_user))
+
+    async def get_message(self, request):
+        message = self.messages.get(request.match_info["message_id"])
+        if message is None or message["channel_id"] != request.match_info["channel_id"]:
+            return json_response({"message": "Unknown Message", "code": 10008}, status=404)
+        return json_response(message)
+
+    async def delete_message(self, request):
+        if self.messages.pop(request.match_info["message_id"], None) is None:
+            return json_response({"message": "Unknown Message", "code": 10008}, status=404)
+        return web.Response(status=204)
+
+    async def execute_webhook(self, request):
+        webhook_id = request.match_info["webhook_id"]
+        body = await self._json_body(request)
+        channel_id = request.query.get("thread_id")
+        if channel_id is None:
+            webhook = next((w for w in self.webhooks.values() if w["id"] == webhook_id), None)
+            # インタラクションのフォローアップはアプリケーションIDのWebhookとして届く
+            channel_id = webhook["channel_id"] if webhook else webhook_id
+        author = {"id": webhook_id, "username": body.get("username") or "webhook", "discriminator": "0000", "avatar": None, "bot": True}
+        message = self._message_payload(channel_id, body.get("content"), author, webhook_id=webhook_id)
+        self.webhook_messages.append(message)
+        if request.query.get("wait") in ("true", "1", "True"):
+            return json_response(message)
+        return web.Response(status=204)
+
+    async def get_webhook_message(self, request):
+        message = self.messages.get(request.match_info["message_id"])
+        if message is None:
+            return json_response(self._message_payload(request.match_info["webhook_id"], "", self.bot_user))
+        return json_response(message)
+
+    async def delete_webhook_message(self, request):
+        self.messages.pop(request.match_info["message_id"], None)
+        return web.Response(status=204)
+
+    async def fallback(self, request):
+        return json_response({})
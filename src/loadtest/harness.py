@@ -0,0 +1,399 @@
+"""オフライン負荷試験ハーネス
+
+実際のCog (AnonymousPostCog / ConversionCog / ModerationCog) を、ローカルの偽Discord
+REST/Webhookサーバーと合成Interactionに対して動かし、スループット・レイテンシ・
+イベントループ遅延・DBクエリ数を計測する。Gatewayには接続せず、ギルド情報は
+ConnectionStateに直接注入する。
+
+実行例 (srcディレクトリで):
+    python -m loadtest.harness --db sqlite:///loadtest.db --concurrency 20 --requests 500
+    python -m loadtest.harness --db postgresql://bot:pw@localhost/loadtest --mix post=60,reply=20,delete=10,convert=10
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import logging
+import threading
+import contextvars
+from collections import Counter, defaultdict
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load test for the anonymous post cogs")
+    parser.add_argument("--db", default="sqlite:///loadtest.db", help="SQLAlchemy URL (ローカルのPostgreSQLまたはSQLite)")
+    parser.add_argument("--concurrency", type=int, default=10, help="同時に実行するインタラクション数")
+    parser.add_argument("--requests", type=int, default=200, help="実行するインタラクションの総数")
+    parser.add_argument("--mix", default="post=70,reply=15,delete=10,convert=5", help="操作の比率")
+    parser.add_argument("--guilds", type=int, default=3)
+    parser.add_argument("--channels", type=int, default=3, help="ギルドあたりのチャンネル数")
+    parser.add_argument("--users", type=int, default=50, help="ギルドあたりのユーザー数")
+    parser.add_argument("--rest-latency-ms", type=float, default=30.0, help="偽RESTサーバーの応答遅延")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--max-error-rate", type=float, default=0.05, help="これを超える割合の操作が例外で失敗した場合、結果を無効として終了コード1で終了する")
+    return parser.parse_args(argv)
+
+
+def parse_mix(mix: str) -> dict[str, float]:
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        weights[name.strip()] = float(weight or 1)
+    unknown = set(weights) - set(OPERATIONS)
+    if unknown:
+        raise SystemExit(f"Unknown operation(s) in --mix: {', '.join(sorted(unknown))}")
+    return weights
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+# --- 計測 ---
+
+current_op: contextvars.ContextVar[str] = contextvars.ContextVar("current_op", default="setup")
+
+
+class Metrics:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors = Counter()
+        self.queries = Counter()
+        self.loop_lag: list[float] = []
+
+    def install_query_counter(self, engine):
+        from sqlalchemy import event
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def _count(conn, cursor, statement, parameters, context, executemany):
+            # イベントループ外のスレッド(遅延書き込みなど)はbackgroundとして数える
+            if threading.current_thread() is threading.main_thread():
+                self.queries[current_op.get()] += 1
+            else:
+                self.queries["background"] += 1
+
+    async def monitor_loop_lag(self, interval: float = 0.05):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.loop_lag.append((time.perf_counter() - started - interval) * 1000)
+
+
+# --- 合成データ ---
+
+class World:
+    """ギルド・チャンネル・ユーザーと、投稿済みメッセージの追跡"""
+
+    def __init__(self, fake, state, args):
+        self.fake = fake
+        self.state = state
+        self.guilds = []
+        self.users: dict[int, list[dict]] = {}
+        self.posts: list[tuple[int, int, int, dict]] = []  # (guild_id, channel_id, message_id, user)
+        self.pending: dict[str, tuple[int, int, dict]] = {}  # content -> (guild_id, channel_id, user)
+        self._seen = 0
+        for _ in range(args.guilds):
+            guild_id = fake.snowflake()
+            channels = [
+                {"id": str(fake.snowflake()), "type": 0, "name": f"general-{i}", "position": i, "guild_id": str(guild_id), "permission_overwrites": [], "nsfw": False, "parent_id": None}
+                for i in range(args.channels)
+            ]
+            guild = state._add_guild_from_data({
+                "id": str(guild_id),
+                "name": f"loadtest-{guild_id}",
+                "owner_id": fake.bot_user["id"],
+                "roles": [{"id": str(guild_id), "name": "@everyone", "permissions": "0", "position": 0, "color": 0, "hoist": False, "managed": False, "mentionable": False, "flags": 0}],
+                "channels": channels,
+                "member_count": args.users,
+                "features": [],
+                "emojis": [],
+                "stickers": [],
+            })
+            self.guilds.append(guild)
+            self.users[guild.id] = [
+                {"id": str(fake.snowflake()), "username": f"user{i}", "discriminator": "0000", "global_name": None, "avatar": None}
+                for i in range(args.users)
+            ]
+
+    def record_posts(self):
+        """偽サーバーに届いたWebhookメッセージから投稿者を対応付ける"""
+        new_messages = self.fake.webhook_messages[self._seen:]
+        self._seen += len(new_messages)
+        for message in new_messages:
+            owner = self.pending.pop(message["content"], None)
+            if owner:
+                guild_id, channel_id, user = owner
+                self.posts.append((guild_id, int(message["channel_id"]), int(message["id"]), user))
+
+    def interaction(self, guild, channel, user: dict, name: str, options: list[dict] | None = None):
+        import discord
+        payload = {
+            "id": str(self.fake.snowflake()),
+            "application_id": self.fake.application_id,
+            "type": 2,
+            "token": f"interaction-token-{self.fake.snowflake()}",
+            "version": 1,
+            "guild_id": str(guild.id),
+            "channel_id": str(channel.id),
+            "channel": {"id": str(channel.id), "type": 0, "name": channel.name, "guild_id": str(guild.id), "position": channel.position},
+            "member": {"user": user, "roles": [], "joined_at": "2024-01-01T00:00:00+00:00", "deaf": False, "mute": False, "flags": 0, "permissions": "0"},
+            "app_permissions": str(discord.Permissions.all().value),
+            "attachment_size_limit": 25 * 1024 * 1024,
+            "locale": "ja",
+            "guild_locale": "ja",
+            "entitlements": [],
+            "data": {"id": str(self.fake.snowflake()), "name": name, "type": 1, "options": options or []},
+        }
+        return discord.Interaction(data=payload, state=self.state)
+
+    def user_message(self, guild, channel, user: dict, content: str):
+        import discord
+        data = {
+            "id": str(self.fake.snowflake()),
+            "channel_id": str(channel.id),
+            "guild_id": str(guild.id),
+            "author": user,
+            "member": {"roles": [], "joined_at": "2024-01-01T00:00:00+00:00", "deaf": False, "mute": False, "flags": 0},
+            "content": content,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S.000000+00:00", time.gmtime()),
+            "edited_timestamp": None,
+            "tts": False,
+            "mention_everyone": False,
+            "mentions": [],
+            "mention_roles": [],
+            "attachments": [],
+            "embeds": [],
+            "pinned": False,
+            "type": 0,
+        }
+        self.fake.messages[data["id"]] = data
+        return discord.Message(state=self.state, channel=channel, data=data)
+
+
+# --- 操作 ---
+
+async def op_post(bot, world: World, rng: random.Random):
+    guild = rng.choice(world.guilds)
+    channel = rng.choice(guild.text_channels)
+    user = rng.choice(world.users[guild.id])
+    content = f"loadtest post {world.fake.snowflake()}"
+    world.pending[content] = (guild.id, channel.id, user)
+    cog = bot.get_cog("AnonymousPostCog")
+    await cog.post.callback(cog, world.interaction(guild, channel, user, "post"), message=content)
+
+
+async def op_reply(bot, world: World, rng: random.Random):
+    if not world.posts:
+        return await op_post(bot, world, rng)
+    guild_id, channel_id, message_id, _ = rng.choice(world.posts)
+    guild = bot.get_guild(guild_id)
+    channel = guild.get_channel(channel_id)
+    user = rng.choice(world.users[guild.id])
+    cog = bot.get_cog("AnonymousPostCog")
+    await cog.reply.callback(cog, world.interaction(guild, channel, user, "reply"), message_id=str(message_id), message=f"loadtest reply {world.fake.snowflake()}")
+
+
+async def op_delete(bot, world: World, rng: random.Random):
+    if not world.posts:
+        return await op_post(bot, world, rng)
+    guild_id, channel_id, message_id, user = world.posts.pop(rng.randrange(len(world.posts)))
+    guild = bot.get_guild(guild_id)
+    channel = guild.get_channel(channel_id)
+    cog = bot.get_cog("AnonymousPostCog")
+    await cog.delete.callback(cog, world.interaction(guild, channel, user, "delete"), message_id=str(message_id))
+
+
+async def op_convert(bot, world: World, rng: random.Random):
+    guild = rng.choice(world.guilds)
+    channel = rng.choice(guild.text_channels)
+    user = rng.choice(world.users[guild.id])
+    content = f"loadtest convert {world.fake.snowflake()}"
+    world.pending[content] = (guild.id, channel.id, user)
+    original_message = world.user_message(guild, channel, user, content)
+    cog = bot.get_cog("ConversionCog")
+    try:
+        await cog.convert_message(world.interaction(guild, channel, user, "convert"), original_message)
+    except ValueError:
+        # BAN・レート制限・NGワードによる拒否は正常な応答として扱う
+        pass
+
+
+OPERATIONS = {
+    "post": op_post,
+    "reply": op_reply,
+    "delete": op_delete,
+    "convert": op_convert,
+}
+
+
+# --- 実行 ---
+
+def prepare_environment(args):
+    # database モジュールの読み込み前に接続先を設定する
+    os.environ["DATABASE_URL"] = args.db
+    os.environ.setdefault("ENCRYPTION_KEY", "loadtest-encryption-key")
+
+
+def prepare_database(metrics: Metrics, url: str):
+    from sqlalchemy import BigInteger, create_engine
+    from sqlalchemy.ext.compiler import compiles
+
+    import database
+    from models import Base
+
+    @compiles(BigInteger, "sqlite")
+    def _sqlite_bigint(type_, compiler, **kw):
+        # SQLiteでは INTEGER PRIMARY KEY のみ自動採番されるため
+        return "INTEGER"
+
+    connect_args = {"check_same_thread": False} if url.startswith("sqlite") else {}
+    engine = create_engine(url, connect_args=connect_args)
+    database.engine = engine
+    database.SessionLocal.configure(bind=engine)
+    Base.metadata.create_all(engine)
+    metrics.install_query_counter(engine)
+    return engine
+
+
+def patch_discord_base_url(base_url: str):
+    import discord.http
+    import discord.webhook.async_
+    discord.http.Route.BASE = base_url
+    discord.webhook.async_.Route.BASE = base_url
+
+
+async def run(args) -> dict:
+    import discord
+    from discord.ext import commands
+
+    from loadtest.fake_discord import FakeDiscord
+    from utils.write_behind import write_behind
+
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    metrics = Metrics()
+    prepare_database(metrics, args.db)
+
+    fake = FakeDiscord(latency=args.rest_latency_ms / 1000)
+    await fake.start()
+    patch_discord_base_url(fake.base_url)
+
+    intents = discord.Intents.default()
+    intents.message_content = True
+    bot = commands.Bot(command_prefix="/", intents=intents)
+    await bot.login("loadtest-token")
+    for extension in ("cogs.config", "cogs.anonymous_post", "cogs.conversion", "cogs.moderation"):
+        await bot.load_extension(extension)
+
+    world = World(fake, bot._connection, args)
+    lag_task = asyncio.create_task(metrics.monitor_loop_lag())
+
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    remaining = args.requests
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            name = rng.choices(names, weights)[0]
+            async with semaphore:
+                token = current_op.set(name)
+                started = time.perf_counter()
+                try:
+                    await OPERATIONS[name](bot, world, rng)
+                except Exception as e:
+                    metrics.errors[f"{name}: {type(e).__name__}"] += 1
+                finally:
+                    metrics.latencies[name].append((time.perf_counter() - started) * 1000)
+                    current_op.reset(token)
+            world.record_posts()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+
+    lag_task.cancel()
+    await write_behind.close()
+    # Cogは bot.close() で外されるため、先に取り出しておく
+    post_cog = bot.get_cog("AnonymousPostCog")
+    api_calls = dict(post_cog.api_calls)
+    rejections = dict(post_cog.rejections)
+    await bot.close()
+    await fake.close()
+
+    all_latencies = [v for values in metrics.latencies.values() for v in values]
+    error_count = sum(metrics.errors.values())
+    succeeded = len(all_latencies) - error_count
+    return {
+        "elapsed": elapsed,
+        # 例外で失敗した操作は速く終わるため、スループットには成功した操作だけを数える
+        "throughput": succeeded / elapsed if elapsed else 0.0,
+        "error_rate": error_count / len(all_latencies) if all_latencies else 0.0,
+        "latencies": metrics.latencies,
+        "all_latencies": all_latencies,
+        "errors": metrics.errors,
+        "queries": metrics.queries,
+        "loop_lag": metrics.loop_lag,
+        "rest_calls": fake.calls,
+        "api_calls": api_calls,
+        "rejections": rejections,
+        "write_behind_overflow": dict(write_behind.overflow),
+    }
+
+
+def print_report(result: dict):
+    def row(name, values):
+        return f"  {name:<10} n={len(values):<6} p50={percentile(values, 50):8.1f}ms p95={percentile(values, 95):8.1f}ms p99={percentile(values, 99):8.1f}ms"
+
+    print(f"elapsed:    {result['elapsed']:.2f}s")
+    print(f"throughput: {result['throughput']:.1f} interactions/s (succeeded only)")
+    print(f"error rate: {result['error_rate']:.1%}")
+    print("latency:")
+    print(row("all", result["all_latencies"]))
+    for name, values in sorted(result["latencies"].items()):
+        print(row(name, values))
+    lag = result["loop_lag"]
+    print(f"event loop lag: p50={percentile(lag, 50):.1f}ms p99={percentile(lag, 99):.1f}ms max={max(lag, default=0):.1f}ms")
+    print("db queries:")
+    for name, count in sorted(result["queries"].items()):
+        ops = len(result["latencies"].get(name, ())) or 1
+        print(f"  {name:<10} total={count:<8} per_op={count / ops:.1f}")
+    print("rest calls:")
+    for route, count in result["rest_calls"].most_common():
+        print(f"  {count:>7}  {route}")
+    print("api calls by command:")
+    for name, count in sorted(result["api_calls"].items()):
+        print(f"  {count:>7}  {name}")
+    if result["rejections"]:
+        print("rejections by stage:")
+        for stage, count in sorted(result["rejections"].items()):
+            print(f"  {count:>7}  {stage}")
+    if result["errors"]:
+        print("errors:")
+        for name, count in result["errors"].most_common():
+            print(f"  {count:>7}  {name}")
+    if result["write_behind_overflow"]:
+        print(f"write-behind overflow: {result['write_behind_overflow']}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    prepare_environment(args)
+    logging.basicConfig(level=logging.WARNING, stream=sys.stderr)
+    result = asyncio.run(run(args))
+    print_report(result)
+    if result["error_rate"] > args.max_error_rate:
+        print(f"FAILED: {result['error_rate']:.1%} of operations raised errors (limit {args.max_error_rate:.1%}); the numbers above are not valid", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
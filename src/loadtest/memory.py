@@ -0,0 +1,155 @@
+"""キャッシュ設定ごとのメモリ使用量ベンチマーク
+
+Gatewayには接続せず、合成したギルド (チャンネル・ボイス接続中のメンバー) とメッセージを
+ConnectionStateに流し込み、通常モードと省メモリモードで1,000ギルドあたりのRSSを比較する。
+モードごとに別プロセスで計測するため、互いのヒープの影響を受けない。
+
+実行例 (srcディレクトリで):
+    python -m loadtest.memory --guilds 2000 --messages-per-guild 50
+"""
+import gc
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+MODES = ("default", "low-memory")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="RSS per 1k guilds for each cache profile")
+    parser.add_argument("--guilds", type=int, default=2000)
+    parser.add_argument("--channels", type=int, default=10, help="ギルドあたりのチャンネル数")
+    parser.add_argument("--voice-members", type=int, default=5, help="ギルドあたりのボイス接続中メンバー数 (GUILD_CREATEに含まれる)")
+    parser.add_argument("--messages-per-guild", type=int, default=50, help="ギルドあたりの受信メッセージ数")
+    parser.add_argument("--mode", choices=MODES, default=None, help="指定したモードのみを計測してJSONを出力する (内部用)")
+    return parser.parse_args(argv)
+
+
+class Snowflakes:
+    def __init__(self):
+        self.value = 1 << 40
+
+    def __call__(self) -> str:
+        self.value += 1
+        return str(self.value)
+
+
+def guild_payload(snowflake: Snowflakes, args) -> dict:
+    guild_id = snowflake()
+    channels = [
+        {"id": snowflake(), "type": 0, "name": f"channel-{i}", "position": i, "guild_id": guild_id, "permission_overwrites": [], "nsfw": False, "parent_id": None}
+        for i in range(args.channels)
+    ]
+    voice_channel = snowflake()
+    channels.append({"id": voice_channel, "type": 2, "name": "voice", "position": args.channels, "guild_id": guild_id, "permission_overwrites": [], "bitrate": 64000, "user_limit": 0, "parent_id": None})
+    members = [
+        {"user": {"id": snowflake(), "username": f"member{i}", "discriminator": "0000", "global_name": None, "avatar": None}, "roles": [], "joined_at": "2024-01-01T00:00:00+00:00", "deaf": False, "mute": False, "flags": 0}
+        for i in range(args.voice_members)
+    ]
+    voice_states = [
+        {"user_id": member["user"]["id"], "channel_id": voice_channel, "session_id": snowflake(), "deaf": False, "mute": False, "self_deaf": False, "self_mute": False, "self_video": False, "suppress": False, "request_to_speak_timestamp": None}
+        for member in members
+    ]
+    return {
+        "id": guild_id,
+        "name": f"guild-{guild_id}",
+        "owner_id": snowflake(),
+        "roles": [{"id": guild_id, "name": "@everyone", "permissions": "0", "position": 0, "color": 0, "hoist": False, "managed": False, "mentionable": False, "flags": 0}],
+        "channels": channels,
+        "members": members,
+        "voice_states": voice_states,
+        "member_count": 1000,
+        "features": [],
+        "emojis": [],
+        "stickers": [],
+    }
+
+
+def message_payload(snowflake: Snowflakes, guild_id: str, channel_id: str, author: dict) -> dict:
+    return {
+        "id": snowflake(),
+        "channel_id": channel_id,
+        "guild_id": guild_id,
+        "author": author,
+        "member": {"roles": [], "joined_at": "2024-01-01T00:00:00+00:00", "deaf": False, "mute": False, "flags": 0},
+        "content": "x" * 120,
+        "timestamp": "2024-01-01T00:00:00.000000+00:00",
+        "edited_timestamp": None,
+        "tts": False,
+        "mention_everyone": False,
+        "mentions": [],
+        "mention_roles": [],
+        "attachments": [],
+        "embeds": [],
+        "pinned": False,
+        "type": 0,
+    }
+
+
+def measure(mode: str, args) -> dict:
+    """1つのモードで合成データを流し込み、RSSの増分を計測する"""
+    import discord
+    from utils.memory_profile import client_options, freeze_after_warmup, rss_bytes
+
+    intents = discord.Intents.default()
+    intents.messages = True
+    intents.message_content = True
+    client = discord.Client(intents=intents, **client_options(mode == "low-memory"))
+    state = client._connection
+    snowflake = Snowflakes()
+
+    gc.collect()
+    baseline = rss_bytes()
+    started = time.perf_counter()
+
+    guilds = []
+    for _ in range(args.guilds):
+        guilds.append(state._add_guild_from_data(guild_payload(snowflake, args)))
+
+    authors = [{"id": snowflake(), "username": f"author{i}", "discriminator": "0000", "global_name": None, "avatar": None} for i in range(50)]
+    for guild in guilds:
+        channels = guild.text_channels
+        for i in range(args.messages_per_guild):
+            channel = channels[i % len(channels)]
+            state.parse_message_create(message_payload(snowflake, str(guild.id), str(channel.id), authors[i % len(authors)]))
+
+    if mode == "low-memory":
+        freeze_after_warmup()
+    else:
+        gc.collect()
+    rss = rss_bytes()
+    return {
+        "mode": mode,
+        "guilds": args.guilds,
+        "cached_members": sum(len(guild.members) for guild in guilds),
+        "cached_messages": len(state._messages or ()),
+        "rss_mb": rss / 1024 / 1024,
+        "rss_per_1k_guilds_mb": (rss - baseline) / 1024 / 1024 / args.guilds * 1000,
+        "load_seconds": time.perf_counter() - started,
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.mode:
+        print(json.dumps(measure(args.mode, args)))
+        return
+
+    results = []
+    for mode in MODES:
+        command = [sys.executable, "-m", "loadtest.memory", "--mode", mode,
+                   "--guilds", str(args.guilds), "--channels", str(args.channels),
+                   "--voice-members", str(args.voice_members), "--messages-per-guild", str(args.messages_per_guild)]
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"guilds={args.guilds} channels/guild={args.channels} voice members/guild={args.voice_members} messages/guild={args.messages_per_guild}")
+    print(f"{'mode':<12}{'RSS MB':>10}{'MB/1k guilds':>15}{'members':>10}{'messages':>10}")
+    for result in results:
+        print(f"{result['mode']:<12}{result['rss_mb']:>10.1f}{result['rss_per_1k_guilds_mb']:>15.1f}{result['cached_members']:>10}{result['cached_messages']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@ from sqlalchemy import (
     Text,
     Boolean,
     DateTime,
+    Integer,
     JSON,
     Index,
     UniqueConstraint,
@@ -39,6 +40,8 @@ class AnonymousPost(Base):
     __table_args__ = (
         Index('idx_anonymous_posts_guild_channel', 'guild_id', 'channel_id'),
         Index('idx_anonymous_posts_anon_id', 'anonymous_id'),
+        Index('idx_anonymous_posts_guild_created', 'guild_id', 'created_at'),
+        Index('idx_anonymous_posts_content_trgm', 'content', postgresql_using='gin', postgresql_ops={'content': 'gin_trgm_ops'}),
     )
 
 
@@ -60,6 +63,24 @@ class ConversionHistory(Base):
     )
 
 
+class ConversionPrompt(Base):
+    __tablename__ = 'conversion_prompts'
+
+    # 表示中の誤投稿変換の確認メッセージ。期限切れのものはスイーパーがまとめて片付ける
+    prompt_message_id = Column(String(64), primary_key=True)
+    guild_id = Column(String(30), nullable=False)
+    channel_id = Column(String(30), nullable=False)
+    original_message_id = Column(String(64), nullable=False)
+    # 署名 (PBKDF2) は確認が解決したときに導出するため、投稿者のIDをそのまま持つ
+    user_id = Column(String(30), nullable=False)
+    is_thread = Column(Boolean, nullable=False, default=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        Index('idx_conversion_prompts_expires_at', 'expires_at'),
+    )
+
+
 class AdminCommandLog(Base):
     __tablename__ = 'admin_command_logs'
 
@@ -139,9 +160,30 @@ class AnonymousThread(Base):
     title = Column(String(200), nullable=False)
     created_by_encrypted = Column(String(512), nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    deleted_at = Column(DateTime(timezone=True))
+
+    __table_args__ = (
+        # /board_threads のキーセットページング用
+        Index('idx_threads_guild_board_created', 'guild_id', 'board', 'created_at', 'id'),
+        Index('idx_threads_thread_discord_id', 'thread_discord_id'),
+    )
+
+
+class Board(Base):
+    """ボードの一覧。スレッドの作成・削除時にスレッド数と最終更新日時を更新する"""
+    __tablename__ = 'boards'
+
+    id = Column(BigInteger, primary_key=True)
+    guild_id = Column(String(30), nullable=False)
+    name = Column(String(100), nullable=False)
+    thread_count = Column(Integer, nullable=False, default=0)
+    last_activity_at = Column(DateTime(timezone=True), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     __table_args__ = (
-        Index('idx_threads_guild_board', 'guild_id', 'board'),
+        UniqueConstraint('guild_id', 'name', name='uq_boards_guild_name'),
+        # /boards のキーセットページング用
+        Index('idx_boards_guild_last_activity', 'guild_id', 'last_activity_at', 'id'),
     )
 
 
@@ -197,6 +239,14 @@ class BatchDeleteJob(Base):
     started_at = Column(DateTime(timezone=True))
     completed_at = Column(DateTime(timezone=True))
     error_message = Column(Text)
+    total_count = Column(BigInteger)
+    processed_count = Column(BigInteger, nullable=False, server_default='0', default=0)
+    last_post_id = Column(BigInteger)  # 論理削除済みの最後の投稿ID
+    purged_post_id = Column(BigInteger)  # Discord上の削除まで済んだ最後の投稿ID
+
+    __table_args__ = (
+        Index('idx_batch_delete_jobs_status', 'status'),
+    )
 
 
 class ConfigHistory(Base):
@@ -236,13 +286,16 @@ class NgWord(Base):
 class BotLog(Base):
     __tablename__ = 'bot_logs'
 
-    id = Column(BigInteger, primary_key=True)
+    # PostgreSQLではマイグレーションで created_at による月単位のレンジパーティションにしており、
+    # 主キーは (id, created_at) になる (utils.partitions)。id はシーケンスで一意なため、ORM上は
+    # id だけを主キーとして扱う (SQLiteでは複合主キーに自動採番を使えないため)
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
     logger_name = Column(String(255))
     level = Column(String(50))
     message = Column(Text)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
 
     __table_args__ = (
-        Index('idx_bot_logs_level', 'level'),
+        Index('idx_bot_logs_level_created_at', 'level', 'created_at'),
         Index('idx_bot_logs_created_at', 'created_at'),
     )
\ No newline at end of file
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# database.py は読み込み時にエンジンを作るため、テストではメモリ上のSQLiteを使う
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,63 @@
+import re
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+
+from models import AnonymousPost
+from utils.batch_delete import count_targets, explain_row_estimate, target_filters
+
+USER_CONDITIONS = {'type': 'user', 'daily_signatures': ['sig-a', 'sig-b']}
+
+
+class ExplainRecorder:
+    """PostgreSQLとして振る舞い、EXPLAIN に渡されたSQLとパラメータを記録する"""
+
+    def __init__(self, plan_rows: int):
+        self.plan_rows = plan_rows
+        self.calls = []
+
+    def get_bind(self):
+        return self
+
+    @property
+    def dialect(self):
+        return postgresql.psycopg2.dialect()
+
+    def connection(self):
+        return self
+
+    def exec_driver_sql(self, sql, params):
+        self.calls.append((sql, params))
+        return self
+
+    def scalar(self):
+        return [{'Plan': {'Plan Rows': self.plan_rows}}]
+
+
+def test_explain_expands_in_filter():
+    db = ExplainRecorder(plan_rows=123)
+    statement = select(AnonymousPost.id).where(*target_filters('1', USER_CONDITIONS))
+
+    assert explain_row_estimate(db, statement) == 123
+
+    sql, params = db.calls[0]
+    assert sql.startswith("EXPLAIN (FORMAT JSON) ")
+    assert "POSTCOMPILE" not in sql
+    placeholders = set(re.findall(r"%\((\w+)\)s", sql))
+    assert placeholders == set(params)
+    assert {'sig-a', 'sig-b'} <= set(params.values())
+
+
+def test_count_targets_with_user_filter():
+    engine = create_engine("sqlite://")
+    AnonymousPost.__table__.create(engine)
+    with Session(engine) as db:
+        for index, signature in enumerate(['sig-a', 'sig-b', 'sig-c', 'sig-a']):
+            db.add(AnonymousPost(
+                id=index + 1, guild_id='1', user_id_encrypted='x', daily_user_id_signature=signature, search_tag='t',
+                anonymous_id='anon', message_id=str(100 + index), channel_id='10', content='hello',
+            ))
+        db.commit()
+
+        assert count_targets(db, '1', USER_CONDITIONS) == (3, False)
@@ -0,0 +1,66 @@
+import asyncio
+from types import SimpleNamespace
+
+import discord
+
+from utils.deletion_attribution import DeletionAttributor, PendingDeletion
+
+BOT_USER_ID = 1
+WEBHOOK_ID = 2
+CHANNEL_ID = 10
+
+
+def message_delete_entry(entry_id: int, target_id: int, channel_id: int, moderator: str):
+    return SimpleNamespace(
+        id=entry_id,
+        action=discord.AuditLogAction.message_delete,
+        extra=SimpleNamespace(count=1, channel=SimpleNamespace(id=channel_id)),
+        target=SimpleNamespace(id=target_id),
+        user=moderator,
+        created_at=discord.utils.utcnow(),
+    )
+
+
+class FakeGuild:
+    id = 100
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.webhook_requests = 0
+
+    async def audit_logs(self, limit):
+        for entry in self.entries:
+            yield entry
+
+    async def webhooks(self):
+        self.webhook_requests += 1
+        return []
+
+
+def attribute(entries):
+    async def run():
+        bot = SimpleNamespace(user=SimpleNamespace(id=BOT_USER_ID))
+        attributor = DeletionAttributor(bot, send_log=None)
+        attributor.own_webhook_ids.add(WEBHOOK_ID)
+        deletion = PendingDeletion(CHANNEL_ID, message_ids=[500])
+        guild = FakeGuild(entries)
+        await attributor._attribute(guild, [deletion])
+        return deletion.deleter, guild.webhook_requests
+
+    return asyncio.run(run())
+
+
+def test_attributes_deletion_of_own_webhook_message():
+    deleter, _ = attribute([message_delete_entry(1, WEBHOOK_ID, CHANNEL_ID, "moderator")])
+    assert deleter == "moderator"
+
+
+def test_ignores_deletion_of_other_users_message():
+    deleter, webhook_requests = attribute([message_delete_entry(1, 999, CHANNEL_ID, "moderator")])
+    assert deleter is None
+    assert webhook_requests == 1
+
+
+def test_ignores_deletion_in_other_channel():
+    deleter, _ = attribute([message_delete_entry(1, WEBHOOK_ID, CHANNEL_ID + 1, "moderator")])
+    assert deleter is None
@@ -0,0 +1,42 @@
+import asyncio
+from types import SimpleNamespace
+
+import discord
+
+from utils.log_dispatcher import LogDispatcher
+
+
+class FlakyChannel:
+    """最初の送信だけ500で失敗するチャンネル"""
+
+    def __init__(self):
+        self.sent = []
+        self.failures = 1
+
+    async def send(self, embeds):
+        if self.failures:
+            self.failures -= 1
+            raise discord.HTTPException(SimpleNamespace(status=500, reason="Internal Server Error"), "error")
+        self.sent.append(embeds)
+
+
+def test_failed_batch_is_requeued():
+    async def run():
+        channel = FlakyChannel()
+        dispatcher = LogDispatcher(bot=None)
+
+        async def resolve_channel(guild_id):
+            return channel
+        dispatcher._resolve_channel = resolve_channel
+
+        embeds = [discord.Embed(title=str(i)) for i in range(3)]
+        for embed in embeds:
+            dispatcher.enqueue("1", embed)
+
+        await dispatcher.flush()
+        assert dispatcher.queue_depth() == 3
+        await dispatcher.flush()
+        assert dispatcher.queue_depth() == 0
+        assert channel.sent == [embeds]
+
+    asyncio.run(run())
@@ -0,0 +1,29 @@
+from models import AnonymousPost
+from utils.post_cache import RecentPostCache
+
+
+def make_post(message_id: str) -> AnonymousPost:
+    return AnonymousPost(
+        guild_id='1', user_id_encrypted='x', daily_user_id_signature='sig', search_tag='t',
+        anonymous_id='anon', message_id=message_id, channel_id='10', content='hello',
+    )
+
+
+def test_evict_removes_post_and_remembers_deletion():
+    cache = RecentPostCache(max_size=2)
+    cache.add_post(make_post('1000000000000000001'))
+
+    cache.evict('1000000000000000001')
+
+    assert cache.get('1000000000000000001') is None
+    assert cache.was_deleted(1000000000000000001)
+    assert len(cache) == 0
+
+
+def test_deleted_ids_are_bounded():
+    cache = RecentPostCache(max_size=2)
+    for message_id in (1, 2, 3):
+        cache.evict(message_id)
+
+    assert not cache.was_deleted(1)
+    assert cache.was_deleted(2) and cache.was_deleted(3)
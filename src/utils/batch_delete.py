@@ -0,0 +1,342 @@
+import os
+import math
+import time
+import asyncio
+import logging
+from datetime import datetime
+
+import discord
+from discord.ext import commands
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from database import get_db
+from models import AnonymousPost, BatchDeleteJob, BulkDeleteHistory
+from utils.post_cache import recent_posts
+
+logger = logging.getLogger(__name__)
+
+# 1回のトランザクションで論理削除する投稿数
+BATCH_DELETE_CHUNK_SIZE = int(os.getenv("BATCH_DELETE_CHUNK_SIZE", 100))
+# Discord上のメッセージを削除する間隔(秒)。Webhookのレート制限に収まるようにする
+BATCH_DELETE_MESSAGE_INTERVAL = float(os.getenv("BATCH_DELETE_MESSAGE_INTERVAL", 0.25))
+# ギルドが一時的に利用できない場合に、ジョブを再試行するまでの待機時間(秒)
+BATCH_DELETE_RETRY_DELAY = float(os.getenv("BATCH_DELETE_RETRY_DELAY", 60))
+# 実行者への進捗通知の最小間隔(秒)
+BATCH_DELETE_PROGRESS_INTERVAL = float(os.getenv("BATCH_DELETE_PROGRESS_INTERVAL", 5.0))
+
+# 推定件数がこの値を超える場合は COUNT(*) を実行せず、実行計画の推定値を使う
+BULK_DELETE_EXACT_COUNT_THRESHOLD = int(os.getenv("BULK_DELETE_EXACT_COUNT_THRESHOLD", 50000))
+# 所要時間の見積もりに使う、メッセージ削除1件あたりのREST呼び出し時間(秒)
+ESTIMATED_REQUEST_SECONDS = 0.15
+
+ACTIVE_STATUSES = ('pending', 'running')
+
+
+def target_filters(guild_id: str, conditions: dict) -> list:
+    """ジョブの条件から対象投稿の絞り込み条件(SQL)を作る。削除済みかどうかは含めない
+
+    時刻や件数に依存する条件はジョブ作成時に id・日時へ解決済みのため、
+    再開しても対象が変わらない。
+    """
+    filters = [AnonymousPost.guild_id == guild_id]
+    if conditions.get('channel_id'):
+        filters.append(AnonymousPost.channel_id == conditions['channel_id'])
+    if conditions.get('max_post_id') is not None:
+        filters.append(AnonymousPost.id <= conditions['max_post_id'])
+
+    condition_type = conditions['type']
+    value = conditions.get('value')
+    if condition_type == 'messages':
+        filters.append(AnonymousPost.id >= conditions['min_post_id'])
+    elif condition_type == 'hours':
+        filters.append(AnonymousPost.created_at >= datetime.fromisoformat(conditions['since']))
+    elif condition_type == 'user':
+        filters.append(AnonymousPost.daily_user_id_signature.in_(conditions['daily_signatures']))
+    elif condition_type == 'contains':
+        filters.append(AnonymousPost.content.icontains(value, autoescape=True))
+    elif condition_type == 'pattern':
+        # PostgreSQLでは `~` 演算子になる
+        filters.append(AnonymousPost.content.regexp_match(value))
+    elif condition_type == 'anonymous_id':
+        filters.append(AnonymousPost.anonymous_id == value)
+    elif condition_type == 'converted_only':
+        filters.append(AnonymousPost.is_converted.is_(True))
+    elif condition_type == 'direct_only':
+        filters.append(AnonymousPost.original_message_id.is_(None))
+    return filters
+
+
+def count_targets(db: Session, guild_id: str, conditions: dict) -> tuple[int, bool]:
+    """対象件数を返す。(件数, 推定値かどうか)
+
+    PostgreSQLでは先に EXPLAIN の推定行数を確認し、閾値を超える場合はそれを返す。
+    """
+    filters = target_filters(guild_id, conditions) + [AnonymousPost.deleted_at.is_(None)]
+    if db.get_bind().dialect.name == 'postgresql':
+        estimate = explain_row_estimate(db, select(AnonymousPost.id).where(*filters))
+        if estimate > BULK_DELETE_EXACT_COUNT_THRESHOLD:
+            return estimate, True
+    return db.query(func.count(AnonymousPost.id)).filter(*filters).scalar(), False
+
+
+def explain_row_estimate(db: Session, statement) -> int:
+    """実行計画の推定行数を返す(クエリ自体は実行しない)"""
+    # in_() の値は実行時に展開されるため、EXPLAIN の文字列に埋め込む前に展開しておく
+    compiled = statement.compile(dialect=db.get_bind().dialect, compile_kwargs={"render_postcompile": True})
+    plan = db.connection().exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params).scalar()
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def estimate_run(count: int) -> tuple[int, float]:
+    """実行時のバッチ数と所要時間(秒)の見積もりを返す"""
+    batches = math.ceil(count / BATCH_DELETE_CHUNK_SIZE)
+    seconds = count * (BATCH_DELETE_MESSAGE_INTERVAL + ESTIMATED_REQUEST_SECONDS)
+    return batches, seconds
+
+
+def preview_targets(db: Session, guild_id: str, conditions: dict, limit: int = 5) -> list:
+    filters = target_filters(guild_id, conditions)
+    return db.query(AnonymousPost.channel_id, AnonymousPost.content).filter(
+        *filters, AnonymousPost.deleted_at.is_(None)
+    ).order_by(AnonymousPost.id.asc()).limit(limit).all()
+
+
+def soft_delete_chunk(db: Session, filters: list, after_id: int, limit: int, deleted_by: str) -> list:
+    """after_id より後の対象投稿を最大 limit 件、1回の UPDATE ... RETURNING で論理削除する"""
+    chunk_ids = select(AnonymousPost.id).where(
+        *filters,
+        AnonymousPost.deleted_at.is_(None),
+        AnonymousPost.id > after_id
+    ).order_by(AnonymousPost.id.asc()).limit(limit)
+
+    result = db.execute(
+        update(AnonymousPost)
+        .where(AnonymousPost.id.in_(chunk_ids.scalar_subquery()))
+        .values(deleted_at=discord.utils.utcnow(), deleted_by=deleted_by)
+        .returning(AnonymousPost.id, AnonymousPost.message_id, AnonymousPost.channel_id, AnonymousPost.thread_id)
+        .execution_options(synchronize_session=False)
+    )
+    return sorted(result.all(), key=lambda row: row.id)
+
+
+class BatchDeleteWorker:
+    """BatchDeleteJob を1件ずつバックグラウンドで処理する
+
+    投稿はチャンクごとに論理削除してから、Webhook経由でDiscord上のメッセージを削除する。
+    進捗 (last_post_id / purged_post_id) はチャンクごとにコミットするため、
+    再起動後は pending / running のジョブを続きから再開できる。
+    """
+
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self.queue: asyncio.Queue[int] = asyncio.Queue()
+        self.progress_messages: dict[int, discord.WebhookMessage] = {}
+        self._last_report: dict[int, float] = {}
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        db: Session = next(get_db())
+        try:
+            jobs = db.query(BatchDeleteJob.id, BatchDeleteJob.guild_id).filter(
+                BatchDeleteJob.status.in_(ACTIVE_STATUSES)
+            ).order_by(BatchDeleteJob.id.asc()).all()
+            # シャードを複数プロセスで分担している場合は、自プロセスのギルドのジョブだけ再開する
+            handles_guild = getattr(self.bot, 'handles_guild', None)
+            job_ids = [job_id for job_id, guild_id in jobs if handles_guild is None or handles_guild(guild_id)]
+        finally:
+            db.close()
+        for job_id in job_ids:
+            self.queue.put_nowait(job_id)
+        if job_ids:
+            logger.info(f"Resuming {len(job_ids)} batch delete job(s).")
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        # 処理中のジョブは running のまま残り、次回起動時に再開される
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def enqueue(self, job_id: int, progress_message: discord.WebhookMessage | None = None):
+        if progress_message is not None:
+            self.progress_messages[job_id] = progress_message
+        self.queue.put_nowait(job_id)
+
+    async def _run(self):
+        await self.bot.wait_until_ready()
+        while True:
+            job_id = await self.queue.get()
+            try:
+                await self.process(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Batch delete job {job_id} failed: {e}", exc_info=True)
+                self._mark_failed(job_id, e)
+                await self._report(job_id, f"❌ 一括削除ジョブ #{job_id} の処理中にエラーが発生しました。", force=True)
+            finally:
+                self.progress_messages.pop(job_id, None)
+                self._last_report.pop(job_id, None)
+
+    def _mark_failed(self, job_id: int, error: Exception):
+        db: Session = next(get_db())
+        try:
+            job = db.get(BatchDeleteJob, job_id)
+            if job:
+                job.status = 'failed'
+                job.error_message = str(error)
+                job.completed_at = discord.utils.utcnow()
+                db.commit()
+        except Exception:
+            db.rollback()
+            logger.error(f"Failed to mark batch delete job {job_id} as failed.", exc_info=True)
+        finally:
+            db.close()
+
+    async def process(self, job_id: int):
+        db: Session = next(get_db())
+        try:
+            job = db.get(BatchDeleteJob, job_id)
+            if job is None or job.status not in ACTIVE_STATUSES:
+                return
+            if job.status == 'pending':
+                job.status = 'running'
+                job.started_at = discord.utils.utcnow()
+                db.commit()
+
+            guild = self.bot.get_guild(int(job.guild_id))
+            if guild is None:
+                # BOTがギルドから外れている場合は、Discord上のメッセージを削除できないため中止する
+                raise RuntimeError(f"Guild {job.guild_id} is not available to this bot")
+            if guild.unavailable:
+                # 障害などで一時的に利用できない場合は、進捗を進めずに後で再試行する
+                logger.warning(f"Guild {job.guild_id} is unavailable; retrying batch delete job {job_id} later.")
+                asyncio.get_running_loop().call_later(BATCH_DELETE_RETRY_DELAY, self.queue.put_nowait, job_id)
+                return
+            conditions = job.conditions
+            max_count = conditions.get('max_count')
+            webhooks: dict[int, discord.Webhook] = {}
+            filters = target_filters(job.guild_id, conditions)
+
+            # 前回中断時に論理削除だけ済んでいるチャンクのメッセージを先に削除する
+            if (job.purged_post_id or 0) < (job.last_post_id or 0):
+                rows = db.query(AnonymousPost.id, AnonymousPost.message_id, AnonymousPost.channel_id, AnonymousPost.thread_id).filter(
+                    *filters,
+                    AnonymousPost.id > (job.purged_post_id or 0),
+                    AnonymousPost.id <= job.last_post_id,
+                    AnonymousPost.deleted_at.isnot(None)
+                ).order_by(AnonymousPost.id.asc()).all()
+                await self._delete_messages(guild, rows, webhooks)
+                job.purged_post_id = job.last_post_id
+                db.commit()
+
+            while True:
+                limit = BATCH_DELETE_CHUNK_SIZE
+                if max_count:
+                    limit = min(limit, max_count - job.processed_count)
+                if limit <= 0:
+                    break
+
+                # Discordで削除する前に論理削除しておき、削除イベントで外部削除として扱われないようにする
+                rows = soft_delete_chunk(db, filters, job.last_post_id or 0, limit, job.created_by)
+                if not rows:
+                    break
+                job.last_post_id = rows[-1].id
+                job.processed_count += len(rows)
+                db.commit()
+                for row in rows:
+                    recent_posts.evict(row.message_id)
+
+                await self._delete_messages(guild, rows, webhooks)
+                job.purged_post_id = job.last_post_id
+                db.commit()
+
+                await self._report(job_id, f"⏳ 一括削除ジョブ #{job_id}: {job.processed_count}/{job.total_count or '?'} 件を削除しました。")
+
+            job.status = 'completed'
+            job.completed_at = discord.utils.utcnow()
+            db.add(BulkDeleteHistory(
+                guild_id=job.guild_id,
+                executed_by=job.created_by,
+                target_type='anonymous_post',
+                scope=conditions.get('scope'),
+                conditions={'type': conditions['type'], 'value': conditions.get('value')},
+                deleted_count=job.processed_count,
+                dry_run=False
+            ))
+            db.commit()
+            logger.info(f"Batch delete job {job_id} completed: {job.processed_count} posts deleted.")
+
+            await self._report(job_id, f"✅ 一括削除ジョブ #{job_id} が完了しました。{job.processed_count} 件の投稿を削除しました。", force=True)
+            await self._notify_admins(db, job)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def _get_channel(self, guild: discord.Guild, channel_id: int):
+        channel = guild.get_channel_or_thread(channel_id)
+        if channel is None:
+            try:
+                channel = await guild.fetch_channel(channel_id)
+            except (discord.NotFound, discord.Forbidden):
+                return None
+        return channel
+
+    async def _delete_messages(self, guild: discord.Guild, rows: list, webhooks: dict):
+        anonymous_post_cog = self.bot.get_cog("AnonymousPostCog")
+        channels: dict[int, object] = {}
+        for row in rows:
+            # スレッド (/th・フォーラム投稿) 内の投稿は、スレッド内のメッセージとして削除する
+            channel_id = int(row.thread_id or row.channel_id)
+            if channel_id not in channels:
+                channels[channel_id] = await self._get_channel(guild, channel_id)
+            channel = channels[channel_id]
+            if channel is None:
+                continue
+
+            webhook_key = channel.parent_id if isinstance(channel, discord.Thread) else channel.id
+            try:
+                if webhook_key not in webhooks:
+                    webhooks[webhook_key] = await anonymous_post_cog.get_webhook(channel)
+                kwargs = {"thread": channel} if isinstance(channel, discord.Thread) else {}
+                await webhooks[webhook_key].delete_message(int(row.message_id), **kwargs)
+            except discord.NotFound:
+                pass  # Already deleted
+            except discord.HTTPException as e:
+                logger.warning(f"Failed to delete message {row.message_id} in batch delete: {e}")
+            await asyncio.sleep(BATCH_DELETE_MESSAGE_INTERVAL)
+
+    async def _report(self, job_id: int, content: str, force: bool = False):
+        message = self.progress_messages.get(job_id)
+        if message is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_report.get(job_id, 0) < BATCH_DELETE_PROGRESS_INTERVAL:
+            return
+        self._last_report[job_id] = now
+        try:
+            await message.edit(content=content)
+        except discord.HTTPException:
+            # インタラクションのトークンが失効した場合などは以降の通知をやめる
+            self.progress_messages.pop(job_id, None)
+
+    async def _notify_admins(self, db: Session, job: BatchDeleteJob):
+        config_cog = self.bot.get_cog("ConfigCog")
+        anonymous_post_cog = self.bot.get_cog("AnonymousPostCog")
+        if not config_cog or not anonymous_post_cog:
+            return
+        settings = await config_cog.get_guild_settings(db, job.guild_id)
+        if not settings.get('bulk_delete_notify_admins', True):
+            return
+        embed = discord.Embed(title="一括削除完了", color=discord.Color.orange(), timestamp=discord.utils.utcnow())
+        embed.add_field(name="ジョブID", value=str(job.id), inline=True)
+        embed.add_field(name="実行者", value=f"<@{job.created_by}>", inline=True)
+        embed.add_field(name="削除件数", value=str(job.processed_count), inline=True)
+        embed.add_field(name="条件", value=f"`{job.conditions['type']}`: {job.conditions.get('value')}", inline=False)
+        await anonymous_post_cog._send_log_message(job.guild_id, embed)
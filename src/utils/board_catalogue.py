@@ -0,0 +1,59 @@
+import datetime
+
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import AnonymousThread, Board
+from utils.message_filter import AnonymousMessageFilter
+
+# 匿名スレッドは投稿より少ないため、小さい容量から始める
+THREAD_FILTER_MIN_CAPACITY = 10000
+
+# /th で作られたスレッドのIDかどうかを、DBに問い合わせずに判定する
+anonymous_threads = AnonymousMessageFilter(
+    AnonymousThread.thread_discord_id, AnonymousThread.deleted_at.is_(None), min_capacity=THREAD_FILTER_MIN_CAPACITY
+)
+
+
+def record_thread_created(db: Session, guild_id: str, board: str, created_at: datetime.datetime):
+    """ボードのスレッド数を1増やし、最終更新日時を進める。ボードがなければ作る
+
+    呼び出し側のトランザクション内で実行し、コミットは呼び出し側で行う。
+    """
+    values = {'thread_count': Board.thread_count + 1, 'last_activity_at': created_at}
+    result = db.execute(
+        update(Board).where(Board.guild_id == guild_id, Board.name == board).values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount:
+        return
+    try:
+        # 同じボードが同時に作られた場合に備えて、セーブポイント内で追加する
+        with db.begin_nested():
+            db.add(Board(guild_id=guild_id, name=board, thread_count=1, last_activity_at=created_at))
+    except IntegrityError:
+        db.execute(
+            update(Board).where(Board.guild_id == guild_id, Board.name == board).values(**values)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def record_thread_deleted(db: Session, thread_id: str, deleted_at: datetime.datetime) -> tuple[str, str] | None:
+    """削除されたスレッドが匿名スレッドなら論理削除してボードのスレッド数を1減らし、(guild_id, ボード名) を返す"""
+    row = db.execute(
+        update(AnonymousThread)
+        .where(AnonymousThread.thread_discord_id == thread_id, AnonymousThread.deleted_at.is_(None))
+        .values(deleted_at=deleted_at)
+        .returning(AnonymousThread.guild_id, AnonymousThread.board)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if row is None:
+        return None
+    db.execute(
+        update(Board)
+        .where(Board.guild_id == row.guild_id, Board.name == row.board, Board.thread_count > 0)
+        .values(thread_count=Board.thread_count - 1)
+        .execution_options(synchronize_session=False)
+    )
+    return row.guild_id, row.board
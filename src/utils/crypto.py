@@ -18,6 +18,7 @@ class Encryptor:
         self.backend = default_backend()
         self.iv_length = 12
         self.kdf_iterations = 100000
+        self._anon_id_key_cache: dict[str, bytes] = {}
 
     def _derive_key(self, salt: bytes, length: int = 32) -> bytes:
         """マスターキーとソルトから鍵を導出する"""
@@ -45,6 +46,21 @@ class Encryptor:
         user_salt = f"persistent-{user_id}-{guild_salt}".encode()
         return self._derive_key(user_salt)
 
+    def get_anon_id_hmac_key(self, guild_salt: str) -> bytes:
+        """サーバーソルトから匿名ID導出用のHMAC鍵を導出する(ギルドごとにキャッシュ)"""
+        key = self._anon_id_key_cache.get(guild_salt)
+        if key is None:
+            key = self._derive_key(f"anon-id-{guild_salt}".encode())
+            self._anon_id_key_cache[guild_salt] = key
+        return key
+
+    def derive_anon_id(self, user_id_signature: str, channel_or_thread_id: str, rotation_epoch: int, guild_salt: str, length: int = 10) -> str:
+        """署名・スコープ・ローテーション期間から匿名IDを決定的に導出する"""
+        hmac_key = self.get_anon_id_hmac_key(guild_salt)
+        h = hmac.HMAC(hmac_key, hashes.SHA256(), backend=self.backend)
+        h.update(f"{user_id_signature}|{channel_or_thread_id}|{rotation_epoch}".encode())
+        return base64.urlsafe_b64encode(h.finalize()).decode()[:length]
+
     def encrypt(self, data: str, guild_salt: str) -> str:
         """サーバー鍵で文字列を暗号化する"""
         if not isinstance(data, str):
@@ -87,10 +103,17 @@ class Encryptor:
 
     def sign_search_tag(self, daily_signature: str, user_id: str, guild_salt: str) -> str:
         """永続鍵でdaily_user_id_signatureに署名し、search_tagを生成する"""
+        return self.search_tag_signer(user_id, guild_salt)(daily_signature)
+
+    def search_tag_signer(self, user_id: str, guild_salt: str):
+        """同じユーザーのsearch_tagを繰り返し計算する関数を返す(永続鍵の導出は1回だけ)"""
         hmac_key = self.get_persistent_user_hmac_key(user_id, guild_salt)
-        h = hmac.HMAC(hmac_key, hashes.SHA256(), backend=self.backend)
-        h.update(daily_signature.encode())
-        return base64.b64encode(h.finalize()).decode()
+
+        def sign(daily_signature: str) -> str:
+            h = hmac.HMAC(hmac_key, hashes.SHA256(), backend=self.backend)
+            h.update(daily_signature.encode())
+            return base64.b64encode(h.finalize()).decode()
+        return sign
 
     def sign_persistent_user_id(self, user_id: str, guild_salt: str) -> str:
         """永続鍵でユーザーIDに署名し、user_id_signatureを生成する"""
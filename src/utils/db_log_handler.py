@@ -1,24 +1,109 @@
-import logging
+import os
+import time
+import queue
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler
+
+from sqlalchemy import insert
+
 from database import SessionLocal
 from models import BotLog
 
+DB_LOG_QUEUE_SIZE = int(os.getenv("DB_LOG_QUEUE_SIZE", 10000))
+DB_LOG_BATCH_SIZE = int(os.getenv("DB_LOG_BATCH_SIZE", 200))
+DB_LOG_FLUSH_INTERVAL = float(os.getenv("DB_LOG_FLUSH_INTERVAL", 1.0))
 
-class DatabaseLogHandler(logging.Handler):
-    def __init__(self):
-        super().__init__()
+_STOP = object()
 
-    def emit(self, record):
+
+class DatabaseLogListener(threading.Thread):
+    """キューからログを取り出し、件数または時間の条件でまとめてDBに書き込むスレッド"""
+
+    def __init__(self, log_queue: queue.Queue, batch_size: int, flush_interval: float):
+        super().__init__(name="db-log-writer", daemon=True)
+        self.queue = log_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.failed = 0
+
+    def run(self):
+        batch = []
+        deadline = 0.0
+        stopping = False
+        while not stopping:
+            timeout = max(deadline - time.monotonic(), 0) if batch else None
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                stopping = True
+            elif item is not None:
+                if not batch:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(item)
+                if len(batch) < self.batch_size and time.monotonic() < deadline:
+                    continue
+
+            if batch:
+                self._write(batch)
+                batch = []
+
+    def _write(self, batch: list[dict]):
         db = SessionLocal()
         try:
-            log_entry = BotLog(
-                logger_name=record.name,
-                level=record.levelname,
-                message=record.getMessage()
-            )
-            db.add(log_entry)
+            db.execute(insert(BotLog), batch)
             db.commit()
+            self.written += len(batch)
         except Exception:
             db.rollback()
-            # ここでエラーを発生させると無限ループになる可能性があるため、何もしない
+            # ここでログを出すと自身のキューに戻ってくるため、件数だけ数える
+            self.failed += len(batch)
         finally:
             db.close()
+
+    def stop(self, timeout: float = 5.0):
+        self.queue.put(_STOP)
+        self.join(timeout)
+
+
+class DatabaseLogHandler(QueueHandler):
+    """ログをキューに積むだけのハンドラ。DBへの書き込みはリスナースレッドがまとめて行う
+
+    キューが一杯のときはレコードを破棄し、dropped に数える。
+    終了時 (logging.shutdown) に残りを書き出す。
+    """
+
+    def __init__(self, queue_size: int = DB_LOG_QUEUE_SIZE, batch_size: int = DB_LOG_BATCH_SIZE, flush_interval: float = DB_LOG_FLUSH_INTERVAL):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self.dropped = 0
+        self.listener = DatabaseLogListener(self.queue, batch_size, flush_interval)
+        self.listener.start()
+
+    def emit(self, record):
+        # 書き込みスレッド自身のログはDBに送らない(再帰を防ぐ)
+        if record.thread == self.listener.ident:
+            return
+        super().emit(record)
+
+    def prepare(self, record) -> dict:
+        return {
+            "logger_name": record.name,
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "created_at": datetime.fromtimestamp(record.created, timezone.utc),
+        }
+
+    def enqueue(self, item: dict):
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        if self.listener.is_alive():
+            self.listener.stop()
+        super().close()
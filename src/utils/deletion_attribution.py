@@ -0,0 +1,250 @@
+import os
+import time
+import asyncio
+import logging
+import datetime
+from collections import OrderedDict, defaultdict
+from typing import Awaitable, Callable
+
+import discord
+from discord.ext import commands
+from sqlalchemy import update
+
+from database import SessionLocal
+from models import AnonymousPost
+from utils.post_cache import recent_posts
+
+logger = logging.getLogger(__name__)
+
+# 削除を集める時間(秒)。監査ログが記録されるまでの待ち時間も兼ねる
+DELETION_ATTRIBUTION_WINDOW = float(os.getenv("DELETION_ATTRIBUTION_WINDOW", 2.0))
+# 1回の取得で見る監査ログの件数 (APIの上限は100)
+AUDIT_LOG_FETCH_LIMIT = int(os.getenv("AUDIT_LOG_FETCH_LIMIT", 50))
+# 初めて見る監査ログを今回の削除とみなす、ウィンドウ開始前の猶予(秒)
+AUDIT_LOG_SLACK = 10
+# 件数を覚えておく監査ログエントリの数
+SEEN_ENTRY_LIMIT = 2000
+# 知らない削除対象があった場合に、ギルドのWebhook一覧を取り直す最短の間隔(秒)
+WEBHOOK_REFRESH_INTERVAL = 300
+
+
+class PendingDeletion:
+    """監査ログでの照合を待っている削除 (単体・一括削除されたメッセージ、またはフォーラム投稿のスレッド)"""
+    __slots__ = ('channel_id', 'message_ids', 'thread_id', 'thread_name', 'bulk', 'queued_at', 'deleter')
+
+    def __init__(self, channel_id: int, message_ids: list[int] | None = None, thread_id: int | None = None, thread_name: str | None = None, bulk: bool = False):
+        self.channel_id = channel_id
+        self.message_ids = message_ids or []
+        self.thread_id = thread_id
+        self.thread_name = thread_name
+        self.bulk = bulk
+        self.queued_at = discord.utils.utcnow()
+        self.deleter: discord.abc.User | None = None
+
+
+class DeletionAttributor:
+    """外部で削除された匿名投稿の削除者を、ギルドごとにまとめて監査ログから特定する
+
+    削除をギルドごとに DELETION_ATTRIBUTION_WINDOW 秒集め、監査ログを1回だけ取得して照合し、
+    論理削除を1トランザクションで書き込む。Discordは同じ実行者・チャンネルのメッセージ削除を
+    1つのエントリにまとめて件数 (extra.count) を増やすため、前回見た件数との差分を
+    そのチャンネルで削除された件数として割り当てる。削除対象がBOT自身またはBOTのWebhookの
+    メッセージでないエントリ (他のユーザーのメッセージの削除) は割り当てない。照合できなかった削除は、
+    従来どおり投稿者本人による削除とみなす。
+    """
+
+    def __init__(self, bot: commands.Bot, send_log: Callable[[str, discord.Embed], Awaitable[None]], window: float = DELETION_ATTRIBUTION_WINDOW):
+        self.bot = bot
+        self.send_log = send_log
+        self.window = window
+        self._pending: dict[int, list[PendingDeletion]] = {}
+        self._tasks: dict[int, asyncio.Task] = {}
+        self._entry_counts: OrderedDict[int, int] = OrderedDict()
+        # 匿名投稿の作成者になり得るWebhookのID (get_webhook で取得したものと、ギルドから取り直したもの)
+        self.own_webhook_ids: set[int] = set()
+        self._webhooks_refreshed_at: dict[int, float] = {}
+        self.audit_log_requests = 0
+        self.attributed = 0
+        self.unattributed = 0
+
+    def add(self, guild_id: int, deletion: PendingDeletion):
+        """削除をキューに追加する。ギルドのウィンドウが開いていなければ開始する"""
+        self._pending.setdefault(guild_id, []).append(deletion)
+        if guild_id not in self._tasks:
+            self._tasks[guild_id] = asyncio.create_task(self._flush_after(guild_id))
+
+    async def close(self):
+        """待機中のウィンドウを打ち切り、残りの削除を書き込む"""
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+        for guild_id in list(self._pending):
+            await self.flush_guild(guild_id)
+
+    async def _flush_after(self, guild_id: int):
+        await asyncio.sleep(self.window)
+        self._tasks.pop(guild_id, None)
+        try:
+            await self.flush_guild(guild_id)
+        except Exception as e:
+            logger.error(f"Failed to flush deletions for guild {guild_id}: {e}", exc_info=True)
+
+    async def flush_guild(self, guild_id: int):
+        pending = self._pending.pop(guild_id, [])
+        if not pending:
+            return
+        guild = self.bot.get_guild(guild_id)
+        if guild:
+            try:
+                await self._attribute(guild, pending)
+            except discord.Forbidden:
+                pass  # 監査ログの閲覧権限がない
+            except discord.HTTPException as e:
+                logger.warning(f"Failed to fetch audit logs for guild {guild_id}: {e}")
+        rows = await asyncio.to_thread(self._soft_delete, str(guild_id), pending)
+        for row in rows.values():
+            recent_posts.evict(row.message_id)
+        await self._send_logs(str(guild_id), pending, rows)
+
+    def _remember_count(self, entry_id: int, count: int) -> int | None:
+        previous = self._entry_counts.pop(entry_id, None)
+        self._entry_counts[entry_id] = count
+        while len(self._entry_counts) > SEEN_ENTRY_LIMIT:
+            self._entry_counts.popitem(last=False)
+        return previous
+
+    def _is_own_author(self, target) -> bool:
+        return target is not None and (target.id == self.bot.user.id or target.id in self.own_webhook_ids)
+
+    async def _refresh_webhooks(self, guild: discord.Guild):
+        """ギルドのWebhookのうちBOTが作成したものを覚える (再起動後など、まだ取得していない場合)"""
+        now = time.monotonic()
+        if now - self._webhooks_refreshed_at.get(guild.id, -WEBHOOK_REFRESH_INTERVAL) < WEBHOOK_REFRESH_INTERVAL:
+            return
+        self._webhooks_refreshed_at[guild.id] = now
+        try:
+            webhooks = await guild.webhooks()
+        except discord.HTTPException as e:
+            logger.warning(f"Failed to fetch webhooks for guild {guild.id}: {e}")
+            return
+        self.own_webhook_ids.update(webhook.id for webhook in webhooks if webhook.user == self.bot.user)
+
+    async def _attribute(self, guild: discord.Guild, pending: list[PendingDeletion]):
+        """監査ログを1回取得し、各削除に削除者を割り当てる"""
+        self.audit_log_requests += 1
+        entries = [entry async for entry in guild.audit_logs(limit=AUDIT_LOG_FETCH_LIMIT)]
+        window_start = min(deletion.queued_at for deletion in pending) - datetime.timedelta(seconds=AUDIT_LOG_SLACK)
+
+        # 削除されたチャンネルのエントリに知らない削除対象があれば、BOTのWebhookかどうかを確認する
+        message_channels = {deletion.channel_id for deletion in pending if not deletion.thread_id and not deletion.bulk}
+        if any(
+            entry.action == discord.AuditLogAction.message_delete and entry.extra.channel.id in message_channels
+            and entry.created_at >= window_start and not self._is_own_author(entry.target)
+            for entry in entries
+        ):
+            await self._refresh_webhooks(guild)
+
+        message_credits: dict[int, list[list]] = defaultdict(list)  # channel_id -> [[実行者, 残り件数]]
+        bulk_deleters: dict[int, list] = defaultdict(list)  # channel_id -> [実行者]
+        thread_deleters: dict[int, discord.abc.User] = {}
+        for entry in reversed(entries):  # 古い順
+            if entry.action == discord.AuditLogAction.message_delete:
+                count = entry.extra.count
+                previous = self._remember_count(entry.id, count)
+                if previous is None:
+                    # 初めて見るエントリは、今回のウィンドウ内に作られたものだけを数える
+                    delta = count if entry.created_at >= window_start else 0
+                else:
+                    delta = count - previous
+                # 削除されたメッセージと同じチャンネルで、BOT (Webhook) のメッセージを削除したエントリだけを割り当てる
+                if delta > 0 and self._is_own_author(entry.target):
+                    message_credits[entry.extra.channel.id].append([entry.user, delta])
+            elif entry.action == discord.AuditLogAction.message_bulk_delete:
+                if entry.created_at >= window_start and self._remember_count(entry.id, entry.extra.count) is None:
+                    bulk_deleters[entry.target.id].append(entry.user)
+            elif entry.action == discord.AuditLogAction.thread_delete:
+                if entry.created_at >= window_start:
+                    thread_deleters[entry.target.id] = entry.user
+
+        for deletion in pending:
+            if deletion.thread_id:
+                deletion.deleter = thread_deleters.get(deletion.thread_id)
+            elif deletion.bulk:
+                deleters = bulk_deleters.get(deletion.channel_id)
+                deletion.deleter = deleters.pop(0) if deleters else None
+            else:
+                credits = message_credits.get(deletion.channel_id)
+                if credits:
+                    deletion.deleter = credits[0][0]
+                    credits[0][1] -= 1
+                    if credits[0][1] <= 0:
+                        credits.pop(0)
+
+    def _soft_delete(self, guild_id: str, pending: list[PendingDeletion]) -> dict[str, object]:
+        """削除者ごとに1回のUPDATEで論理削除し、{message_id または thread_id: 行} を返す (別スレッドで実行する)"""
+        groups: dict[tuple[bool, str | None], list[str]] = defaultdict(list)
+        for deletion in pending:
+            deleter_id = str(deletion.deleter.id) if deletion.deleter else None
+            if deletion.thread_id:
+                groups[(True, deleter_id)].append(str(deletion.thread_id))
+            else:
+                groups[(False, deleter_id)].extend(str(message_id) for message_id in deletion.message_ids)
+            if deletion.deleter:
+                self.attributed += 1
+            else:
+                self.unattributed += 1
+
+        now = discord.utils.utcnow()
+        rows = {}
+        db = SessionLocal()
+        try:
+            for (is_thread, deleter_id), ids in groups.items():
+                column = AnonymousPost.thread_id if is_thread else AnonymousPost.message_id
+                result = db.execute(
+                    update(AnonymousPost)
+                    .where(AnonymousPost.guild_id == guild_id, column.in_(ids), AnonymousPost.deleted_at.is_(None))
+                    # 監査ログで追えない場合は、投稿者自身が削除したとみなし、暗号化IDを保存
+                    .values(deleted_at=now, deleted_by=deleter_id or AnonymousPost.user_id_encrypted)
+                    .returning(AnonymousPost.message_id, AnonymousPost.thread_id, AnonymousPost.anonymous_id)
+                    .execution_options(synchronize_session=False)
+                )
+                for row in result:
+                    rows[row.thread_id if is_thread else row.message_id] = row
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        return rows
+
+    async def _send_logs(self, guild_id: str, pending: list[PendingDeletion], rows: dict[str, object]):
+        for deletion in pending:
+            deleter_value = deletion.deleter.mention if deletion.deleter else "不明 (投稿者本人による削除の可能性)"
+            if deletion.thread_id:
+                row = rows.get(str(deletion.thread_id))
+                if not row:
+                    continue
+                embed = discord.Embed(title="匿名フォーラム投稿削除 (外部)", color=0x7289da, timestamp=discord.utils.utcnow())
+                embed.add_field(name="匿名ID", value=row.anonymous_id, inline=False)
+                embed.add_field(name="対象スレッド", value=deletion.thread_name or deletion.thread_id, inline=False)
+                embed.add_field(name="フォーラム", value=f"<#{deletion.channel_id}>", inline=False)
+            elif deletion.bulk:
+                deleted = [rows[str(message_id)] for message_id in deletion.message_ids if str(message_id) in rows]
+                if not deleted:
+                    continue
+                embed = discord.Embed(title="匿名投稿一括削除 (外部)", color=0x7289da, timestamp=discord.utils.utcnow())
+                embed.add_field(name="削除件数", value=len(deleted), inline=False)
+                embed.add_field(name="匿名ID", value=", ".join(sorted({row.anonymous_id for row in deleted}))[:1024], inline=False)
+                embed.add_field(name="チャンネル", value=f"<#{deletion.channel_id}>", inline=False)
+                deleter_value = deletion.deleter.mention if deletion.deleter else "不明"
+            else:
+                row = rows.get(str(deletion.message_ids[0]))
+                if not row:
+                    continue
+                embed = discord.Embed(title="匿名投稿削除 (外部)", color=0x7289da, timestamp=discord.utils.utcnow())
+                embed.add_field(name="匿名ID", value=row.anonymous_id, inline=False)
+                embed.add_field(name="対象メッセージID", value=row.message_id, inline=False)
+                embed.add_field(name="チャンネル", value=f"<#{deletion.channel_id}>", inline=False)
+            embed.add_field(name="削除実行者", value=deleter_value, inline=False)
+            await self.send_log(guild_id, embed)
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+from collections import deque
+
+import discord
+from discord.ext import commands
+
+from database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Discordの1メッセージあたりのEmbed上限
+MAX_EMBEDS_PER_MESSAGE = 10
+
+
+class LogDispatcher:
+    """ログチャンネルへのEmbed送信をギルドごとにキューイングし、まとめて送信する"""
+
+    def __init__(self, bot: commands.Bot, flush_interval: float = 2.0, max_queue_size: int = 500):
+        self.bot = bot
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self._queues: dict[str, deque[discord.Embed]] = {}
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self.dropped = 0
+        self.sent_messages = 0
+        self.failed_messages = 0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """バックグラウンドタスクを停止し、残りのキューを送信する"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def enqueue(self, guild_id: str, embed: discord.Embed):
+        """Embedをキューに追加する(送信は待たない)"""
+        queue = self._queues.setdefault(guild_id, deque())
+        if len(queue) >= self.max_queue_size:
+            # 上限を超えた場合は最も古いものを捨てる
+            queue.popleft()
+            self.dropped += 1
+        queue.append(embed)
+        if len(queue) >= MAX_EMBEDS_PER_MESSAGE:
+            self._wakeup.set()
+
+    def queue_depth(self, guild_id: str | None = None) -> int:
+        """キューに溜まっているEmbed数を返す(guild_id省略時は全ギルドの合計)"""
+        if guild_id is not None:
+            return len(self._queues.get(guild_id, ()))
+        return sum(len(q) for q in self._queues.values())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Failed to flush log dispatcher: {e}", exc_info=True)
+
+    async def flush(self):
+        guild_ids = [guild_id for guild_id, queue in self._queues.items() if queue]
+        if guild_ids:
+            await asyncio.gather(*(self._flush_guild(guild_id) for guild_id in guild_ids))
+
+    async def _flush_guild(self, guild_id: str):
+        queue = self._queues.get(guild_id)
+        channel = await self._resolve_channel(guild_id)
+        if channel is None:
+            # ログチャンネル未設定の場合は破棄する
+            queue.clear()
+            return
+
+        while queue:
+            batch = [queue.popleft() for _ in range(min(MAX_EMBEDS_PER_MESSAGE, len(queue)))]
+            try:
+                await channel.send(embeds=batch)
+                self.sent_messages += 1
+            except discord.HTTPException as e:
+                self.failed_messages += 1
+                logger.warning(f"Failed to send log message to guild {guild_id}: {e}")
+                if isinstance(e, (discord.Forbidden, discord.NotFound)):
+                    queue.clear()
+                    return
+                if e.status >= 500:
+                    # 一時的な障害は先頭に戻し、次回の送信で再試行する
+                    queue.extendleft(reversed(batch))
+                    return
+                # それ以外 (不正なEmbedなど) は再試行しても失敗するため、このバッチだけ破棄する
+            except BaseException:
+                # 停止時のキャンセルや通信エラーでもEmbedを失わないよう戻す (close() で送り直す)
+                queue.extendleft(reversed(batch))
+                raise
+
+    async def _resolve_channel(self, guild_id: str) -> discord.abc.Messageable | None:
+        config_cog = self.bot.get_cog("ConfigCog")
+        if not config_cog:
+            return None
+        settings = config_cog.settings_cache.get(guild_id)
+        if settings is None:
+            db = SessionLocal()
+            try:
+                settings = await config_cog.get_guild_settings(db, guild_id)
+            finally:
+                db.close()
+        log_channel_id = settings.get('log_channel_id')
+        if not log_channel_id:
+            return None
+        return self.bot.get_channel(int(log_channel_id))
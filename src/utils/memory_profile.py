@@ -0,0 +1,36 @@
+import os
+import gc
+
+import discord
+
+# 省メモリモード。メンバーキャッシュとメッセージキャッシュを絞り、起動後にGC対象から既存オブジェクトを外す
+LOW_MEMORY_MODE = os.getenv("LOW_MEMORY_MODE", "").lower() in ("1", "true", "yes")
+# 省メモリモードでのメッセージキャッシュ件数 (0でキャッシュしない)
+LOW_MEMORY_MAX_MESSAGES = int(os.getenv("LOW_MEMORY_MAX_MESSAGES", 100))
+
+
+def client_options(low_memory: bool = LOW_MEMORY_MODE) -> dict:
+    """Bot (Client) に渡すキャッシュ関連のオプション"""
+    if not low_memory:
+        return {}
+    return {
+        'max_messages': LOW_MEMORY_MAX_MESSAGES or None,
+        'member_cache_flags': discord.MemberCacheFlags.none(),
+        'chunk_guilds_at_startup': False,
+    }
+
+
+def freeze_after_warmup():
+    """起動時に作られたオブジェクトを回収済みにした上で、以降の世代別GCの走査対象から外す"""
+    gc.collect()
+    gc.freeze()
+
+
+def rss_bytes() -> int:
+    """現在のプロセスの常駐メモリ (RSS)。取得できない環境では最大RSSを返す"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
@@ -0,0 +1,115 @@
+import os
+import math
+import asyncio
+import logging
+
+from sqlalchemy import func
+
+from database import SessionLocal
+from models import AnonymousPost
+
+logger = logging.getLogger(__name__)
+
+# 想定する最小の件数と偽陽性率。件数が容量を超えたら2倍の容量で作り直す
+ANON_MESSAGE_FILTER_MIN_CAPACITY = int(os.getenv("ANON_MESSAGE_FILTER_MIN_CAPACITY", 100000))
+ANON_MESSAGE_FILTER_ERROR_RATE = float(os.getenv("ANON_MESSAGE_FILTER_ERROR_RATE", 0.001))
+REBUILD_BATCH_SIZE = 10000
+
+_MASK64 = (1 << 64) - 1
+
+
+def _mix64(value: int) -> int:
+    """splitmix64 の最終化関数。連番に近いSnowflakeをビット位置に散らす"""
+    value = (value + 0x9E3779B97F4A7C15) & _MASK64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return value ^ (value >> 31)
+
+
+class BloomFilter:
+    """整数用のブルームフィルタ (偽陽性はあるが偽陰性はない)"""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value: int):
+        # 2つのハッシュから k 個の位置を作る (Kirsch-Mitzenmacher)
+        h1 = _mix64(value)
+        h2 = _mix64(h1) | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, value: int):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value: int) -> bool:
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class AnonymousMessageFilter:
+    """匿名投稿のメッセージIDかどうかを、DBに問い合わせずに判定する
+
+    起動時に anonymous_posts の未削除の投稿から作り、投稿のたびに追加する。
+    含まれないと判定されたメッセージは匿名投稿ではないことが確定する。
+    含まれると判定された場合は偽陽性の可能性があるため、DBで確認する。
+    作り直しは別スレッドで行い、その間に追加されたIDは作り直したフィルタにも追加する。
+    column と active を指定すると、匿名スレッドのIDなど他のIDの判定にも使える。
+    """
+
+    def __init__(self, column=AnonymousPost.message_id, active=AnonymousPost.deleted_at.is_(None),
+                 min_capacity: int = ANON_MESSAGE_FILTER_MIN_CAPACITY, error_rate: float = ANON_MESSAGE_FILTER_ERROR_RATE):
+        self.column = column
+        self.active = active
+        self.min_capacity = min_capacity
+        self.error_rate = error_rate
+        self.bloom = BloomFilter(min_capacity, error_rate)
+        self._pending: list[int] | None = None  # 作り直し中に追加されたID
+        self._rebuild_task: asyncio.Task | None = None
+
+    def _build(self) -> BloomFilter:
+        db = SessionLocal()
+        try:
+            count = db.query(func.count()).select_from(self.column.class_).filter(self.active).scalar() or 0
+            bloom = BloomFilter(max(self.min_capacity, count * 2), self.error_rate)
+            for (value,) in db.query(self.column).filter(self.active).yield_per(REBUILD_BATCH_SIZE):
+                bloom.add(int(value))
+        finally:
+            db.close()
+        return bloom
+
+    async def rebuild(self):
+        self._pending = []
+        try:
+            bloom = await asyncio.to_thread(self._build)
+            # DBから読み終えた後に追加された投稿は読み込み結果に含まれていない可能性がある
+            for message_id in self._pending:
+                bloom.add(message_id)
+        finally:
+            self._pending = None
+        self.bloom = bloom
+        logger.info(f"Anonymous message filter for {self.column} built: {bloom.count} id(s), {len(bloom.bits) / 1024:.0f}KiB")
+
+    async def _rebuild_in_background(self):
+        try:
+            await self.rebuild()
+        except Exception as e:
+            logger.error(f"Failed to rebuild anonymous message filter: {e}", exc_info=True)
+
+    def add(self, message_id: int | str):
+        message_id = int(message_id)
+        self.bloom.add(message_id)
+        if self._pending is not None:
+            self._pending.append(message_id)
+        elif self.bloom.count > self.bloom.capacity:
+            # 容量を超えると偽陽性率が上がるため作り直す (作り直すまでは今のフィルタを使う)
+            self._rebuild_task = asyncio.create_task(self._rebuild_in_background())
+
+    def __contains__(self, message_id: int) -> bool:
+        return message_id in self.bloom
@@ -0,0 +1,89 @@
+import math
+from abc import ABC, abstractmethod
+
+import discord
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Session
+
+from database import get_db
+
+
+class KeysetPaginationView(discord.ui.View, ABC):
+    """(created_at, id) のキーセットで表示中のページだけを取得するビュー
+
+    sort_columns を指定すると、その列の組をキーにする (最後の列は一意であること)。
+    """
+
+    def __init__(self, bot, guild_id: str, model, columns: list, filters: list, total: int, total_capped: bool = False, descending: bool = False, sort_columns: list | None = None):
+        super().__init__(timeout=180)
+        self.bot = bot
+        self.guild_id = guild_id
+        self.model = model
+        self.columns = columns
+        self.filters = filters
+        self.total = total
+        self.total_capped = total_capped
+        self.descending = descending
+        self.sort_columns = sort_columns or [model.created_at, model.id]
+        self.current_page = 1
+        self.per_page = 10
+        self.cursors: list[tuple | None] = [None]  # 各ページの直前の行の、並び順の列の値
+        self.has_next = False
+
+    def fetch_page(self) -> list:
+        db: Session = next(get_db())
+        try:
+            query = db.query(*self.columns).filter(*self.filters)
+            cursor = self.cursors[self.current_page - 1]
+            key = tuple_(*self.sort_columns)
+            if self.descending:
+                if cursor is not None:
+                    query = query.filter(key < tuple_(*cursor))
+                query = query.order_by(*(column.desc() for column in self.sort_columns))
+            else:
+                if cursor is not None:
+                    query = query.filter(key > tuple_(*cursor))
+                query = query.order_by(*(column.asc() for column in self.sort_columns))
+            rows = query.limit(self.per_page + 1).all()
+        finally:
+            db.close()
+
+        self.has_next = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if rows and len(self.cursors) == self.current_page:
+            self.cursors.append(tuple(getattr(rows[-1], column.key) for column in self.sort_columns))
+        return rows
+
+    def footer_text(self) -> str:
+        if self.total_capped:
+            return f"ページ {self.current_page} ({self.total}件以上)"
+        total_pages = max(math.ceil(self.total / self.per_page), 1)
+        return f"ページ {self.current_page}/{total_pages} ({self.total}件)"
+
+    async def get_page_embed(self) -> discord.Embed:
+        rows = self.fetch_page()
+        embed = await self.build_embed(rows)
+        embed.set_footer(text=self.footer_text())
+        return embed
+
+    @abstractmethod
+    async def build_embed(self, rows: list) -> discord.Embed:
+        """取得したページの行からEmbedを作る"""
+
+    @discord.ui.button(label="◀️ 前へ", style=discord.ButtonStyle.grey)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if self.current_page > 1:
+            self.current_page -= 1
+            embed = await self.get_page_embed()
+            await interaction.response.edit_message(embed=embed, view=self)
+        else:
+            await interaction.response.defer()
+
+    @discord.ui.button(label="次へ ▶️", style=discord.ButtonStyle.grey)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if self.has_next:
+            self.current_page += 1
+            embed = await self.get_page_embed()
+            await interaction.response.edit_message(embed=embed, view=self)
+        else:
+            await interaction.response.defer()
@@ -0,0 +1,131 @@
+import os
+import re
+import logging
+import datetime
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# 何か月先までパーティションを作成しておくか
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", 3))
+
+
+def month_start(value: datetime.datetime) -> datetime.date:
+    return datetime.date(value.year, value.month, 1)
+
+
+def next_month(value: datetime.date) -> datetime.date:
+    return datetime.date(value.year + (value.month == 12), value.month % 12 + 1, 1)
+
+
+class MonthlyPartitioner:
+    """created_at による月単位のレンジパーティションを管理する (PostgreSQLのみ)
+
+    パーティション名は <table>_pYYYYMM とし、境界はUTCの月初とする。
+    どの月にも当てはまらない行は DEFAULT パーティション (<table>_default) に入る。
+    """
+
+    def __init__(self, table_name: str, months_ahead: int = PARTITION_MONTHS_AHEAD):
+        self.table_name = table_name
+        self.months_ahead = months_ahead
+        self._name_pattern = re.compile(rf"^{re.escape(table_name)}_p(\d{{4}})(\d{{2}})$")
+
+    def partition_name(self, month: datetime.date) -> str:
+        return f"{self.table_name}_p{month:%Y%m}"
+
+    @property
+    def default_partition_name(self) -> str:
+        return f"{self.table_name}_default"
+
+    def is_partitioned(self, db: Session) -> bool:
+        if db.get_bind().dialect.name != 'postgresql':
+            return False
+        relkind = db.execute(
+            text("SELECT relkind FROM pg_class WHERE relname = :name AND relnamespace = 'public'::regnamespace"),
+            {"name": self.table_name}
+        ).scalar()
+        return relkind == 'p'
+
+    def partitions(self, db: Session) -> dict[datetime.date, str]:
+        """既存のパーティションを {月初: パーティション名} で返す"""
+        rows = db.execute(text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = :name"
+        ), {"name": self.table_name}).scalars()
+        result = {}
+        for name in rows:
+            match = self._name_pattern.match(name)
+            if match:
+                result[datetime.date(int(match.group(1)), int(match.group(2)), 1)] = name
+        return result
+
+    def ensure_default_partition(self, db: Session):
+        db.execute(text(f'CREATE TABLE IF NOT EXISTS "{self.default_partition_name}" PARTITION OF "{self.table_name}" DEFAULT'))
+
+    def ensure_partitions(self, db: Session, now: datetime.datetime | None = None) -> list[str]:
+        """DEFAULTパーティションと、今月から months_ahead か月先までのパーティションを作成し、作成した名前を返す"""
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        self.ensure_default_partition(db)
+        existing = self.partitions(db)
+        created = []
+        month = month_start(now)
+        for _ in range(self.months_ahead + 1):
+            if month not in existing:
+                self._create_partition(db, month)
+                created.append(self.partition_name(month))
+            month = next_month(month)
+        db.commit()
+        if created:
+            logger.info(f"Created partitions for {self.table_name}: {', '.join(created)}")
+        return created
+
+    def _create_partition(self, db: Session, month: datetime.date):
+        """月のパーティションを作成する
+
+        DEFAULTパーティションにその月の行がある場合はパーティションを作成できないため、
+        DEFAULTを一度切り離し、行を新しいパーティションへ移してから付け直す。
+        """
+        name = self.partition_name(month)
+        default = self.default_partition_name
+        lower = f"'{month:%Y-%m-%d} 00:00:00+00'"
+        upper = f"'{next_month(month):%Y-%m-%d} 00:00:00+00'"
+        in_month = f"created_at >= {lower} AND created_at < {upper}"
+        has_rows = db.execute(text(f'SELECT EXISTS (SELECT 1 FROM "{default}" WHERE {in_month})')).scalar()
+        if not has_rows:
+            db.execute(text(f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{self.table_name}" FOR VALUES FROM ({lower}) TO ({upper})'))
+            return
+        db.execute(text(f'ALTER TABLE "{self.table_name}" DETACH PARTITION "{default}"'))
+        db.execute(text(f'CREATE TABLE "{name}" PARTITION OF "{self.table_name}" FOR VALUES FROM ({lower}) TO ({upper})'))
+        db.execute(text(f'INSERT INTO "{self.table_name}" SELECT * FROM "{default}" WHERE {in_month}'))
+        db.execute(text(f'DELETE FROM "{default}" WHERE {in_month}'))
+        db.execute(text(f'ALTER TABLE "{self.table_name}" ATTACH PARTITION "{default}" DEFAULT'))
+        logger.info(f"Moved rows for {month:%Y-%m} from {default} to {name}")
+
+    def drop_partitions_before(self, db: Session, cutoff: datetime.datetime) -> tuple[int, int]:
+        """すべての行が cutoff より古いパーティションを切り離して削除する
+
+        (削除したパーティション数, 推定行数) を返す。cutoff を含む月のパーティションは残るため、
+        実際の保持期間は最大で1か月長くなる。DEFAULTパーティション内の古い行は行単位で削除する。
+        """
+        dropped = 0
+        rows = 0
+        for month, name in sorted(self.partitions(db).items()):
+            if next_month(month) > cutoff.date():
+                continue
+            rows += int(db.execute(text("SELECT GREATEST(reltuples, 0) FROM pg_class WHERE relname = :name"), {"name": name}).scalar() or 0)
+            db.execute(text(f'ALTER TABLE "{self.table_name}" DETACH PARTITION "{name}"'))
+            db.execute(text(f'DROP TABLE "{name}"'))
+            db.commit()
+            dropped += 1
+            logger.info(f"Dropped partition {name}")
+        result = db.execute(
+            text(f'DELETE FROM "{self.default_partition_name}" WHERE created_at < :cutoff'),
+            {"cutoff": cutoff}
+        )
+        db.commit()
+        rows += result.rowcount or 0
+        return dropped, rows
@@ -0,0 +1,96 @@
+import os
+import datetime
+from collections import OrderedDict
+
+import discord
+
+# 保持する最近の投稿の件数
+RECENT_POST_CACHE_SIZE = int(os.getenv("RECENT_POST_CACHE_SIZE", 10000))
+
+
+class CachedPost:
+    """最近の匿名投稿のうち、返信・削除・特定・削除イベントで参照する項目だけを持つ"""
+    __slots__ = (
+        'guild_id', 'message_id', 'anonymous_id', 'channel_id', 'thread_id', 'created_at',
+        'daily_user_id_signature', 'user_id_encrypted', 'is_converted',
+    )
+
+    def __init__(self, guild_id: str, message_id: str, anonymous_id: str, channel_id: str, thread_id: str | None, created_at: datetime.datetime,
+                 daily_user_id_signature: str, user_id_encrypted: str, is_converted: bool = False):
+        self.guild_id = guild_id
+        self.message_id = message_id
+        self.anonymous_id = anonymous_id
+        self.channel_id = channel_id
+        self.thread_id = thread_id
+        self.created_at = created_at
+        self.daily_user_id_signature = daily_user_id_signature
+        self.user_id_encrypted = user_id_encrypted
+        self.is_converted = is_converted
+
+
+class RecentPostCache:
+    """message_id をキーにした最近の投稿のLRUキャッシュ
+
+    投稿のコミット後に書き込み、論理削除したら取り除く。見つからない場合は呼び出し側がDBを参照する。
+    取り除いたメッセージIDは、削除イベントを記録済みとして読み飛ばせるよう別に覚えておく。
+    """
+
+    def __init__(self, max_size: int = RECENT_POST_CACHE_SIZE):
+        self.max_size = max_size
+        self._posts: OrderedDict[int, CachedPost] = OrderedDict()
+        self._deleted: OrderedDict[int, None] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def add_post(self, post) -> CachedPost:
+        """コミット済みの AnonymousPost から記録を作って保持する"""
+        cached = CachedPost(
+            guild_id=post.guild_id,
+            message_id=post.message_id,
+            anonymous_id=post.anonymous_id,
+            channel_id=post.channel_id,
+            thread_id=post.thread_id,
+            # created_at はサーバー側で入るため、メッセージIDの作成時刻を使う
+            created_at=discord.utils.snowflake_time(int(post.message_id)),
+            daily_user_id_signature=post.daily_user_id_signature,
+            user_id_encrypted=post.user_id_encrypted,
+            is_converted=bool(post.is_converted),
+        )
+        key = int(post.message_id)
+        self._posts[key] = cached
+        self._posts.move_to_end(key)
+        while len(self._posts) > self.max_size:
+            self._posts.popitem(last=False)
+        return cached
+
+    def get(self, message_id: int | str, guild_id: str | None = None) -> CachedPost | None:
+        try:
+            cached = self._posts.get(int(message_id))
+        except ValueError:
+            return None
+        if cached is None or (guild_id is not None and cached.guild_id != guild_id):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return cached
+
+    def evict(self, message_id: int | str):
+        """論理削除した投稿を取り除き、削除済みとして覚えておく"""
+        key = int(message_id)
+        self._posts.pop(key, None)
+        self._deleted[key] = None
+        self._deleted.move_to_end(key)
+        while len(self._deleted) > self.max_size:
+            self._deleted.popitem(last=False)
+
+    def was_deleted(self, message_id: int | str) -> bool:
+        try:
+            return int(message_id) in self._deleted
+        except ValueError:
+            return False
+
+    def __len__(self) -> int:
+        return len(self._posts)
+
+
+recent_posts = RecentPostCache()
@@ -0,0 +1,145 @@
+import os
+import re
+import time
+import logging
+from datetime import date
+from functools import cached_property
+
+from sqlalchemy.orm import Session
+
+from models import BotBannedUser, GuildBannedUser, NgWord
+from utils.crypto import Encryptor
+
+logger = logging.getLogger(__name__)
+
+# BAN・NGワードをDBから読み直す間隔(秒)。他のプロセス (シャード) での変更を反映するため
+POST_VALIDATION_REFRESH_INTERVAL = float(os.getenv("POST_VALIDATION_REFRESH_INTERVAL", 60))
+
+# 投稿前の検証の段階 (安いものから順に実行する)
+STAGE_LENGTH = "length"
+STAGE_BAN = "ban"
+STAGE_NG_WORD = "ng_word"
+STAGE_RATE_LIMIT = "rate_limit"
+
+
+class PostRejected(ValueError):
+    """投稿前の検証で拒否された。str() は従来の ValueError と同じメッセージを返す"""
+
+    def __init__(self, stage: str, message: str):
+        super().__init__(message)
+        self.stage = stage
+
+
+class PostIdentity:
+    """投稿者の識別情報。PBKDF2を伴うため、必要になった時点で1回だけ導出する"""
+
+    def __init__(self, encryptor: Encryptor, user_id: str, guild_salt: str, today: date):
+        self.encryptor = encryptor
+        self.user_id = user_id
+        self.guild_salt = guild_salt
+        self.today = today
+
+    @cached_property
+    def daily_signature(self) -> str:
+        return self.encryptor.sign_daily_user_id(self.user_id, self.guild_salt, self.today)
+
+    @cached_property
+    def persistent_signature(self) -> str:
+        return self.encryptor.sign_persistent_user_id(self.user_id, self.guild_salt)
+
+    @cached_property
+    def encrypted_user_id(self) -> str:
+        return self.encryptor.encrypt(self.user_id, self.guild_salt)
+
+    @cached_property
+    def search_tag(self) -> str:
+        return self.encryptor.sign_search_tag(self.daily_signature, self.user_id, self.guild_salt)
+
+
+class BanIndex:
+    """BANされたユーザーIDの索引 (ギルドごと + グローバル)
+
+    /ban・/unban で更新し、POST_VALIDATION_REFRESH_INTERVAL ごとにDBから読み直す。
+    """
+
+    def __init__(self, refresh_interval: float = POST_VALIDATION_REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self.guild_bans: dict[str, set[str]] = {}
+        self.global_bans: set[str] = set()
+        self._loaded_at: float | None = None
+
+    def load(self, db: Session):
+        guild_bans: dict[str, set[str]] = {}
+        for guild_id, user_id in db.query(GuildBannedUser.guild_id, GuildBannedUser.user_id):
+            guild_bans.setdefault(guild_id, set()).add(user_id)
+        self.global_bans = {user_id for (user_id,) in db.query(BotBannedUser.user_id)}
+        self.guild_bans = guild_bans
+        self._loaded_at = time.monotonic()
+
+    def is_banned(self, db: Session, guild_id: str, user_id: str) -> bool:
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.refresh_interval:
+            self.load(db)
+        return user_id in self.global_bans or user_id in self.guild_bans.get(guild_id, ())
+
+    def add(self, guild_id: str | None, user_id: str):
+        """guild_id が None の場合はグローバルBAN"""
+        if guild_id is None:
+            self.global_bans.add(user_id)
+        else:
+            self.guild_bans.setdefault(guild_id, set()).add(user_id)
+
+    def remove(self, guild_id: str | None, user_id: str):
+        if guild_id is None:
+            self.global_bans.discard(user_id)
+        else:
+            self.guild_bans.get(guild_id, set()).discard(user_id)
+
+
+class NgWordMatcher:
+    """ギルドごとのNGワードを読み込み・コンパイル済みの状態で保持する
+
+    NGワードの追加・削除時に invalidate() で破棄し、POST_VALIDATION_REFRESH_INTERVAL ごとにDBから読み直す。
+    """
+
+    def __init__(self, refresh_interval: float = POST_VALIDATION_REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._rules: dict[str, tuple[float, list[tuple]]] = {}
+
+    def invalidate(self, guild_id: str):
+        self._rules.pop(guild_id, None)
+
+    def _load(self, db: Session, guild_id: str) -> list[tuple]:
+        rules = []
+        for ng_word in db.query(NgWord).filter(NgWord.guild_id == guild_id).all():
+            pattern = None
+            if ng_word.match_type == 'regex':
+                try:
+                    pattern = re.compile(ng_word.word)
+                except re.error:
+                    # 正規表現が無効な場合はログに出力してスキップ
+                    logger.warning(f"Invalid regex for NG word (ID: {ng_word.id}): {ng_word.word}")
+                    continue
+            rules.append((ng_word.match_type, ng_word.word, pattern, ng_word.action))
+        self._rules[guild_id] = (time.monotonic(), rules)
+        return rules
+
+    def match(self, db: Session, guild_id: str, content: str) -> tuple[bool, str | None]:
+        cached = self._rules.get(guild_id)
+        if cached is None or time.monotonic() - cached[0] > self.refresh_interval:
+            rules = self._load(db, guild_id)
+        else:
+            rules = cached[1]
+        for match_type, word, pattern, action in rules:
+            if match_type == 'exact':
+                is_match = word == content
+            elif match_type == 'regex':
+                is_match = pattern.search(content) is not None
+            else:  # partial (default)
+                is_match = word in content
+            if is_match:
+                return True, action
+        return False, None
+
+
+ban_index = BanIndex()
+ng_word_matcher = NgWordMatcher()
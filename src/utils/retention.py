@@ -0,0 +1,171 @@
+import os
+import time
+import asyncio
+import logging
+import datetime
+
+from sqlalchemy.orm import Session
+
+from cogs.config import DEFAULT_SETTINGS
+from database import SessionLocal
+from models import AdminCommandLog, AnonIdMapping, BotLog, ConversionHistory, GuildSettings, RateLimit, UserCommandLog
+from utils.partitions import MonthlyPartitioner
+
+logger = logging.getLogger(__name__)
+
+# 1バッチで削除する行数と、バッチ間の待機時間(秒)
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", 1000))
+RETENTION_BATCH_SLEEP = float(os.getenv("RETENTION_BATCH_SLEEP", 0.2))
+
+
+class RetentionPolicy:
+    """テーブルごとの保持ポリシー
+
+    settings_key が指定されている場合はギルド設定の値(日数)を使い、
+    指定されていない場合は default_days を全ギルド共通で適用する。
+    partitioner が指定され、テーブルがパーティション化されている場合は
+    行ではなくパーティション単位で削除する。
+    日数が0以下の場合は無期限に保持する (min_days が指定されている場合はその日数に切り上げる)。
+    """
+    def __init__(self, model, time_column: str, default_days: int, settings_key: str | None = None, margin_days: int = 0, partitioner: MonthlyPartitioner | None = None, min_days: int | None = None):
+        self.model = model
+        self.time_column = time_column
+        self.default_days = default_days
+        self.settings_key = settings_key
+        self.margin_days = margin_days
+        self.partitioner = partitioner
+        self.min_days = min_days
+
+    def effective_days(self, days: int) -> int | None:
+        """保持日数 (余裕分を含む) を返す。無期限に保持する場合は None"""
+        if self.min_days is not None:
+            days = max(days, self.min_days)
+        if days <= 0:
+            return None
+        return days + self.margin_days
+
+    @property
+    def table_name(self) -> str:
+        return self.model.__tablename__
+
+    @property
+    def is_per_guild(self) -> bool:
+        return self.settings_key is not None
+
+
+def default_policies() -> list[RetentionPolicy]:
+    """既定の保持ポリシー一覧"""
+    log_days = DEFAULT_SETTINGS['log_retention_days']
+    return [
+        RetentionPolicy(BotLog, 'created_at', int(os.getenv("BOT_LOG_RETENTION_DAYS", 365)), partitioner=MonthlyPartitioner(BotLog.__tablename__)),
+        RetentionPolicy(RateLimit, 'timestamp', int(os.getenv("RATE_LIMIT_RETENTION_DAYS", 1))),
+        # IDのローテーション日数は0以下でも1日として扱われるため、無期限にはしない
+        RetentionPolicy(AnonIdMapping, 'created_at', 1, settings_key='id_rotation_days', margin_days=1, min_days=1),
+        RetentionPolicy(UserCommandLog, 'created_at', log_days, settings_key='log_retention_days'),
+        RetentionPolicy(AdminCommandLog, 'created_at', log_days, settings_key='log_retention_days'),
+        RetentionPolicy(ConversionHistory, 'created_at', log_days, settings_key='log_retention_days'),
+    ]
+
+
+class RetentionEngine:
+    """保持期間を過ぎた行をキーセット方式のバッチで削除する"""
+
+    def __init__(self, policies: list[RetentionPolicy] | None = None, batch_size: int = RETENTION_BATCH_SIZE, batch_sleep: float = RETENTION_BATCH_SLEEP):
+        self.policies = policies if policies is not None else default_policies()
+        self.batch_size = batch_size
+        self.batch_sleep = batch_sleep
+
+    def _guild_days(self, db: Session, policy: RetentionPolicy) -> dict[str, int | None]:
+        """ギルドごとの保持日数を取得する (無期限の場合は None)"""
+        guild_days = {}
+        for guild_id, settings in db.query(GuildSettings.guild_id, GuildSettings.settings).all():
+            try:
+                days = int((settings or {}).get(policy.settings_key, policy.default_days))
+            except (TypeError, ValueError):
+                days = policy.default_days
+            guild_days[guild_id] = policy.effective_days(days)
+        return guild_days
+
+    def _delete_batch(self, db: Session, policy: RetentionPolicy, predicates: list, last_id: int) -> tuple[int, int | None]:
+        """id昇順で1バッチ分を削除し、(削除件数, 最後のid) を返す"""
+        model = policy.model
+        ids = [row.id for row in db.query(model.id).filter(*predicates, model.id > last_id).order_by(model.id).limit(self.batch_size)]
+        if not ids:
+            return 0, None
+        deleted = db.query(model).filter(model.id.in_(ids)).delete(synchronize_session=False)
+        db.commit()
+        return deleted, ids[-1]
+
+    async def _purge(self, db: Session, policy: RetentionPolicy, predicates: list) -> int:
+        total = 0
+        last_id = 0
+        while True:
+            deleted, last_id = self._delete_batch(db, policy, predicates, last_id)
+            total += deleted
+            if last_id is None:
+                return total
+            await asyncio.sleep(self.batch_sleep)
+
+    async def run_policy(self, db: Session, policy: RetentionPolicy) -> int:
+        """1つのポリシーを適用し、削除件数を返す"""
+        model = policy.model
+        time_column = getattr(model, policy.time_column)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        default_days = policy.effective_days(policy.default_days)
+
+        if policy.partitioner and policy.partitioner.is_partitioned(db):
+            # 先のパーティションを用意してから、期限切れのパーティションを丸ごと削除する
+            policy.partitioner.ensure_partitions(db, now)
+            if default_days is None:
+                return 0
+            cutoff = now - datetime.timedelta(days=default_days)
+            _, rows = policy.partitioner.drop_partitions_before(db, cutoff)
+            return rows
+
+        if not policy.is_per_guild:
+            if default_days is None:
+                return 0
+            cutoff = now - datetime.timedelta(days=default_days)
+            return await self._purge(db, policy, [time_column < cutoff])
+
+        guild_days = self._guild_days(db, policy)
+        # 同じ保持日数のギルドをまとめて1つの条件で削除する
+        guilds_by_days: dict[int, list[str]] = {}
+        for guild_id, days in guild_days.items():
+            if days is not None:
+                guilds_by_days.setdefault(days, []).append(guild_id)
+
+        total = 0
+        for days, guild_ids in guilds_by_days.items():
+            cutoff = now - datetime.timedelta(days=days)
+            total += await self._purge(db, policy, [model.guild_id.in_(guild_ids), time_column < cutoff])
+
+        # 設定行のないギルドには既定値を適用する
+        if default_days is None:
+            return total
+        cutoff = now - datetime.timedelta(days=default_days)
+        predicates = [time_column < cutoff]
+        if guild_days:
+            predicates.append(model.guild_id.notin_(list(guild_days)))
+        total += await self._purge(db, policy, predicates)
+        return total
+
+    async def run(self) -> dict:
+        """全ポリシーを適用し、テーブルごとの削除件数と所要時間を返す"""
+        report = {}
+        db = SessionLocal()
+        try:
+            for policy in self.policies:
+                started = time.perf_counter()
+                try:
+                    deleted = await self.run_policy(db, policy)
+                except Exception as e:
+                    db.rollback()
+                    logger.error(f"Retention failed for {policy.table_name}: {e}", exc_info=True)
+                    deleted = None
+                elapsed = time.perf_counter() - started
+                report[policy.table_name] = {'deleted': deleted, 'seconds': round(elapsed, 3)}
+                logger.info(f"Retention {policy.table_name}: deleted={deleted} time={elapsed:.3f}s")
+        finally:
+            db.close()
+        return report
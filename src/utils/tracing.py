@@ -0,0 +1,219 @@
+import os
+import json
+import time
+import heapq
+import random
+import asyncio
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# 出力先(どちらも未設定ならエクスポートしない)
+TRACE_EXPORT_FILE = os.getenv("TRACE_EXPORT_FILE")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT")  # 例: http://localhost:4318/v1/traces
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 1.0))
+# この時間(ms)を超えたトレースは内訳をログに出力する
+TRACE_SLOW_THRESHOLD_MS = float(os.getenv("TRACE_SLOW_THRESHOLD_MS", 2000))
+TRACE_SLOW_KEEP = int(os.getenv("TRACE_SLOW_KEEP", 20))
+
+SERVICE_NAME = "anonymous-bot"
+
+_current_trace: contextvars.ContextVar["Trace | None"] = contextvars.ContextVar("current_trace", default=None)
+_current_span: contextvars.ContextVar["Span | None"] = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ('name', 'span_id', 'parent_id', 'start_ns', 'end_ns', 'attributes', 'error')
+
+    def __init__(self, name: str, parent_id: str | None, attributes: dict):
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.error = None
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def to_otlp(self, trace_id: str) -> dict:
+        span = {
+            "traceId": trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": [{"key": k, "value": {"stringValue": str(v)}} for k, v in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class Trace:
+    """1回のインタラクションに対応するトレース"""
+
+    def __init__(self, name: str, attributes: dict):
+        self.trace_id = os.urandom(16).hex()
+        self.root = Span(name, None, attributes)
+        self.spans: list[Span] = [self.root]
+        self._tokens = None
+
+    @property
+    def name(self) -> str:
+        return self.root.name
+
+    @property
+    def duration_ms(self) -> float:
+        return self.root.duration_ms
+
+    def breakdown(self) -> str:
+        """ステージごとの所要時間を1行にまとめる"""
+        stages = ", ".join(f"{s.name}={s.duration_ms:.1f}ms" for s in self.spans[1:])
+        return f"{self.name} {self.duration_ms:.1f}ms [{stages}]"
+
+    def to_otlp(self) -> dict:
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+                "scopeSpans": [{
+                    "scope": {"name": __name__},
+                    "spans": [s.to_otlp(self.trace_id) for s in self.spans],
+                }],
+            }]
+        }
+
+
+class Tracer:
+    def __init__(self, sample_rate: float = TRACE_SAMPLE_RATE, slow_threshold_ms: float = TRACE_SLOW_THRESHOLD_MS, slow_keep: int = TRACE_SLOW_KEEP):
+        self.sample_rate = sample_rate
+        self.slow_threshold_ms = slow_threshold_ms
+        self.slow_keep = slow_keep
+        self._slowest: list[tuple[float, str, str]] = []  # (duration_ms, trace_id, breakdown) の最小ヒープ
+        self._export_tasks: set[asyncio.Task] = set()
+        self._file_lock = threading.Lock()
+        # コレクタへの接続は使い回す (bot.close() で閉じる)
+        self._session: aiohttp.ClientSession | None = None
+
+    def start(self, name: str, **attributes) -> Trace:
+        """トレースを開始し、現在のコンテキストに設定する"""
+        trace = Trace(name, attributes)
+        trace._tokens = (_current_trace.set(trace), _current_span.set(trace.root))
+        return trace
+
+    def end(self, trace: Trace, error: BaseException | None = None):
+        """トレースを終了する。サンプリング対象外でも遅いトレースの記録は行う"""
+        trace.root.end_ns = time.time_ns()
+        if error is not None:
+            trace.root.error = type(error).__name__
+        if trace._tokens:
+            trace_token, span_token = trace._tokens
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+            trace._tokens = None
+        self._finish(trace)
+
+    @contextmanager
+    def trace(self, name: str, **attributes):
+        trace = self.start(name, **attributes)
+        try:
+            yield trace
+        except BaseException as e:
+            self.end(trace, e)
+            raise
+        else:
+            self.end(trace)
+
+    def _finish(self, trace: Trace):
+        duration = trace.duration_ms
+        if len(self._slowest) < self.slow_keep:
+            heapq.heappush(self._slowest, (duration, trace.trace_id, trace.breakdown()))
+        elif duration > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, (duration, trace.trace_id, trace.breakdown()))
+
+        if duration >= self.slow_threshold_ms:
+            logger.warning(f"Slow trace {trace.trace_id}: {trace.breakdown()}")
+
+        if random.random() < self.sample_rate:
+            self.export(trace)
+
+    def slowest(self) -> list[tuple[float, str, str]]:
+        """記録されている最も遅いトレースを遅い順に返す"""
+        return sorted(self._slowest, reverse=True)
+
+    def export(self, trace: Trace):
+        """OpenTelemetry(OTLP/JSON)形式でファイルまたはコレクタに出力する (イベントループは待たせない)"""
+        if not TRACE_EXPORT_FILE and not TRACE_OTLP_ENDPOINT:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        task = loop.create_task(self._export(trace.to_otlp()))
+        self._export_tasks.add(task)
+        task.add_done_callback(self._export_tasks.discard)
+
+    async def _export(self, payload: dict):
+        if TRACE_EXPORT_FILE:
+            await asyncio.to_thread(self._write_file, json.dumps(payload, ensure_ascii=False) + "\n")
+        if TRACE_OTLP_ENDPOINT:
+            await self._post_otlp(payload)
+
+    def _write_file(self, line: str):
+        try:
+            # 複数のスレッドから書き込んでも行が混ざらないようにする
+            with self._file_lock, open(TRACE_EXPORT_FILE, 'a', encoding='utf-8') as f:
+                f.write(line)
+        except OSError as e:
+            logger.warning(f"Failed to write trace export file: {e}")
+
+    async def _post_otlp(self, payload: dict):
+        try:
+            if self._session is None or self._session.closed:
+                self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5))
+            async with self._session.post(TRACE_OTLP_ENDPOINT, json=payload) as resp:
+                if resp.status >= 400:
+                    logger.warning(f"OTLP collector returned {resp.status}")
+        except Exception as e:
+            logger.warning(f"Failed to export trace to collector: {e}")
+
+    async def close(self):
+        """出力中のトレースを待ち、コレクタへの接続を閉じる"""
+        if self._export_tasks:
+            await asyncio.gather(*self._export_tasks, return_exceptions=True)
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """現在のトレースに子スパンを追加する(トレース外では何もしない)"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+    parent = _current_span.get()
+    child = Span(name, parent.span_id if parent else None, attributes)
+    trace.spans.append(child)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.error = type(e).__name__
+        raise
+    finally:
+        child.end_ns = time.time_ns()
+        _current_span.reset(token)
+
+
+tracer = Tracer()
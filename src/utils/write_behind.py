@@ -0,0 +1,111 @@
+import os
+import asyncio
+import logging
+import datetime
+from collections import Counter
+
+from sqlalchemy import insert
+
+from database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# 作成時刻を記録するカラム名(バッファ投入時点の時刻を入れる)
+TIME_COLUMNS = ('created_at', 'timestamp')
+
+
+class WriteBehindBuffer:
+    """遅延書き込みバッファ
+
+    監査ログ・コマンドログなど、即時性が不要な行をメモリに溜め、
+    一定間隔でテーブルごとに複数行INSERTでまとめて書き込む。
+    """
+
+    def __init__(self, flush_interval: float = 0.3, max_rows: int = 10000, max_batch: int = 1000):
+        self.flush_interval = flush_interval
+        self.max_rows = max_rows
+        self.max_batch = max_batch
+        self._rows: list[tuple] = []
+        self._task: asyncio.Task | None = None
+        self._wakeup: asyncio.Event | None = None
+        self.overflow = Counter()
+        self.failed = Counter()
+        self.written = Counter()
+
+    def add(self, model, **values):
+        """行をバッファに追加する(DBへの書き込みは待たない)"""
+        table_name = model.__tablename__
+        if len(self._rows) >= self.max_rows:
+            self.overflow[table_name] += 1
+            if self.overflow[table_name] in (1, 100) or self.overflow[table_name] % 1000 == 0:
+                logger.warning(f"Write-behind buffer full, dropped {self.overflow[table_name]} row(s) for {table_name}")
+            return
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for column in TIME_COLUMNS:
+            if column in model.__table__.c and column not in values:
+                values[column] = now
+        self._rows.append((model, values))
+        self._ensure_started()
+        if len(self._rows) >= self.max_batch:
+            self._wakeup.set()
+
+    def pending(self) -> int:
+        return len(self._rows)
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        while self._rows:
+            batch, self._rows = self._rows[:self.max_batch], self._rows[self.max_batch:]
+            await asyncio.to_thread(self._write, batch)
+
+    def _write(self, batch: list[tuple]):
+        # モデルとカラム構成ごとにまとめて executemany (複数行INSERT) する
+        groups: dict[tuple, list[dict]] = {}
+        for model, values in batch:
+            groups.setdefault((model, frozenset(values)), []).append(values)
+
+        db = SessionLocal()
+        try:
+            for (model, _), rows in groups.items():
+                db.execute(insert(model), rows)
+            db.commit()
+            for (model, _), rows in groups.items():
+                self.written[model.__tablename__] += len(rows)
+        except Exception as e:
+            db.rollback()
+            for (model, _), rows in groups.items():
+                self.failed[model.__tablename__] += len(rows)
+            logger.error(f"Failed to flush write-behind buffer ({len(batch)} rows): {e}")
+        finally:
+            db.close()
+
+    async def close(self):
+        """フラッシュタスクを停止し、残りの行をすべて書き込む"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+write_behind = WriteBehindBuffer(
+    flush_interval=float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", 0.3)),
+    max_rows=int(os.getenv("WRITE_BEHIND_MAX_ROWS", 10000)),
+)